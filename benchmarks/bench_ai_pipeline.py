@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timezone
+from unittest import mock
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "benchmark-token")
+
+import poopbot  # noqa: E402
+
+
+BOT_USER_ID = 123
+CHANNEL_ID = 4242
+HISTORY_SIZES = [100, 1000, 10000]
+ROUNDS = 30
+OPENAI_LATENCY_MS = 50
+PREVIEW_PAGE_COUNT = 50
+
+
+class FakeChannel:
+    def __init__(self, messages_oldest_first):
+        self.id = CHANNEL_ID
+        self.messages_oldest_first = messages_oldest_first
+
+    async def history(self, limit=None, before=None, after=None, oldest_first=False):
+        before_id = getattr(before, "id", None)
+        after_id = getattr(after, "id", None)
+        yielded = 0
+        for message in reversed(self.messages_oldest_first):
+            if before_id is not None and message.id >= before_id:
+                continue
+            if after_id is not None and message.id <= after_id:
+                return
+            if limit is not None and yielded >= limit:
+                return
+            yielded += 1
+            yield message
+
+
+class FakeResponses:
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.latency_seconds)
+        text = "Benchmark reply with a few words in it."
+        usage = types.SimpleNamespace(
+            input_tokens=2000,
+            input_tokens_details=types.SimpleNamespace(cached_tokens=1024),
+        )
+        final = types.SimpleNamespace(output_text=text, status="completed", output=[], usage=usage)
+        if not kwargs.get("stream"):
+            return final
+
+        async def stream():
+            for word in text.split(" "):
+                await asyncio.sleep(self.latency_seconds / 20)
+                yield types.SimpleNamespace(type="response.output_text.delta", delta=word + " ")
+            yield types.SimpleNamespace(type="response.completed", response=final)
+
+        return stream()
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, latency_seconds: float):
+        self.responses = FakeResponses(latency_seconds)
+
+
+def make_message(message_id: int, channel: FakeChannel, content: str, author: str, attachments=None, embeds=None):
+    return types.SimpleNamespace(
+        id=message_id,
+        content=content,
+        attachments=attachments or [],
+        embeds=embeds or [],
+        webhook_id=None,
+        edited_at=None,
+        author=types.SimpleNamespace(display_name=author),
+        channel=channel,
+        guild=types.SimpleNamespace(id=1),
+    )
+
+
+def build_history(size: int, preview_base_url: str) -> tuple[FakeChannel, list]:
+    rng = random.Random(size)
+    channel = FakeChannel([])
+    words = ["poop", "printer", "wordle", "queue", "song", "ticket", "lunch", "meeting", "cat", "deploy"]
+    messages = []
+    for index in range(size):
+        message_id = 1_000_000 + index
+        author = f"user{index % 17}"
+        content = " ".join(rng.choice(words) for _ in range(rng.randint(3, 40)))
+        attachments = []
+        embeds = []
+        kind = index % 20
+        if kind == 0:
+            content += f" {preview_base_url}/page/{index % PREVIEW_PAGE_COUNT}"
+        elif kind == 5:
+            attachments.append(
+                types.SimpleNamespace(
+                    url=f"https://cdn.discordapp.com/attachments/1/{index}.png",
+                    content_type="image/png",
+                    filename=f"{index}.png",
+                )
+            )
+        elif kind == 10:
+            embeds.append(types.SimpleNamespace(title=f"Embed {index}", description="An embedded card", image=None))
+        elif kind == 15:
+            content = f"<@{BOT_USER_ID}> {content}"
+        messages.append(make_message(message_id, channel, content, author, attachments, embeds))
+    channel.messages_oldest_first = messages
+    return channel, messages
+
+
+async def start_preview_stub() -> tuple[web.AppRunner, str]:
+    async def page(request):
+        number = request.match_info["number"]
+        head = (
+            f"<title>Stub page {number}</title>"
+            f'<meta property="og:title" content="Stub page {number}">'
+            f'<meta property="og:description" content="Description for stub page {number}">'
+        )
+        body = "<p>filler</p>" * 2000
+        return web.Response(text=f"<html><head>{head}</head><body>{body}</body></html>", content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/page/{number}", page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def reset_ai_state():
+    poopbot.ai_context_buffers.clear()
+    poopbot.ai_reply_cache.clear()
+    poopbot.ai_inflight_replies.clear()
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def bench_history_size(size: int, rounds: int, preview_base_url: str) -> dict[str, list[float]]:
+    channel, history = build_history(size, preview_base_url)
+    samples: dict[str, list[float]] = {}
+
+    for round_index in range(rounds):
+        reset_ai_state()
+        mention = make_message(
+            2_000_000 + round_index,
+            channel,
+            f"<@{BOT_USER_ID}> what did I miss? {preview_base_url}/page/{round_index % PREVIEW_PAGE_COUNT}",
+            "asker",
+        )
+
+        started_at = time.perf_counter()
+        context_entries, current_entry = await poopbot.fetch_ai_context_entries(mention, BOT_USER_ID)
+        samples.setdefault("fetch context (cold)", []).append((time.perf_counter() - started_at) * 1000)
+
+        started_at = time.perf_counter()
+        for message in history[-poopbot.AI_CONTEXT_BUFFER_MAX_MESSAGES_PER_CHANNEL:]:
+            poopbot.record_ai_context_message(message, BOT_USER_ID)
+        samples.setdefault("gateway ingest", []).append((time.perf_counter() - started_at) * 1000)
+
+        started_at = time.perf_counter()
+        await poopbot.fetch_ai_context_entries(mention, BOT_USER_ID)
+        samples.setdefault("fetch context (warm)", []).append((time.perf_counter() - started_at) * 1000)
+
+        buffer = poopbot.get_ai_context_buffer(CHANNEL_ID)
+        current_base_entry = poopbot.build_ai_context_base_entry(mention, strip_bot_mention_id=BOT_USER_ID)
+        buffered_newest_first = [item for item in reversed(buffer.messages.values()) if item.message_id < mention.id]
+        poopbot.ai_token_count_cache.clear()
+        started_at = time.perf_counter()
+        poopbot.select_ai_context_entries(
+            poopbot.iter_ai_context_base_entries(buffered_newest_first),
+            current_base_entry,
+        )
+        samples.setdefault("select entries (cold counts)", []).append((time.perf_counter() - started_at) * 1000)
+
+        started_at = time.perf_counter()
+        conversation_prompt = poopbot.build_ai_conversation_prompt(context_entries, current_entry)
+        samples.setdefault("build prompt", []).append((time.perf_counter() - started_at) * 1000)
+
+        partials = []
+
+        async def on_partial_text(text):
+            partials.append(text)
+
+        started_at = time.perf_counter()
+        await poopbot.request_ai_reply(
+            conversation_prompt,
+            image_urls=[],
+            on_partial_text=on_partial_text,
+            guild_id=1,
+        )
+        samples.setdefault("request reply (fake client)", []).append((time.perf_counter() - started_at) * 1000)
+
+    return samples
+
+
+async def run(sizes: list[int], rounds: int, latency_ms: float):
+    runner, preview_base_url = await start_preview_stub()
+    tmp_dir = tempfile.TemporaryDirectory()
+
+    async def allow_stub_host(hostname):
+        return hostname == "127.0.0.1"
+
+    patches = [
+        mock.patch.object(poopbot, "DB_DIR", tmp_dir.name),
+        mock.patch.object(poopbot, "AI_CACHE_DB_PATH", os.path.join(tmp_dir.name, "ai_cache.db")),
+        mock.patch.object(poopbot, "_is_public_fetch_host", allow_stub_host),
+    ]
+    for patch in patches:
+        patch.start()
+    poopbot.init_ai_cache_db()
+    poopbot.ai_client = FakeAsyncOpenAI(latency_ms / 1000)
+    try:
+        poopbot.ai_token_encoder = poopbot.load_token_encoder()
+    except Exception as exc:
+        print(f"tiktoken encoder unavailable ({exc}); token counts use the length estimate.")
+
+    print(
+        f"AI context pipeline, {rounds} rounds per size, fake OpenAI latency {latency_ms:.0f} ms, "
+        f"started {datetime.now(timezone.utc).isoformat(timespec='seconds')}"
+    )
+    try:
+        for size in sizes:
+            # Let the buffer and the history scan cover the whole synthetic history.
+            with mock.patch.object(poopbot, "AI_CONTEXT_HISTORY_SCAN_LIMIT", size), mock.patch.object(
+                poopbot,
+                "AI_CONTEXT_BUFFER_MAX_MESSAGES_PER_CHANNEL",
+                size,
+            ), mock.patch.object(poopbot, "AI_CONTEXT_BUFFER_MAX_TOTAL_MESSAGES", max(size, 10000)):
+                # The bot logs every preview fetch and request; keep the report readable.
+                with contextlib.redirect_stdout(io.StringIO()):
+                    samples = await bench_history_size(size, rounds, preview_base_url)
+
+            print(f"\n{size} messages")
+            print(f"  {'stage':30} {'p50 ms':>10} {'p95 ms':>10}")
+            for stage, stage_samples in samples.items():
+                print(f"  {stage:30} {percentile(stage_samples, 0.5):>10.3f} {percentile(stage_samples, 0.95):>10.3f}")
+    finally:
+        reset_ai_state()
+        poopbot.ai_client = None
+        if poopbot.http_session is not None:
+            await poopbot.http_session.close()
+            poopbot.http_session = None
+        for patch in patches:
+            patch.stop()
+        await runner.cleanup()
+        tmp_dir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AI context pipeline offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=HISTORY_SIZES)
+    parser.add_argument("--rounds", type=int, default=ROUNDS)
+    parser.add_argument("--latency-ms", type=float, default=OPENAI_LATENCY_MS)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.rounds, args.latency_ms))
+
+
+if __name__ == "__main__":
+    main()
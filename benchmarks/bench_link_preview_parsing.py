@@ -0,0 +1,148 @@
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "benchmark-token")
+
+import poopbot  # noqa: E402
+
+
+ROUNDS = 200
+
+
+# The regex extraction that link previews used before the single-pass head parser.
+def legacy_extract_meta_content(html_text: str, key: str) -> str | None:
+    patterns = [
+        rf'<meta[^>]+(?:property|name)=["\']{re.escape(key)}["\'][^>]+content=["\'](.*?)["\']',
+        rf'<meta[^>]+content=["\'](.*?)["\'][^>]+(?:property|name)=["\']{re.escape(key)}["\']',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, html_text, flags=re.IGNORECASE | re.DOTALL)
+        if match:
+            return poopbot.normalize_ai_summary_text(match.group(1))
+    return None
+
+
+def legacy_extract_title_and_description(html_text: str) -> tuple[str | None, str | None]:
+    title = (
+        legacy_extract_meta_content(html_text, "og:title")
+        or legacy_extract_meta_content(html_text, "twitter:title")
+    )
+    if not title:
+        title_match = re.search(r"<title[^>]*>(.*?)</title>", html_text, flags=re.IGNORECASE | re.DOTALL)
+        if title_match:
+            title = poopbot.normalize_ai_summary_text(title_match.group(1))
+
+    description = (
+        legacy_extract_meta_content(html_text, "og:description")
+        or legacy_extract_meta_content(html_text, "twitter:description")
+        or legacy_extract_meta_content(html_text, "description")
+    )
+    return title, description
+
+
+def build_page(name: str, head_extra: str, meta: str, body_size: int) -> tuple[str, bytes]:
+    body = "".join(
+        f'<div class="row"><a href="/item/{index}">Item {index}</a><p>{"lorem ipsum " * 12}</p></div>'
+        for index in range(body_size // 200)
+    )
+    page = (
+        "<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\">"
+        f"{head_extra}{meta}</head><body>{body}</body></html>"
+    )
+    return name, page.encode("utf-8")
+
+
+def synthetic_corpus() -> list[tuple[str, bytes]]:
+    inline_script = "<script>" + "var config = {\"key\": \"value\"};" * 400 + "</script>"
+    stylesheets = "".join(f'<link rel="stylesheet" href="/static/{index}.css">' for index in range(40))
+    return [
+        build_page(
+            "video page, large inline config",
+            inline_script * 3,
+            '<title>Video title - YouTube</title><meta name="description" content="Video description">'
+            '<meta property="og:title" content="Video title"><meta property="og:description" content="Video description">',
+            400_000,
+        ),
+        build_page(
+            "news article",
+            stylesheets,
+            '<title>Headline | News</title><meta content="Article summary" property="og:description">'
+            '<meta content="Headline" property="og:title">',
+            120_000,
+        ),
+        build_page(
+            "blog, twitter cards only",
+            stylesheets[:400],
+            '<title>Blog post</title><meta name="twitter:title" content="Blog post">'
+            '<meta name="twitter:description" content="Post teaser">',
+            60_000,
+        ),
+        build_page("bare page, title only", "", "<title>Plain page</title>", 20_000),
+        build_page("no metadata", inline_script, "", 90_000),
+    ]
+
+
+def load_corpus(paths: list[str]) -> list[tuple[str, bytes]]:
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as handle:
+            corpus.append((os.path.basename(path), handle.read()))
+    return corpus
+
+
+def legacy_bytes_read(page: bytes) -> int:
+    return min(len(page), poopbot.AI_LINK_PREVIEW_MAX_BYTES)
+
+
+def streamed_parse(page: bytes) -> tuple[int, tuple[str | None, str | None]]:
+    parser = poopbot.LinkPreviewHeadParser()
+    limit = min(len(page), poopbot.AI_LINK_PREVIEW_MAX_BYTES)
+    bytes_read = 0
+    for offset in range(0, limit, poopbot.HTTP_READ_CHUNK_BYTES):
+        chunk = page[offset:min(offset + poopbot.HTTP_READ_CHUNK_BYTES, limit)]
+        bytes_read += len(chunk)
+        if parser.feed_text(chunk.decode("utf-8", errors="replace")):
+            break
+    return bytes_read, parser.title_and_description()
+
+
+def cpu_ms(func) -> float:
+    started_at = time.process_time()
+    for _ in range(ROUNDS):
+        func()
+    return (time.process_time() - started_at) * 1000 / ROUNDS
+
+
+def main():
+    corpus = load_corpus(sys.argv[1:]) if len(sys.argv) > 1 else synthetic_corpus()
+    if len(sys.argv) <= 1:
+        print("No HTML files given; using the synthetic corpus. Pass saved pages as arguments to use real ones.")
+
+    print(f"{'page':36} {'legacy bytes':>12} {'head bytes':>10} {'legacy cpu':>10} {'head cpu':>9}  same result")
+    totals = [0, 0, 0.0, 0.0]
+    for name, page in corpus:
+        legacy_text = page[:legacy_bytes_read(page)].decode("utf-8", errors="replace")
+        head_bytes, head_result = streamed_parse(page)
+        legacy_result = legacy_extract_title_and_description(legacy_text)
+        legacy_cpu = cpu_ms(lambda: legacy_extract_title_and_description(
+            page[:legacy_bytes_read(page)].decode("utf-8", errors="replace")
+        ))
+        head_cpu = cpu_ms(lambda: streamed_parse(page))
+
+        totals[0] += legacy_bytes_read(page)
+        totals[1] += head_bytes
+        totals[2] += legacy_cpu
+        totals[3] += head_cpu
+        print(
+            f"{name[:36]:36} {legacy_bytes_read(page):>12} {head_bytes:>10} "
+            f"{legacy_cpu:>8.3f}ms {head_cpu:>7.3f}ms  {'yes' if legacy_result == head_result else 'no'}"
+        )
+
+    print(f"{'total':36} {totals[0]:>12} {totals[1]:>10} {totals[2]:>8.3f}ms {totals[3]:>7.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
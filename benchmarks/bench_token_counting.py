@@ -0,0 +1,83 @@
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISCORD_TOKEN", "benchmark-token")
+
+import poopbot  # noqa: E402
+
+
+WINDOW_SIZE = 100
+ROUNDS = 200
+BATCH_SIZES = (4, 16, 64)
+
+
+def build_window(size: int) -> list[poopbot.AIContextEntry]:
+    entries = []
+    for index in range(size):
+        words = " ".join(f"word{(index * 7 + offset) % 97}" for offset in range(10 + index % 40))
+        entries.append(
+            poopbot.AIContextEntry(
+                author_name=f"user-{index % 12}",
+                text=f"message {index}: {words}",
+                message_id=1_000_000 + index,
+            )
+        )
+    return entries
+
+
+def time_rounds(func) -> float:
+    samples = []
+    for _ in range(ROUNDS):
+        started_at = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    try:
+        poopbot.ai_token_encoder = poopbot.load_token_encoder()
+    except Exception as exc:
+        print(f"tiktoken encoder failed to load: {exc}")
+    if poopbot.ai_token_encoder is None:
+        print("tiktoken encoder unavailable; nothing to benchmark.")
+        return
+
+    entries = build_window(WINDOW_SIZE)
+
+    def per_entry():
+        for entry in entries:
+            poopbot.count_text_tokens(poopbot.format_ai_context_entry(entry))
+
+    def batched_cold():
+        poopbot.ai_token_count_cache.clear()
+        poopbot.count_ai_context_entries_tokens(entries)
+
+    def batched_warm():
+        poopbot.count_ai_context_entries_tokens(entries)
+
+    per_entry_ms = time_rounds(per_entry)
+    cold_ms = time_rounds(batched_cold)
+    poopbot.count_ai_context_entries_tokens(entries)
+    warm_ms = time_rounds(batched_warm)
+
+    print(f"{WINDOW_SIZE}-message window, median of {ROUNDS} rounds")
+    print(f"  per-entry encode_ordinary:  {per_entry_ms:.3f} ms")
+    print(f"  batched, cold cache:        {cold_ms:.3f} ms")
+    print(f"  batched, warm cache:        {warm_ms:.3f} ms")
+
+    encoder = poopbot.ai_token_encoder
+    texts = [poopbot.format_ai_context_entry(entry) for entry in entries]
+    print("encode_ordinary loop vs encode_ordinary_batch(num_threads=2)")
+    for size in BATCH_SIZES:
+        batch = texts[:size]
+        loop_ms = time_rounds(lambda: [encoder.encode_ordinary(text) for text in batch])
+        threaded_ms = time_rounds(lambda: encoder.encode_ordinary_batch(batch, num_threads=2))
+        print(f"  {size:>3} texts: loop {loop_ms:.3f} ms, threaded {threaded_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
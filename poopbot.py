@@ -1,4 +1,6 @@
 from dotenv import load_dotenv
+import hashlib
+import heapq
 import html
 import ipaddress
 import os
@@ -8,18 +10,23 @@ import random
 import re
 import sqlite3
 import asyncio
+import codecs
+import contextlib
+import base64
+import io
 import socket
-import urllib.request
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 import json
 import xml.etree.ElementTree as ET
-from collections import deque
-from dataclasses import dataclass, field
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
 from datetime import datetime, timezone, date, time as dtime, timedelta
 from functools import partial
 import time
+from typing import Callable, Iterable, Iterator, Literal
 from urllib.parse import parse_qs
 
+import aiohttp
 from yt_dlp import YoutubeDL
 from yt_dlp.utils import DownloadError
 
@@ -27,15 +34,19 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 try:
-    from openai import APIConnectionError, APIError, AsyncOpenAI, RateLimitError
+    from openai import APIConnectionError, APIError, APIStatusError, AsyncOpenAI, RateLimitError, Timeout
     OPENAI_IMPORT_ERROR = None
 except ImportError as exc:
     AsyncOpenAI = None
+    Timeout = None
     OPENAI_IMPORT_ERROR = exc
 
     class APIError(Exception):
         pass
 
+    class APIStatusError(APIError):
+        pass
+
     class APIConnectionError(Exception):
         pass
 
@@ -48,6 +59,12 @@ except ImportError as exc:
     encoding_for_model = None
     get_encoding = None
     TIKTOKEN_IMPORT_ERROR = exc
+try:
+    from PIL import Image
+    PIL_IMPORT_ERROR = None
+except ImportError as exc:
+    Image = None
+    PIL_IMPORT_ERROR = exc
 
 try:
     from zoneinfo import ZoneInfo
@@ -66,6 +83,7 @@ DB_DIR = "db"
 CONFIG_DB_PATH = os.path.join(DB_DIR, "poopbot_config.db")
 CLEANUP_DB_PATH = os.path.join(DB_DIR, "poopbot_cleanup.db")
 WORDLE_DB_PATH = os.path.join(DB_DIR, "poopbot_wordle.db")
+AI_CACHE_DB_PATH = os.path.join(DB_DIR, "poopbot_ai_cache.db")
 
 WORDLE_CROWN_EMOJI = "\U0001f451"
 WORDLE_GREEN_BLOCK = "\U0001f7e9"
@@ -86,6 +104,8 @@ TICKET_DEV_USER_ID = os.getenv("TICKET_DEV_USER_ID")
 TICKET_ARCHIVE_CHANNEL_ID = os.getenv("TICKET_ARCHIVE_CHANNEL_ID")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = (os.getenv("OPENAI_MODEL") or "gpt-5-mini").strip() or "gpt-5-mini"
+# Small prompts are only routed to a cheaper model when one is configured explicitly.
+OPENAI_FAST_MODEL = (os.getenv("OPENAI_FAST_MODEL") or "").strip()
 
 # Daily post time (12:00am Pacific)
 TZ_NAME = "America/Los_Angeles"
@@ -94,19 +114,106 @@ TZ_NAME = "America/Los_Angeles"
 ROTATE_EVERY = 10
 AI_CONTEXT_TOKEN_BUDGET = 2500
 AI_CONTEXT_HISTORY_SCAN_LIMIT = 100
+AI_CONTEXT_BUFFER_MAX_MESSAGES_PER_CHANNEL = AI_CONTEXT_HISTORY_SCAN_LIMIT
+AI_CONTEXT_BUFFER_MAX_CHANNELS = 250
+AI_CONTEXT_BUFFER_MAX_TOTAL_MESSAGES = 10000
+AI_PROMPT_CACHE_STABLE_WINDOW = True
+AI_PROMPT_CACHE_WINDOW_SLACK_TOKENS = 600
+AI_RESET_MARKER_MEMORY_CACHE_SIZE = 1000
+AI_CHANNEL_SUMMARIES = False
+AI_SUMMARY_CONTEXT_TOKEN_BUDGET = 1500
+AI_SUMMARY_REFRESH_MIN_MESSAGES = 15
+AI_SUMMARY_MAX_OUTPUT_TOKENS = 500
+AI_SUMMARY_MAX_CHARS = 1500
+AI_SUMMARY_MEMORY_CACHE_SIZE = 250
+AI_SUMMARY_SCHEDULER_WAIT_SECONDS = 60
 AI_MAX_OUTPUT_TOKENS = 220
 AI_RETRY_MAX_OUTPUT_TOKENS = 600
+AI_OUTPUT_BUDGET_HISTORY_SIZE = 200
+AI_OUTPUT_BUDGET_MIN_SAMPLES = 20
+AI_OUTPUT_BUDGET_PERCENTILE = 0.95
+AI_OUTPUT_BUDGET_HEADROOM = 1.15
+AI_HEDGE_REQUESTS = False
+AI_HEDGE_PERCENTILE = 0.95
+AI_HEDGE_MIN_SAMPLES = 20
+AI_HEDGE_MAX_RATE = 0.1
+AI_HEDGE_HISTORY_SIZE = 200
 AI_DIAGNOSTIC_MAX_OUTPUT_TOKENS = 20
+AI_HEALTH_PROBE_INTERVAL_MINUTES = 15
+AI_HEALTH_PROBE_HISTORY_SIZE = 24
+AI_HEALTH_PROBE_LATENCY_BUCKETS_MS = (500, 1000, 2000, 5000)
+AI_USAGE_LEDGER = True
+AI_USAGE_FLUSH_BATCH_SIZE = 25
+AI_USAGE_FLUSH_INTERVAL_SECONDS = 60
+AI_USAGE_MAX_PENDING = 1000
+AI_USAGE_RETENTION_DAYS = 90
+AI_USAGE_REPORT_DEFAULT_DAYS = 7
+AI_USAGE_REPORT_ROWS = 15
+AI_USAGE_GROUP_COLUMNS = {"user": "user_id", "channel": "channel_id", "guild": "guild_id", "day": "day"}
 AI_MAX_REPLY_CHARS = 1800
+DISCORD_MESSAGE_MAX_CHARS = 2000
+AI_STREAM_REPLIES = True
+AI_STREAM_EDIT_INTERVAL_SECONDS = 1.5
+AI_LATENCY_HISTORY_SIZE = 50
+AI_REPLY_CACHE_TTL_SECONDS = 30
+AI_REPLY_CACHE_SIZE = 64
+AI_COALESCE_MENTIONS = False
+AI_COALESCE_WINDOW_SECONDS = 2.0
+AI_SCHEDULER_MAX_CONCURRENCY = 4
+AI_SCHEDULER_MAX_QUEUE_DEPTH = 20
+AI_SCHEDULER_MAX_WAIT_SECONDS = 20
+AI_SCHEDULER_GUILD_WEIGHTS: dict[int, float] = {}
+# Checked in order; the first tier whose limits all fit wins, and the last tier catches everything else.
+# max_prompt_tokens covers the instructions plus the conversation prompt.
+AI_MODEL_TIERS = [
+    *(
+        [{"name": "fast", "model": OPENAI_FAST_MODEL, "max_prompt_tokens": 1000, "max_images": 0, "max_previews": 0}]
+        if OPENAI_FAST_MODEL
+        else []
+    ),
+    {"name": "default", "model": OPENAI_MODEL},
+]
+# The SDK defaults (600s timeout, 2 retries) would hold a mention for minutes per failure.
+AI_OPENAI_TIMEOUT_SECONDS = 30
+AI_OPENAI_CONNECT_TIMEOUT_SECONDS = 5
+AI_OPENAI_MAX_RETRIES = 1
+AI_CIRCUIT_FAILURE_THRESHOLD = 3
+AI_CIRCUIT_OPEN_SECONDS = 30
+AI_CIRCUIT_HISTORY_SIZE = 5
 AI_REASONING_EFFORT = "minimal"
 AI_TEXT_VERBOSITY = "low"
 AI_CONTEXT_IMAGE_LIMIT = 4
 AI_CONTEXT_LINK_PREVIEW_LIMIT = 5
+AI_LINK_PREVIEW_TOKEN_ESTIMATE = 80
+AI_IMAGE_PREPROCESSING = True
+AI_IMAGE_MAX_DIMENSION = 512
+AI_IMAGE_MAX_PIXELS = 40_000_000
+AI_IMAGE_JPEG_QUALITY = 80
+AI_IMAGE_MAX_DOWNLOAD_BYTES = 10 * 1024 * 1024
+AI_IMAGE_DOWNLOAD_TIMEOUT_SECONDS = 8
+AI_IMAGE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+AI_IMAGE_URL_CACHE_SIZE = 1024
+AI_TOKEN_COUNT_CACHE_SIZE = 4096
+AI_TOKEN_COUNT_BATCH_SIZE = 16
 AI_LINK_PREVIEW_TIMEOUT_SECONDS = 8
 AI_LINK_PREVIEW_MAX_BYTES = 65536
+AI_LINK_PREVIEW_CONCURRENCY = 4
+AI_LINK_PREVIEW_DEADLINE_SECONDS = 3
+AI_DNS_CACHE_TTL_SECONDS = 300
+AI_DNS_NEGATIVE_CACHE_TTL_SECONDS = 60
+AI_DNS_CACHE_SIZE = 1024
+AI_LINK_PREVIEW_CACHE_TTL_SECONDS = 24 * 60 * 60
+AI_LINK_PREVIEW_NEGATIVE_CACHE_TTL_SECONDS = 60 * 60
+AI_LINK_PREVIEW_TRANSIENT_CACHE_TTL_SECONDS = 2 * 60
+AI_LINK_PREVIEW_DB_PRUNE_INTERVAL_SECONDS = 10 * 60
+AI_LINK_PREVIEW_MEMORY_CACHE_SIZE = 512
+AI_LINK_PREVIEW_DB_CACHE_SIZE = 5000
 AI_RATE_LIMIT_WINDOW_SECONDS = 60
 AI_RATE_LIMIT_MAX_REQUESTS = 5
 AI_RATE_LIMIT_TIMEOUT_SECONDS = 5 * 60
+AI_RATE_LIMIT_MAX_TRACKED_USERS = 5000
+AI_RATE_LIMIT_SWEEP_MINUTES = 1
+AI_RATE_LIMIT_PERSIST_TIMEOUTS = True
 AI_SENTIENCE_START_DATE = date(2026, 3, 10)
 AI_BASE_SYSTEM_PROMPT = (
     "You are PoopBot. A discord bot that people use to prompt and mess with."
@@ -148,11 +255,20 @@ AI_SENTIENCE_INCREMENTS = {
 AI_NOT_CONFIGURED_MESSAGE = "AI replies are not configured yet."
 AI_TIMEOUT_MESSAGE = "Too many prompts in a minute. Try again in 5 minutes."
 AI_RATE_LIMIT_MESSAGE = "I’m a little busy right now. Try again in a moment."
+AI_BUSY_MESSAGE = "Too many people are asking me things right now. Try again in a minute."
 AI_ERROR_MESSAGE = "I hit an error trying to answer that. Try again in a moment."
+AI_UNAVAILABLE_MESSAGE = "I can't reach my brain right now. Try again in a minute."
 AI_EMPTY_RESPONSE_MESSAGE = "I don't have a reply for that yet."
 AI_RESET_MESSAGE = "Context reset. Future prompts will ignore anything earlier in this channel."
+AI_SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a Discord channel for a chat bot. "
+    "Merge the previous summary with the new messages into one updated summary. "
+    "Keep who said what, open questions, running jokes, and facts people shared. "
+    "Drop greetings and filler. Write plain sentences, no lists, under 200 words."
+)
 AI_URL_PATTERN = re.compile(r"https?://\S+", re.IGNORECASE)
 AI_IMAGE_FILE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+AI_DISCORD_CDN_HOSTS = {"cdn.discordapp.com", "media.discordapp.net"}
 
 
 class AIConfigurationError(RuntimeError):
@@ -167,11 +283,94 @@ class AIIncompleteResponseError(RuntimeError):
     pass
 
 
+class AIStreamError(RuntimeError):
+    pass
+
+
+class AISchedulerBusyError(RuntimeError):
+    pass
+
+
+class AICircuitOpenError(RuntimeError):
+    pass
+
+
 @dataclass
 class AIContextEntry:
     author_name: str
     text: str
     image_urls: list[str] = field(default_factory=list)
+    link_urls: list[str] = field(default_factory=list)
+    message_id: int | None = None
+    edited_at: datetime | None = None
+    link_preview_count: int = 0
+
+
+@dataclass
+class AIPreparedImage:
+    data_url: str
+    width: int
+    height: int
+    token_estimate: int
+
+
+@dataclass
+class AIUsageRecord:
+    kind: str                                     # 'mention' or 'summary'
+    guild_id: int | None
+    channel_id: int | None
+    user_id: int | None
+    model: str
+    source: str = "none"                          # 'upstream', 'cache', 'joined' or 'none'
+    ok: bool = False
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    image_count: int = 0
+    retry_count: int = 0
+    context_ms: float | None = None
+    images_ms: float | None = None
+    queue_ms: float | None = None
+    first_text_ms: float | None = None
+    total_ms: float = 0.0
+    requested_at: float | None = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(LOCAL_TZ))
+
+
+@dataclass
+class AIRateLimitBucket:
+    prompt_times: deque[float] = field(default_factory=lambda: deque(maxlen=AI_RATE_LIMIT_MAX_REQUESTS))
+    timeout_until: float = 0.0
+
+
+@dataclass
+class AIStreamedResponse:
+    output_text: str
+    status: str | None
+    incomplete_details: object | None = None
+    output: list = field(default_factory=list)
+    usage: object | None = None
+
+
+@dataclass
+class AIBufferedMessage:
+    message_id: int | None
+    entry: AIContextEntry | None
+    is_reset: bool = False
+
+
+@dataclass
+class AIChannelSummary:
+    summary: str
+    last_message_id: int
+    updated_at: float
+
+
+class AIChannelContextBuffer:
+    def __init__(self):
+        self.messages: OrderedDict[int, AIBufferedMessage] = OrderedDict()
+        self.warm = False
+        self.prompt_anchor_id: int | None = None
 
 
 @dataclass
@@ -219,6 +418,18 @@ WESROTH_CAPTIONS = [
     "THIS IS IT.",
 ]
 
+HTTP_CONNECTION_LIMIT = 32
+HTTP_CONNECTION_LIMIT_PER_HOST = 4
+HTTP_MAX_REDIRECTS = 5
+HTTP_READ_CHUNK_BYTES = 8192
+HTTP_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+HTTP_TRANSIENT_STATUSES = {408, 425, 429}
+FEED_FETCH_TIMEOUT_SECONDS = 20
+FEED_REQUEST_USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
 FETCH_TRACK_INFO_TIMEOUT_SECONDS = 25
 FETCH_TRACK_INFO_TIMEOUT_MESSAGE = (
     "Timed out while fetching track info for that link or search. Please try again in a moment."
@@ -427,7 +638,12 @@ def build_ai_sentience_prompt(sentience_percent: int) -> str:
 
 
 def get_ai_system_prompt(on_date: date | None = None) -> str:
-    return build_ai_sentience_prompt(get_ai_sentience_percent(on_date))
+    global ai_system_prompt_cache
+
+    current_date = on_date or datetime.now(LOCAL_TZ).date()
+    if ai_system_prompt_cache is None or ai_system_prompt_cache[0] != current_date:
+        ai_system_prompt_cache = (current_date, build_ai_sentience_prompt(get_ai_sentience_percent(current_date)))
+    return ai_system_prompt_cache[1]
 
 
 def build_bot_mention_regex(bot_user_id: int) -> re.Pattern:
@@ -479,41 +695,164 @@ def extract_urls_from_text(content: str) -> list[str]:
     return dedupe_preserve_order(urls)
 
 
-def get_token_encoder():
-    global ai_token_encoder
-
-    if ai_token_encoder is not None:
-        return ai_token_encoder
+def load_token_encoder():
     if encoding_for_model is None or get_encoding is None:
         return None
 
     try:
-        ai_token_encoder = encoding_for_model(OPENAI_MODEL)
-        return ai_token_encoder
+        return encoding_for_model(OPENAI_MODEL)
     except KeyError:
         pass
 
     for encoding_name in ("o200k_base", "cl100k_base"):
         try:
-            ai_token_encoder = get_encoding(encoding_name)
-            return ai_token_encoder
+            return get_encoding(encoding_name)
         except KeyError:
             continue
 
     return None
 
 
+def get_token_encoder():
+    # Loading the BPE tables can block for hundreds of ms, so it only happens in
+    # warm_token_encoder; until then callers use the character estimate.
+    return ai_token_encoder
+
+
+async def warm_token_encoder():
+    global ai_token_encoder
+
+    if ai_token_encoder is not None or ai_token_encoder_status["state"] == "loading":
+        return
+
+    ai_token_encoder_status.update(state="loading", error=None)
+    started_at = time.perf_counter()
+    try:
+        encoder = await asyncio.to_thread(load_token_encoder)
+    except Exception as exc:
+        elapsed = time.perf_counter() - started_at
+        ai_token_encoder_status.update(state="failed", load_seconds=elapsed, error=str(exc))
+        print(f"[ai] tokenizer warm-up failed elapsed={elapsed:.2f}s error={exc}")
+        return
+
+    elapsed = time.perf_counter() - started_at
+    ai_token_encoder = encoder
+    if encoder is not None:
+        # Counts cached before warm-up are character estimates.
+        ai_token_count_cache.clear()
+    state = "ready" if encoder is not None else "unavailable"
+    ai_token_encoder_status.update(state=state, load_seconds=elapsed)
+    print(f"[ai] tokenizer warm-up {state} elapsed={elapsed:.2f}s")
+
+
+def start_token_encoder_warmup():
+    if ai_token_encoder is not None or ai_token_encoder_status["state"] == "loading":
+        return
+    task = asyncio.create_task(warm_token_encoder())
+    ai_background_tasks.add(task)
+    task.add_done_callback(ai_background_tasks.discard)
+
+
+def get_token_encoder_summary() -> str:
+    state = ai_token_encoder_status["state"]
+    load_seconds = ai_token_encoder_status["load_seconds"]
+    if state == "ready":
+        return f"ready (loaded in {round(load_seconds * 1000)} ms)"
+    if state == "failed":
+        return f"failed after {round(load_seconds * 1000)} ms ({ai_token_encoder_status['error']}), using character estimate"
+    if state == "unavailable":
+        reason = f"tiktoken import failed: {TIKTOKEN_IMPORT_ERROR}" if TIKTOKEN_IMPORT_ERROR else "no matching encoding"
+        return f"unavailable ({reason}), using character estimate"
+    return f"{state.replace('_', ' ')}, using character estimate"
+
+
 def count_text_tokens(text: str) -> int:
     encoder = get_token_encoder()
     if encoder is None:
         return max(1, math.ceil(len(text) / 4))
-    return max(1, len(encoder.encode(text)))
+    return max(1, len(encoder.encode_ordinary(text)))
+
+
+def count_text_tokens_batch(texts: list[str]) -> list[int]:
+    encoder = get_token_encoder()
+    if encoder is None:
+        return [max(1, math.ceil(len(text) / 4)) for text in texts]
+    # encode_ordinary_batch starts a fresh thread pool per call, which costs more than it saves at these sizes.
+    return [max(1, len(encoder.encode_ordinary(text))) for text in texts]
 
 
 def format_ai_context_entry(entry: AIContextEntry) -> str:
     return f"{entry.author_name}: {entry.text}"
 
 
+def get_ai_token_count_cache_key(entry: AIContextEntry) -> tuple | None:
+    if entry.message_id is None:
+        return None
+    # Link unfurls update a message without setting edited_at, so the text itself is part of the key.
+    return entry.message_id, entry.edited_at, entry.author_name, hash(entry.text)
+
+
+def count_ai_context_entries_tokens(
+    entries: list[AIContextEntry],
+    image_slots: int = AI_CONTEXT_IMAGE_LIMIT,
+) -> list[int]:
+    token_counts: list[int | None] = []
+    missing_indexes = []
+    for index, entry in enumerate(entries):
+        cache_key = get_ai_token_count_cache_key(entry)
+        cached = ai_token_count_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            ai_token_count_cache.move_to_end(cache_key)
+        else:
+            missing_indexes.append(index)
+        token_counts.append(cached)
+
+    if missing_indexes:
+        missing_counts = count_text_tokens_batch(
+            [format_ai_context_entry(entries[index]) for index in missing_indexes]
+        )
+        for index, count in zip(missing_indexes, missing_counts):
+            token_counts[index] = count
+            cache_key = get_ai_token_count_cache_key(entries[index])
+            if cache_key is None:
+                continue
+            ai_token_count_cache[cache_key] = count
+            while len(ai_token_count_cache) > AI_TOKEN_COUNT_CACHE_SIZE:
+                ai_token_count_cache.popitem(last=False)
+
+    # Link previews are attached after selection, so reserve room for them up front.
+    # Only the first image_slots images across the entries are sent with the request.
+    entry_tokens = []
+    for entry, count in zip(entries, token_counts):
+        count += min(len(entry.link_urls), AI_CONTEXT_LINK_PREVIEW_LIMIT) * AI_LINK_PREVIEW_TOKEN_ESTIMATE
+        count += estimate_ai_entry_image_tokens(entry, image_slots)
+        image_slots -= min(len(entry.image_urls), image_slots)
+        entry_tokens.append(count)
+    return entry_tokens
+
+
+def estimate_ai_image_tokens(width: int, height: int) -> int:
+    # High-detail vision pricing: fit within 2048px, shrink the short side to 768px,
+    # then 85 tokens plus 170 per 512px tile.
+    width, height = max(1, width), max(1, height)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_ai_entry_image_tokens(entry: AIContextEntry, image_slots: int = AI_CONTEXT_IMAGE_LIMIT) -> int:
+    total = 0
+    for url in entry.image_urls[:max(0, image_slots)]:
+        prepared = get_cached_ai_image(url)
+        if prepared is not None:
+            total += prepared.token_estimate
+        else:
+            total += estimate_ai_image_tokens(AI_IMAGE_MAX_DIMENSION, AI_IMAGE_MAX_DIMENSION)
+    return total
+
+
 def is_probable_image_url(url: str) -> bool:
     try:
         path = (urlparse(url).path or "").lower()
@@ -577,93 +916,657 @@ def format_url_preview(url: str, title: str | None, description: str | None) ->
     return None
 
 
-def _extract_meta_content(html_text: str, key: str) -> str | None:
-    patterns = [
-        rf'<meta[^>]+(?:property|name)=["\']{re.escape(key)}["\'][^>]+content=["\'](.*?)["\']',
-        rf'<meta[^>]+content=["\'](.*?)["\'][^>]+(?:property|name)=["\']{re.escape(key)}["\']',
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, html_text, flags=re.IGNORECASE | re.DOTALL)
-        if match:
-            return normalize_ai_summary_text(match.group(1))
-    return None
+class LinkPreviewHeadParser:
+    META_KEYS = {"og:title", "twitter:title", "og:description", "twitter:description", "description"}
+    TAG_PATTERN = re.compile(r"<(/?)(meta|title|head|body|script|style)\b([^>]*)>|<!--", flags=re.IGNORECASE)
+    ATTR_PATTERN = re.compile(r"""([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+    RAW_TEXT_END_PATTERNS = {
+        "title": re.compile(r"</title\s*>", flags=re.IGNORECASE),
+        "script": re.compile(r"</script\s*>", flags=re.IGNORECASE),
+        "style": re.compile(r"</style\s*>", flags=re.IGNORECASE),
+        "comment": re.compile(r"-->"),
+    }
+
+    def __init__(self):
+        self.meta: dict[str, str] = {}
+        self.title: str | None = None
+        self.done = False
+        self.pending = ""
+        self.raw_text_tag: str | None = None
+
+    def _handle_meta(self, attr_text: str):
+        values = {}
+        for name, double_quoted, single_quoted, bare in self.ATTR_PATTERN.findall(attr_text):
+            values[name.lower()] = double_quoted or single_quoted or bare
+        key = (values.get("property") or values.get("name") or "").strip().lower()
+        if key in self.META_KEYS and key not in self.meta and "content" in values:
+            self.meta[key] = values["content"]
+
+    def feed_text(self, text: str) -> bool:
+        if self.done:
+            return True
+
+        buffer = self.pending + text
+        position = 0
+        while True:
+            if self.raw_text_tag is not None:
+                end_match = self.RAW_TEXT_END_PATTERNS[self.raw_text_tag].search(buffer, position)
+                if end_match is None:
+                    # Titles are short, so keep their text; elsewhere keep just enough for a split end tag.
+                    keep_from = position if self.raw_text_tag == "title" else max(position, len(buffer) - 16)
+                    self.pending = buffer[keep_from:]
+                    return False
+                if self.raw_text_tag == "title" and self.title is None:
+                    self.title = buffer[position:end_match.start()]
+                self.raw_text_tag = None
+                position = end_match.end()
+                continue
+
+            match = self.TAG_PATTERN.search(buffer, position)
+            if match is None:
+                partial_tag_start = buffer.rfind("<", position)
+                self.pending = buffer[partial_tag_start:] if partial_tag_start != -1 else ""
+                return False
+
+            position = match.end()
+            if match.group(2) is None:
+                self.raw_text_tag = "comment"
+                continue
+
+            closing, tag, attr_text = match.group(1), match.group(2).lower(), match.group(3)
+            if tag == "body" or (closing and tag == "head"):
+                self.done = True
+                self.pending = ""
+                return True
+            if closing:
+                continue
+            if tag == "meta":
+                self._handle_meta(attr_text)
+            elif tag in self.RAW_TEXT_END_PATTERNS:
+                self.raw_text_tag = tag
+
+    def title_and_description(self) -> tuple[str | None, str | None]:
+        title = (
+            self.meta.get("og:title")
+            or self.meta.get("twitter:title")
+            or self.title
+        )
+        description = (
+            self.meta.get("og:description")
+            or self.meta.get("twitter:description")
+            or self.meta.get("description")
+        )
+        return (
+            normalize_ai_summary_text(title) if title else None,
+            normalize_ai_summary_text(description) if description else None,
+        )
 
 
 def _extract_html_title_and_description(html_text: str) -> tuple[str | None, str | None]:
-    title = (
-        _extract_meta_content(html_text, "og:title")
-        or _extract_meta_content(html_text, "twitter:title")
-    )
-    if not title:
-        title_match = re.search(r"<title[^>]*>(.*?)</title>", html_text, flags=re.IGNORECASE | re.DOTALL)
-        if title_match:
-            title = normalize_ai_summary_text(title_match.group(1))
-
-    description = (
-        _extract_meta_content(html_text, "og:description")
-        or _extract_meta_content(html_text, "twitter:description")
-        or _extract_meta_content(html_text, "description")
+    parser = LinkPreviewHeadParser()
+    parser.feed_text(html_text)
+    return parser.title_and_description()
+
+
+def _is_public_ip_address(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return False
+    return not (
+        ip.is_private
+        or ip.is_loopback
+        or ip.is_link_local
+        or ip.is_multicast
+        or ip.is_reserved
+        or ip.is_unspecified
     )
-    return title, description
 
 
-def _is_public_fetch_host(hostname: str | None) -> bool:
+async def _lookup_public_fetch_host(hostname: str) -> tuple[str, ...] | None:
+    started_at = time.perf_counter()
+    try:
+        addr_infos = await asyncio.get_running_loop().getaddrinfo(
+            hostname,
+            None,
+            type=socket.SOCK_STREAM,
+        )
+    except (socket.gaierror, UnicodeError):
+        addresses = None
+    else:
+        addresses = tuple(dict.fromkeys(addr_info[4][0] for addr_info in addr_infos))
+        if not addresses or not all(_is_public_ip_address(address) for address in addresses):
+            addresses = None
+    finally:
+        lookup_ms = (time.perf_counter() - started_at) * 1000
+        ai_dns_cache_stats["lookups"] += 1
+        ai_dns_cache_stats["lookup_ms_total"] += lookup_ms
+        ai_dns_cache_stats["lookup_ms_max"] = max(ai_dns_cache_stats["lookup_ms_max"], lookup_ms)
+
+    ttl = AI_DNS_CACHE_TTL_SECONDS if addresses else AI_DNS_NEGATIVE_CACHE_TTL_SECONDS
+    ai_dns_cache[hostname] = (addresses, time.monotonic() + ttl)
+    ai_dns_cache.move_to_end(hostname)
+    while len(ai_dns_cache) > AI_DNS_CACHE_SIZE:
+        ai_dns_cache.popitem(last=False)
+    if addresses is None:
+        print(f"[ai] dns blocked or unresolvable host={hostname!r} lookup_ms={lookup_ms:.1f}")
+    return addresses
+
+
+def _finish_dns_lookup_task(hostname: str, task: asyncio.Task):
+    if ai_dns_inflight.get(hostname) is task:
+        ai_dns_inflight.pop(hostname, None)
+
+
+async def resolve_public_fetch_host(hostname: str | None) -> tuple[str, ...] | None:
     if not hostname:
-        return False
+        return None
 
-    normalized = hostname.strip("[]").lower()
-    if normalized in {"localhost", "0.0.0.0"} or normalized.endswith(".local"):
-        return False
+    normalized = hostname.strip("[]").lower().rstrip(".")
+    if normalized in {"localhost", "0.0.0.0"} or normalized.endswith((".local", ".localhost")):
+        return None
 
     try:
-        addresses = {
-            addr_info[4][0].split("%", 1)[0]
-            for addr_info in socket.getaddrinfo(normalized, None)
-        }
-    except socket.gaierror:
-        return False
+        ipaddress.ip_address(normalized.split("%", 1)[0])
+    except ValueError:
+        pass
+    else:
+        return (normalized,) if _is_public_ip_address(normalized) else None
+
+    cached = ai_dns_cache.get(normalized)
+    if cached is not None:
+        addresses, expires_at = cached
+        if expires_at > time.monotonic():
+            ai_dns_cache.move_to_end(normalized)
+            ai_dns_cache_stats["negative_hits" if addresses is None else "hits"] += 1
+            return addresses
+        ai_dns_cache.pop(normalized, None)
+
+    task = ai_dns_inflight.get(normalized)
+    if task is None:
+        task = asyncio.create_task(_lookup_public_fetch_host(normalized))
+        ai_dns_inflight[normalized] = task
+        task.add_done_callback(partial(_finish_dns_lookup_task, normalized))
+    else:
+        ai_dns_cache_stats["inflight_joins"] += 1
+    return await asyncio.shield(task)
 
-    for address in addresses:
-        ip = ipaddress.ip_address(address)
-        if (
-            ip.is_private
-            or ip.is_loopback
-            or ip.is_link_local
-            or ip.is_multicast
-            or ip.is_reserved
-            or ip.is_unspecified
-        ):
-            return False
-    return True
 
+async def _is_public_fetch_host(hostname: str | None) -> bool:
+    return bool(await resolve_public_fetch_host(hostname))
+
+
+def get_dns_cache_summary() -> str:
+    lookups = ai_dns_cache_stats["lookups"]
+    avg_lookup = f"{ai_dns_cache_stats['lookup_ms_total'] / lookups:.1f}ms" if lookups else "n/a"
+    return (
+        f"{len(ai_dns_cache)} hosts cached, "
+        f"{ai_dns_cache_stats['hits']} hits, "
+        f"{ai_dns_cache_stats['negative_hits']} negative hits, "
+        f"{ai_dns_cache_stats['inflight_joins']} joined, "
+        f"{lookups} lookups (avg {avg_lookup}, max {ai_dns_cache_stats['lookup_ms_max']:.1f}ms)"
+    )
+
+
+class PublicFetchResolver(aiohttp.abc.AbstractResolver):
+    # Connect only to the addresses the public-host check validated, straight from its cache.
+    async def resolve(
+        self,
+        host: str,
+        port: int = 0,
+        family: socket.AddressFamily = socket.AF_INET,
+    ) -> list[aiohttp.abc.ResolveResult]:
+        addresses = await resolve_public_fetch_host(host)
+        if not addresses:
+            raise OSError(f"Refusing to connect to non-public host {host!r}")
+
+        results = []
+        for address in addresses:
+            address_family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            if family not in (socket.AF_UNSPEC, address_family):
+                continue
+            results.append({
+                "hostname": host,
+                "host": address,
+                "port": port,
+                "family": address_family,
+                "proto": 0,
+                "flags": socket.AI_NUMERICHOST,
+            })
+        if not results:
+            raise OSError(f"No usable addresses for host {host!r}")
+        return results
+
+    async def close(self):
+        pass
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global http_session
+
+    if http_session is not None and not http_session.closed:
+        return http_session
 
-def _fetch_public_link_preview(url: str) -> str | None:
-    parsed = urlparse(url)
-    if parsed.scheme not in {"http", "https"} or not _is_public_fetch_host(parsed.hostname):
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=HTTP_CONNECTION_LIMIT,
+            limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+            resolver=PublicFetchResolver(),
+            use_dns_cache=False,
+        ),
+    )
+    return http_session
+
+
+async def read_http_body(
+    response: aiohttp.ClientResponse,
+    max_bytes: int | None = None,
+    on_chunk: Callable[[bytes], bool] | None = None,
+) -> bytes:
+    if max_bytes is None and on_chunk is None:
+        return await response.read()
+
+    chunks = []
+    remaining = max_bytes
+    async for chunk in response.content.iter_chunked(HTTP_READ_CHUNK_BYTES):
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        chunks.append(chunk)
+        if on_chunk is not None and on_chunk(chunk):
+            break
+        if remaining is not None and remaining <= 0:
+            break
+    return b"".join(chunks)
+
+
+@contextlib.asynccontextmanager
+async def open_http_response(
+    url: str,
+    *,
+    headers: dict[str, str],
+    timeout_seconds: float,
+    public_only: bool = False,
+):
+    session = get_http_session()
+    timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+    current_url = url
+
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        parsed = urlparse(current_url)
+        if parsed.scheme not in {"http", "https"}:
+            break
+        if public_only and not await _is_public_fetch_host(parsed.hostname):
+            break
+
+        async with session.get(
+            current_url,
+            headers=headers,
+            timeout=timeout,
+            allow_redirects=False,
+        ) as response:
+            if response.status in HTTP_REDIRECT_STATUSES:
+                location = response.headers.get("Location")
+                if not location:
+                    break
+                current_url = urljoin(current_url, location)
+                continue
+
+            response.raise_for_status()
+            yield current_url, response
+            return
+
+    yield None
+
+
+async def fetch_http_text(
+    url: str,
+    *,
+    headers: dict[str, str],
+    timeout_seconds: float,
+    max_bytes: int | None = None,
+    public_only: bool = False,
+    required_content_type: str | None = None,
+    on_text: Callable[[str], bool] | None = None,
+) -> tuple[str, str] | None:
+    async with open_http_response(
+        url,
+        headers=headers,
+        timeout_seconds=timeout_seconds,
+        public_only=public_only,
+    ) as opened:
+        if opened is None:
+            return None
+        final_url, response = opened
+        content_type = (response.headers.get("Content-Type") or "").lower()
+        if required_content_type is not None and required_content_type not in content_type:
+            return None
+
+        charset = response.charset or "utf-8"
+        on_chunk = None
+        if on_text is not None:
+            try:
+                decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            except LookupError:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            on_chunk = lambda chunk: on_text(decoder.decode(chunk))
+        body = await read_http_body(response, max_bytes, on_chunk)
+
+    try:
+        return final_url, body.decode(charset, errors="replace")
+    except LookupError:
+        return final_url, body.decode("utf-8", errors="replace")
+
+
+async def fetch_http_bytes(
+    url: str,
+    *,
+    headers: dict[str, str],
+    timeout_seconds: float,
+    max_bytes: int,
+    public_only: bool = False,
+    required_content_type: str | None = None,
+) -> bytes | None:
+    async with open_http_response(
+        url,
+        headers=headers,
+        timeout_seconds=timeout_seconds,
+        public_only=public_only,
+    ) as opened:
+        if opened is None:
+            return None
+        _, response = opened
+        content_type = (response.headers.get("Content-Type") or "").lower()
+        if required_content_type is not None and required_content_type not in content_type:
+            return None
+        if response.content_length is not None and response.content_length > max_bytes:
+            return None
+        # Read one byte past the limit so an oversized body is rejected instead of truncated.
+        body = await read_http_body(response, max_bytes + 1)
+    if len(body) > max_bytes:
         return None
+    return body
 
-    req = urllib.request.Request(
+
+async def _fetch_public_link_preview(url: str) -> str | None:
+    parser = LinkPreviewHeadParser()
+    result = await fetch_http_text(
         url,
         headers={
             "User-Agent": YOUTUBE_REQUEST_USER_AGENT,
             "Accept": "text/html,application/xhtml+xml",
         },
+        timeout_seconds=AI_LINK_PREVIEW_TIMEOUT_SECONDS,
+        max_bytes=AI_LINK_PREVIEW_MAX_BYTES,
+        public_only=True,
+        required_content_type="html",
+        on_text=parser.feed_text,
     )
-    with urllib.request.urlopen(req, timeout=AI_LINK_PREVIEW_TIMEOUT_SECONDS) as response:
-        final_url = response.geturl()
-        final_parsed = urlparse(final_url)
-        if final_parsed.scheme not in {"http", "https"} or not _is_public_fetch_host(final_parsed.hostname):
-            return None
+    if result is None:
+        return None
 
-        content_type = (response.headers.get("Content-Type") or "").lower()
-        if "html" not in content_type:
-            return None
+    final_url, _ = result
+    title, description = parser.title_and_description()
+    return format_url_preview(final_url, title, description)
 
-        charset = response.headers.get_content_charset() or "utf-8"
-        html_text = response.read(AI_LINK_PREVIEW_MAX_BYTES).decode(charset, errors="replace")
 
-    title, description = _extract_html_title_and_description(html_text)
-    return format_url_preview(final_url, title, description)
+def remember_link_preview_in_memory(url: str, preview: str | None, expires_at: float):
+    ai_link_preview_cache[url] = (preview, expires_at)
+    ai_link_preview_cache.move_to_end(url)
+    while len(ai_link_preview_cache) > AI_LINK_PREVIEW_MEMORY_CACHE_SIZE:
+        ai_link_preview_cache.popitem(last=False)
+
+
+def get_cached_link_preview(url: str, now: float | None = None) -> tuple[bool, str | None]:
+    current_time = time.time() if now is None else now
+
+    cached = ai_link_preview_cache.get(url)
+    if cached is not None:
+        preview, expires_at = cached
+        if expires_at > current_time:
+            ai_link_preview_cache.move_to_end(url)
+            ai_link_preview_cache_stats["memory_hits"] += 1
+            return True, preview
+        ai_link_preview_cache.pop(url, None)
+
+    try:
+        with db_ai_cache() as conn:
+            row = conn.execute(
+                "SELECT preview, expires_at FROM link_preview_cache WHERE url=?",
+                (url,),
+            ).fetchone()
+    except sqlite3.Error:
+        row = None
+
+    if row is not None and row["expires_at"] > current_time:
+        remember_link_preview_in_memory(url, row["preview"], row["expires_at"])
+        ai_link_preview_cache_stats["db_hits"] += 1
+        return True, row["preview"]
+
+    ai_link_preview_cache_stats["misses"] += 1
+    return False, None
+
+
+async def store_cached_link_preview(
+    url: str,
+    preview: str | None,
+    now: float | None = None,
+    transient: bool = False,
+):
+    global ai_link_preview_db_pruned_at
+
+    current_time = time.time() if now is None else now
+    if preview:
+        ttl = AI_LINK_PREVIEW_CACHE_TTL_SECONDS
+    elif transient:
+        ttl = AI_LINK_PREVIEW_TRANSIENT_CACHE_TTL_SECONDS
+    else:
+        ttl = AI_LINK_PREVIEW_NEGATIVE_CACHE_TTL_SECONDS
+    expires_at = current_time + ttl
+    remember_link_preview_in_memory(url, preview, expires_at)
+
+    try:
+        async with db_write_lock:
+            with db_ai_cache() as conn:
+                conn.execute("""
+                    INSERT INTO link_preview_cache(url, preview, fetched_at, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        preview=excluded.preview,
+                        fetched_at=excluded.fetched_at,
+                        expires_at=excluded.expires_at
+                """, (url, preview, current_time, expires_at))
+                # Pruning scans the whole table, so it runs on an interval instead of every insert.
+                if current_time - ai_link_preview_db_pruned_at >= AI_LINK_PREVIEW_DB_PRUNE_INTERVAL_SECONDS:
+                    ai_link_preview_db_pruned_at = current_time
+                    conn.execute("DELETE FROM link_preview_cache WHERE expires_at <= ?", (current_time,))
+                    conn.execute("""
+                        DELETE FROM link_preview_cache
+                        WHERE url IN (
+                            SELECT url FROM link_preview_cache
+                            ORDER BY fetched_at DESC
+                            LIMIT -1 OFFSET ?
+                        )
+                    """, (AI_LINK_PREVIEW_DB_CACHE_SIZE,))
+    except sqlite3.Error as exc:
+        print(f"[ai] link preview cache write failed url={url!r} error={exc}")
+
+
+def get_link_preview_cache_summary() -> str:
+    hits = ai_link_preview_cache_stats["memory_hits"] + ai_link_preview_cache_stats["db_hits"]
+    lookups = hits + ai_link_preview_cache_stats["misses"]
+    hit_rate = f"{round(hits * 100 / lookups)}%" if lookups else "n/a"
+    return (
+        f"{len(ai_link_preview_cache)} in memory, "
+        f"{ai_link_preview_cache_stats['memory_hits']} memory hits, "
+        f"{ai_link_preview_cache_stats['db_hits']} db hits, "
+        f"{ai_link_preview_cache_stats['misses']} misses ({hit_rate} hit rate)"
+    )
+
+
+async def fetch_url_preview_cached(url: str) -> str | None:
+    cached, preview = get_cached_link_preview(url)
+    if cached:
+        return preview
+
+    transient = False
+    try:
+        preview = await _fetch_public_link_preview(url)
+    except aiohttp.ClientResponseError as exc:
+        preview = None
+        transient = exc.status >= 500 or exc.status in HTTP_TRANSIENT_STATUSES
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+        preview = None
+        transient = True
+    except ValueError:
+        preview = None
+
+    await store_cached_link_preview(url, preview, transient=transient)
+    return preview
+
+
+def get_ai_image_cache_key(url: str) -> str:
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return url
+    if (parsed.hostname or "").lower() in AI_DISCORD_CDN_HOSTS:
+        # Discord signs attachment URLs with expiring query parameters; the path alone names the file.
+        return parsed._replace(query="", fragment="").geturl()
+    return url
+
+
+def get_cached_ai_image(url: str) -> AIPreparedImage | None:
+    content_hash = ai_image_url_hashes.get(get_ai_image_cache_key(url))
+    if content_hash is None:
+        return None
+    return ai_image_cache.get(content_hash)
+
+
+def remember_ai_image(url_key: str, content_hash: str, prepared: AIPreparedImage):
+    ai_image_url_hashes[url_key] = content_hash
+    ai_image_url_hashes.move_to_end(url_key)
+    while len(ai_image_url_hashes) > AI_IMAGE_URL_CACHE_SIZE:
+        ai_image_url_hashes.popitem(last=False)
+
+    if content_hash not in ai_image_cache:
+        ai_image_cache_stats["cached_bytes"] += len(prepared.data_url)
+    ai_image_cache[content_hash] = prepared
+    ai_image_cache.move_to_end(content_hash)
+    while ai_image_cache_stats["cached_bytes"] > AI_IMAGE_CACHE_MAX_BYTES and len(ai_image_cache) > 1:
+        _, evicted = ai_image_cache.popitem(last=False)
+        ai_image_cache_stats["cached_bytes"] -= len(evicted.data_url)
+        ai_image_cache_stats["evictions"] += 1
+
+
+def prepare_ai_image(data: bytes) -> AIPreparedImage | None:
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width * image.height > AI_IMAGE_MAX_PIXELS:
+                return None
+            image.draft("RGB", (AI_IMAGE_MAX_DIMENSION, AI_IMAGE_MAX_DIMENSION))
+            if image.mode in {"RGBA", "LA", "PA"} or "transparency" in image.info:
+                rgba = image.convert("RGBA")
+                converted = Image.new("RGB", rgba.size, (255, 255, 255))
+                converted.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                converted = image.convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    converted.thumbnail((AI_IMAGE_MAX_DIMENSION, AI_IMAGE_MAX_DIMENSION))
+    buffer = io.BytesIO()
+    converted.save(buffer, format="JPEG", quality=AI_IMAGE_JPEG_QUALITY, optimize=True)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return AIPreparedImage(
+        data_url=f"data:image/jpeg;base64,{encoded}",
+        width=converted.width,
+        height=converted.height,
+        token_estimate=estimate_ai_image_tokens(converted.width, converted.height),
+    )
+
+
+async def _download_ai_image(url: str, url_key: str) -> AIPreparedImage | None:
+    started_at = time.perf_counter()
+    try:
+        data = await fetch_http_bytes(
+            url,
+            headers={"User-Agent": YOUTUBE_REQUEST_USER_AGENT, "Accept": "image/*"},
+            timeout_seconds=AI_IMAGE_DOWNLOAD_TIMEOUT_SECONDS,
+            max_bytes=AI_IMAGE_MAX_DOWNLOAD_BYTES,
+            public_only=True,
+            required_content_type="image/",
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError):
+        data = None
+    if data is None:
+        ai_image_cache_stats["failures"] += 1
+        print(f"[ai] image download failed url={url!r}")
+        return None
+
+    ai_image_cache_stats["downloads"] += 1
+    ai_image_cache_stats["downloaded_bytes"] += len(data)
+    content_hash = hashlib.sha256(data).hexdigest()
+    prepared = ai_image_cache.get(content_hash)
+    if prepared is None:
+        prepared = await asyncio.to_thread(prepare_ai_image, data)
+        if prepared is None:
+            ai_image_cache_stats["failures"] += 1
+            print(f"[ai] image could not be decoded url={url!r} bytes={len(data)}")
+            return None
+
+    remember_ai_image(url_key, content_hash, prepared)
+    print(
+        f"[ai] image prepared url={url!r} bytes={len(data)} sent_bytes={len(prepared.data_url)} "
+        f"size={prepared.width}x{prepared.height} elapsed={time.perf_counter() - started_at:.2f}s"
+    )
+    return prepared
+
+
+def _finish_ai_image_task(url_key: str, task: asyncio.Task):
+    if ai_image_inflight.get(url_key) is task:
+        ai_image_inflight.pop(url_key, None)
+
+
+async def fetch_ai_image(url: str) -> AIPreparedImage | None:
+    url_key = get_ai_image_cache_key(url)
+    prepared = get_cached_ai_image(url)
+    if prepared is not None:
+        ai_image_cache_stats["hits"] += 1
+        ai_image_url_hashes.move_to_end(url_key)
+        ai_image_cache.move_to_end(ai_image_url_hashes[url_key])
+        return prepared
+
+    task = ai_image_inflight.get(url_key)
+    if task is None:
+        task = asyncio.create_task(_download_ai_image(url, url_key))
+        ai_image_inflight[url_key] = task
+        task.add_done_callback(partial(_finish_ai_image_task, url_key))
+    return await asyncio.shield(task)
+
+
+async def prepare_ai_request_image_urls(image_urls: list[str]) -> list[str]:
+    image_urls = image_urls[:AI_CONTEXT_IMAGE_LIMIT]
+    if not AI_IMAGE_PREPROCESSING or Image is None or not image_urls:
+        return image_urls
+    prepared_images = await asyncio.gather(*(fetch_ai_image(url) for url in image_urls))
+    # Images that fail to download are usually expired links; sending them would fail the whole request.
+    return [prepared.data_url for prepared in prepared_images if prepared is not None]
+
+
+def get_ai_image_cache_summary() -> str:
+    if not AI_IMAGE_PREPROCESSING:
+        return "off"
+    if Image is None:
+        return f"Pillow unavailable ({PIL_IMPORT_ERROR}), sending original URLs"
+    return (
+        f"{len(ai_image_cache)} images ({ai_image_cache_stats['cached_bytes'] / 1024:.0f} KiB), "
+        f"{ai_image_cache_stats['hits']} hits, "
+        f"{ai_image_cache_stats['downloads']} downloads "
+        f"({ai_image_cache_stats['downloaded_bytes'] / 1024:.0f} KiB), "
+        f"{ai_image_cache_stats['failures']} failed, "
+        f"{ai_image_cache_stats['evictions']} evicted"
+    )
 
 
 async def get_url_preview_text(
@@ -678,21 +1581,67 @@ async def get_url_preview_text(
         return None
 
     preview_state["used"] += 1
-    try:
-        preview = await asyncio.to_thread(_fetch_public_link_preview, url)
-    except OSError:
-        preview = None
-
+    preview = await fetch_url_preview_cached(url)
     preview_cache[url] = preview
     return preview
 
 
-async def build_ai_context_entry(
-    message,
+def _finish_background_preview_task(task: asyncio.Task):
+    ai_background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[ai] link preview background fetch failed error={task.exception()!r}")
+
+
+async def prefetch_url_previews(
+    urls: list[str],
     preview_cache: dict[str, str | None],
     preview_state: dict[str, int],
-    strip_bot_mention_id: int | None = None,
-) -> AIContextEntry | None:
+):
+    pending_urls = []
+    for url in dedupe_preserve_order(urls):
+        if url in preview_cache:
+            continue
+        if preview_state["used"] >= AI_CONTEXT_LINK_PREVIEW_LIMIT:
+            preview_cache[url] = None
+            continue
+        preview_state["used"] += 1
+        pending_urls.append(url)
+
+    if not pending_urls:
+        return
+
+    semaphore = asyncio.Semaphore(AI_LINK_PREVIEW_CONCURRENCY)
+    batch_started_at = time.perf_counter()
+
+    async def _fetch(url: str) -> str | None:
+        async with semaphore:
+            started_at = time.perf_counter()
+            preview = await fetch_url_preview_cached(url)
+        elapsed = time.perf_counter() - started_at
+        print(f"[ai] link preview url={url!r} found={preview is not None} elapsed={elapsed:.2f}s")
+        return preview
+
+    tasks = {asyncio.create_task(_fetch(url)): url for url in pending_urls}
+    done, pending = await asyncio.wait(tasks, timeout=AI_LINK_PREVIEW_DEADLINE_SECONDS)
+
+    for task, url in tasks.items():
+        preview_cache[url] = None
+        if task not in done:
+            continue
+        try:
+            preview_cache[url] = task.result()
+        except Exception as exc:
+            print(f"[ai] link preview url={url!r} failed error={exc!r}")
+
+    # Late fetches keep running so they still land in the shared preview cache.
+    for task in pending:
+        elapsed = time.perf_counter() - batch_started_at
+        print(f"[ai] link preview url={tasks[task]!r} dropped after deadline elapsed={elapsed:.2f}s")
+        ai_background_tasks.add(task)
+        task.add_done_callback(_finish_background_preview_task)
+
+
+def build_ai_context_base_entry(message, strip_bot_mention_id: int | None = None) -> AIContextEntry | None:
     if getattr(message, "webhook_id", None) is not None:
         return None
 
@@ -714,12 +1663,7 @@ async def build_ai_context_entry(
         if embed_summary:
             lines.append(embed_summary)
 
-    for url in extract_urls_from_text(raw_content):
-        if is_probable_image_url(url):
-            continue
-        preview_text = await get_url_preview_text(url, preview_cache, preview_state)
-        if preview_text:
-            lines.append(preview_text)
+    link_urls = [url for url in extract_urls_from_text(raw_content) if not is_probable_image_url(url)]
 
     text = "\n".join(dedupe_preserve_order(lines)).strip()
     if not text and not image_urls:
@@ -727,10 +1671,267 @@ async def build_ai_context_entry(
 
     author = getattr(message, "author", None)
     author_name = getattr(author, "display_name", str(author) if author is not None else "Unknown")
-    return AIContextEntry(author_name=author_name, text=text, image_urls=image_urls)
+    return AIContextEntry(
+        author_name=author_name,
+        text=text,
+        image_urls=image_urls,
+        link_urls=link_urls,
+        # Stripped prompts differ from the history text, so only unstripped entries share token counts.
+        message_id=getattr(message, "id", None) if strip_bot_mention_id is None else None,
+        edited_at=getattr(message, "edited_at", None),
+    )
 
 
-def build_ai_request_input(conversation_prompt: str, image_urls: list[str]):
+async def attach_ai_link_previews(
+    entry: AIContextEntry,
+    preview_cache: dict[str, str | None],
+    preview_state: dict[str, int],
+) -> AIContextEntry:
+    preview_lines = []
+    for url in entry.link_urls:
+        preview_text = await get_url_preview_text(url, preview_cache, preview_state)
+        if preview_text:
+            preview_lines.append(preview_text)
+
+    if not preview_lines:
+        return entry
+    text = "\n".join(dedupe_preserve_order([entry.text, *preview_lines])).strip()
+    return replace(entry, text=text, link_preview_count=len(preview_lines))
+
+
+async def build_ai_context_entry(
+    message,
+    preview_cache: dict[str, str | None],
+    preview_state: dict[str, int],
+    strip_bot_mention_id: int | None = None,
+) -> AIContextEntry | None:
+    entry = build_ai_context_base_entry(message, strip_bot_mention_id=strip_bot_mention_id)
+    if entry is None:
+        return None
+    return await attach_ai_link_previews(entry, preview_cache, preview_state)
+
+
+def build_ai_buffered_message(message, bot_user_id: int | None) -> AIBufferedMessage:
+    content = getattr(message, "content", "") or ""
+    is_reset = (
+        bot_user_id is not None
+        and message_mentions_bot_content(content, bot_user_id)
+        and is_ai_reset_prompt(extract_bot_mention_prompt(content, bot_user_id))
+    )
+    return AIBufferedMessage(
+        message_id=getattr(message, "id", None),
+        entry=build_ai_context_base_entry(message),
+        is_reset=is_reset,
+    )
+
+
+def get_ai_context_buffer(channel_id: int | None, create: bool = False) -> AIChannelContextBuffer | None:
+    if channel_id is None:
+        return None
+
+    buffer = ai_context_buffers.get(channel_id)
+    if buffer is None:
+        if not create:
+            return None
+        buffer = AIChannelContextBuffer()
+        ai_context_buffers[channel_id] = buffer
+    ai_context_buffers.move_to_end(channel_id)
+    enforce_ai_context_buffer_limits()
+    return buffer
+
+
+def enforce_ai_context_buffer_limits():
+    while len(ai_context_buffers) > AI_CONTEXT_BUFFER_MAX_CHANNELS:
+        ai_context_buffers.popitem(last=False)
+
+    total_messages = sum(len(buffer.messages) for buffer in ai_context_buffers.values())
+    while total_messages > AI_CONTEXT_BUFFER_MAX_TOTAL_MESSAGES and len(ai_context_buffers) > 1:
+        _, evicted = ai_context_buffers.popitem(last=False)
+        total_messages -= len(evicted.messages)
+
+
+def mark_ai_context_buffers_cold():
+    # A fresh gateway session does not replay what was sent while the bot was offline, so the
+    # next mention in each channel refills its buffer from REST.
+    for buffer in ai_context_buffers.values():
+        buffer.warm = False
+
+
+def store_ai_buffered_messages(buffer: AIChannelContextBuffer, buffered_messages: Iterable[AIBufferedMessage]):
+    messages = buffer.messages
+    out_of_order = False
+    for buffered in buffered_messages:
+        if buffered.message_id is None:
+            continue
+        if (
+            not out_of_order
+            and messages
+            and buffered.message_id not in messages
+            and buffered.message_id < next(reversed(messages))
+        ):
+            out_of_order = True
+        messages[buffered.message_id] = buffered
+    # Sort once per batch; history pages arrive newest-first and would otherwise re-sort per message.
+    if out_of_order:
+        buffer.messages = messages = OrderedDict(sorted(messages.items()))
+    while len(messages) > AI_CONTEXT_BUFFER_MAX_MESSAGES_PER_CHANNEL:
+        messages.popitem(last=False)
+
+
+def store_ai_buffered_message(buffer: AIChannelContextBuffer, buffered: AIBufferedMessage):
+    store_ai_buffered_messages(buffer, [buffered])
+
+
+def record_ai_context_message(message, bot_user_id: int | None):
+    buffer = ai_context_buffers.get(getattr(message.channel, "id", None))
+    if buffer is None:
+        return
+    store_ai_buffered_message(buffer, build_ai_buffered_message(message, bot_user_id))
+    enforce_ai_context_buffer_limits()
+
+
+def update_ai_context_message(message, bot_user_id: int | None):
+    buffer = ai_context_buffers.get(getattr(message.channel, "id", None))
+    if buffer is None or message.id not in buffer.messages:
+        return
+    buffer.messages[message.id] = build_ai_buffered_message(message, bot_user_id)
+
+
+def forget_ai_context_messages(channel_id: int, message_ids):
+    buffer = ai_context_buffers.get(channel_id)
+    if buffer is None:
+        return
+    for message_id in message_ids:
+        buffer.messages.pop(message_id, None)
+
+
+def remember_ai_channel_reset_marker(channel_id: int, message_id: int | None):
+    ai_channel_reset_markers[channel_id] = message_id
+    ai_channel_reset_markers.move_to_end(channel_id)
+    while len(ai_channel_reset_markers) > AI_RESET_MARKER_MEMORY_CACHE_SIZE:
+        ai_channel_reset_markers.popitem(last=False)
+
+
+def get_ai_channel_reset_marker(channel_id: int | None) -> int | None:
+    if channel_id is None:
+        return None
+    if channel_id in ai_channel_reset_markers:
+        ai_channel_reset_markers.move_to_end(channel_id)
+        return ai_channel_reset_markers[channel_id]
+
+    try:
+        with db_ai_cache() as conn:
+            row = conn.execute(
+                "SELECT message_id FROM channel_reset_markers WHERE channel_id=?",
+                (channel_id,),
+            ).fetchone()
+    except sqlite3.Error as exc:
+        print(f"[ai] reset marker read failed channel={channel_id} error={exc}")
+        return None
+
+    message_id = row["message_id"] if row is not None else None
+    remember_ai_channel_reset_marker(channel_id, message_id)
+    return message_id
+
+
+async def record_ai_channel_reset(channel_id: int, message_id: int):
+    current_marker = get_ai_channel_reset_marker(channel_id)
+    if current_marker is not None and current_marker >= message_id:
+        return
+    remember_ai_channel_reset_marker(channel_id, message_id)
+
+    buffer = get_ai_context_buffer(channel_id)
+    if buffer is not None:
+        forget_ai_context_messages(
+            channel_id,
+            [buffered_id for buffered_id in buffer.messages if buffered_id < message_id],
+        )
+
+    try:
+        async with db_write_lock:
+            with db_ai_cache() as conn:
+                conn.execute("""
+                    INSERT INTO channel_reset_markers(channel_id, message_id, reset_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(channel_id) DO UPDATE SET
+                        message_id=excluded.message_id,
+                        reset_at=excluded.reset_at
+                    WHERE excluded.message_id > channel_reset_markers.message_id
+                """, (channel_id, message_id, time.time()))
+    except sqlite3.Error as exc:
+        print(f"[ai] reset marker write failed channel={channel_id} error={exc}")
+
+
+async def load_ai_context_history(
+    message: discord.Message,
+    bot_user_id: int,
+) -> list[AIBufferedMessage]:
+    channel_id = getattr(message.channel, "id", None)
+    # Create the buffer before awaiting so gateway events that land mid-fetch are kept.
+    buffer = get_ai_context_buffer(channel_id, create=True)
+    reset_marker = get_ai_channel_reset_marker(channel_id)
+
+    history_messages = []
+    if reset_marker is not None:
+        # Discord's REST endpoint honours only one of before/after, so page forward from the
+        # reset to fetch just the messages since it.
+        async for previous_message in message.channel.history(
+            limit=AI_CONTEXT_HISTORY_SCAN_LIMIT,
+            before=message,
+            after=discord.Object(id=reset_marker),
+            oldest_first=True,
+        ):
+            history_messages.append(previous_message)
+        history_messages.reverse()
+    if reset_marker is None or len(history_messages) >= AI_CONTEXT_HISTORY_SCAN_LIMIT:
+        # With a full page since the reset, the newest scan-limit messages all come after it.
+        history_messages = [
+            previous_message
+            async for previous_message in message.channel.history(
+                limit=AI_CONTEXT_HISTORY_SCAN_LIMIT,
+                before=message,
+                oldest_first=False,
+            )
+        ]
+    history_messages_newest_first = [
+        build_ai_buffered_message(previous_message, bot_user_id) for previous_message in history_messages
+    ]
+
+    if buffer is not None:
+        store_ai_buffered_messages(
+            buffer,
+            [*reversed(history_messages_newest_first), build_ai_buffered_message(message, bot_user_id)],
+        )
+        buffer.warm = True
+        enforce_ai_context_buffer_limits()
+
+    return history_messages_newest_first
+
+
+def iter_ai_context_base_entries(
+    buffered_messages_newest_first: Iterable[AIBufferedMessage],
+) -> Iterator[AIContextEntry]:
+    for buffered in buffered_messages_newest_first:
+        if buffered.is_reset:
+            return
+        if buffered.entry is not None:
+            yield buffered.entry
+
+
+def select_ai_request_image_urls(
+    context_entries: list[AIContextEntry],
+    current_entries: list[AIContextEntry],
+) -> list[str]:
+    # Same order the token estimate uses: the messages being answered, then history newest-first.
+    image_urls = dedupe_preserve_order(
+        image_url
+        for entry in [*current_entries, *reversed(context_entries)]
+        for image_url in entry.image_urls
+    )
+    return image_urls[:AI_CONTEXT_IMAGE_LIMIT]
+
+
+def build_ai_request_input(conversation_prompt: str, image_urls: list[str]):
     content = [{"type": "input_text", "text": conversation_prompt}]
     for image_url in image_urls[:AI_CONTEXT_IMAGE_LIMIT]:
         content.append({"type": "input_image", "image_url": image_url})
@@ -738,71 +1939,172 @@ def build_ai_request_input(conversation_prompt: str, image_urls: list[str]):
 
 
 def select_ai_context_entries(
-    history_entries_newest_first: list[AIContextEntry],
+    history_entries_newest_first: Iterable[AIContextEntry],
     current_entry: AIContextEntry,
     token_budget: int = AI_CONTEXT_TOKEN_BUDGET,
+    image_slots: int = AI_CONTEXT_IMAGE_LIMIT,
 ) -> list[AIContextEntry]:
     selected_entries: list[AIContextEntry] = []
-    used_tokens = count_text_tokens(format_ai_context_entry(current_entry))
-
     if token_budget <= 0:
         return []
 
-    for entry in history_entries_newest_first:
-        selected_entries.append(entry)
-        used_tokens += count_text_tokens(format_ai_context_entry(entry))
-        if used_tokens >= token_budget:
+    used_tokens = count_ai_context_entries_tokens([current_entry], image_slots)[0]
+    image_slots -= min(len(current_entry.image_urls), image_slots)
+    history_iter = iter(history_entries_newest_first)
+    while True:
+        # Size each tokenizer batch with a cheap character estimate so we rarely tokenize past the budget.
+        batch = []
+        estimated_tokens = used_tokens
+        estimated_image_slots = image_slots
+        for entry in history_iter:
+            batch.append(entry)
+            estimated_tokens += math.ceil(len(format_ai_context_entry(entry)) / 4)
+            estimated_tokens += min(len(entry.link_urls), AI_CONTEXT_LINK_PREVIEW_LIMIT) * AI_LINK_PREVIEW_TOKEN_ESTIMATE
+            estimated_tokens += estimate_ai_entry_image_tokens(entry, estimated_image_slots)
+            estimated_image_slots -= min(len(entry.image_urls), estimated_image_slots)
+            if estimated_tokens >= token_budget or len(batch) >= AI_TOKEN_COUNT_BATCH_SIZE:
+                break
+        if not batch:
             break
 
+        batch_tokens = count_ai_context_entries_tokens(batch, image_slots)
+        image_slots -= min(sum(len(entry.image_urls) for entry in batch), image_slots)
+        for entry, entry_tokens in zip(batch, batch_tokens):
+            selected_entries.append(entry)
+            used_tokens += entry_tokens
+            if used_tokens >= token_budget:
+                selected_entries.reverse()
+                return selected_entries
+
     selected_entries.reverse()
     return selected_entries
 
 
+def select_ai_anchored_context_entries(
+    history_entries_newest_first: Iterable[AIContextEntry],
+    current_entry: AIContextEntry,
+    anchor_message_id: int,
+    token_budget: int,
+    image_slots: int = AI_CONTEXT_IMAGE_LIMIT,
+) -> list[AIContextEntry] | None:
+    candidates = []
+    for entry in history_entries_newest_first:
+        if entry.message_id is None or entry.message_id < anchor_message_id:
+            break
+        candidates.append(entry)
+        if entry.message_id == anchor_message_id:
+            break
+    if not candidates or candidates[-1].message_id != anchor_message_id:
+        return None
+    if sum(count_ai_context_entries_tokens([current_entry, *candidates], image_slots)) > token_budget:
+        return None
+    candidates.reverse()
+    return candidates
+
+
 async def fetch_ai_context_entries(
     message: discord.Message,
     bot_user_id: int,
+    token_budget: int = AI_CONTEXT_TOKEN_BUDGET,
 ) -> tuple[list[AIContextEntry], AIContextEntry]:
-    history_messages = []
-    async for previous_message in message.channel.history(
-        limit=AI_CONTEXT_HISTORY_SCAN_LIMIT,
-        before=message,
-        oldest_first=False,
-    ):
-        history_messages.append(previous_message)
+    context_entries, current_entries = await fetch_ai_mention_context_entries([message], bot_user_id, token_budget)
+    return context_entries, current_entries[0]
+
+
+async def fetch_ai_mention_context_entries(
+    batch_messages: list[discord.Message],
+    bot_user_id: int,
+    token_budget: int = AI_CONTEXT_TOKEN_BUDGET,
+) -> tuple[list[AIContextEntry], list[AIContextEntry]]:
+    message = batch_messages[0]
+    message_id = getattr(message, "id", None)
+    buffer = get_ai_context_buffer(getattr(message.channel, "id", None))
+    if buffer is not None and buffer.warm and message_id is not None:
+        buffered_newest_first = [
+            buffered
+            for buffered in reversed(buffer.messages.values())
+            if buffered.message_id < message_id
+        ]
+    else:
+        buffered_newest_first = await load_ai_context_history(message, bot_user_id)
+        buffer = get_ai_context_buffer(getattr(message.channel, "id", None))
+
+    current_base_entry = build_ai_context_base_entry(message, strip_bot_mention_id=bot_user_id)
+    if current_base_entry is None:
+        author_name = getattr(message.author, "display_name", str(message.author))
+        current_base_entry = AIContextEntry(author_name=author_name, text="", image_urls=[])
+    # Mentions coalesced into this reply share its preview limit and token budget.
+    coalesced_base_entries = [
+        entry
+        for entry in (
+            build_ai_context_base_entry(batched_message, strip_bot_mention_id=bot_user_id)
+            for batched_message in batch_messages[1:]
+        )
+        if entry is not None
+    ]
+    # Images are sent for the messages being answered first, then for history newest-first.
+    image_slots = AI_CONTEXT_IMAGE_LIMIT
+    if coalesced_base_entries:
+        coalesced_slots = image_slots - min(len(current_base_entry.image_urls), image_slots)
+        token_budget -= sum(count_ai_context_entries_tokens(coalesced_base_entries, coalesced_slots))
+        image_slots -= min(sum(len(entry.image_urls) for entry in coalesced_base_entries), coalesced_slots)
+
+    # Keep the window's oldest message fixed while the window still fits within the
+    # slack, so consecutive prompts share a byte-identical prefix for provider caching.
+    selected_base_entries = None
+    if AI_PROMPT_CACHE_STABLE_WINDOW and buffer is not None and buffer.prompt_anchor_id is not None:
+        selected_base_entries = select_ai_anchored_context_entries(
+            iter_ai_context_base_entries(buffered_newest_first),
+            current_base_entry,
+            buffer.prompt_anchor_id,
+            token_budget + AI_PROMPT_CACHE_WINDOW_SLACK_TOKENS,
+            image_slots,
+        )
+    if selected_base_entries is None:
+        # Entries are pulled newest-first and selection stops at the budget, so older
+        # messages are never tokenized and their links are never fetched.
+        selected_base_entries = select_ai_context_entries(
+            iter_ai_context_base_entries(buffered_newest_first),
+            current_base_entry,
+            token_budget=token_budget,
+            image_slots=image_slots,
+        )
+        if buffer is not None and selected_base_entries:
+            buffer.prompt_anchor_id = selected_base_entries[0].message_id
 
     preview_cache: dict[str, str | None] = {}
     preview_state = {"used": 0}
-    history_entries_newest_first: list[AIContextEntry] = []
-    for previous_message in history_messages:
-        previous_content = getattr(previous_message, "content", "") or ""
-        if message_mentions_bot_content(previous_content, bot_user_id):
-            previous_prompt = extract_bot_mention_prompt(previous_content, bot_user_id)
-            if is_ai_reset_prompt(previous_prompt):
-                break
-        entry = await build_ai_context_entry(previous_message, preview_cache, preview_state)
-        if entry is None:
-            continue
-        history_entries_newest_first.append(entry)
+    link_urls = list(current_base_entry.link_urls)
+    for base_entry in coalesced_base_entries:
+        link_urls.extend(base_entry.link_urls)
+    for base_entry in reversed(selected_base_entries):
+        link_urls.extend(base_entry.link_urls)
+    await prefetch_url_previews(link_urls, preview_cache, preview_state)
+
+    context_entries = [
+        await attach_ai_link_previews(base_entry, preview_cache, preview_state)
+        for base_entry in selected_base_entries
+    ]
+    current_entries = [
+        await attach_ai_link_previews(base_entry, preview_cache, preview_state)
+        for base_entry in [current_base_entry, *coalesced_base_entries]
+    ]
+    return context_entries, current_entries
 
-    current_entry = await build_ai_context_entry(
-        message,
-        preview_cache,
-        preview_state,
-        strip_bot_mention_id=bot_user_id,
-    )
-    if current_entry is None:
-        author_name = getattr(message.author, "display_name", str(message.author))
-        current_entry = AIContextEntry(author_name=author_name, text="", image_urls=[])
 
-    context_entries = select_ai_context_entries(history_entries_newest_first, current_entry)
-    return context_entries, current_entry
+def build_ai_channel_summary_lines(channel_summary: str | None) -> list[str]:
+    if not channel_summary:
+        return []
+    return ["Summary of earlier conversation in this channel:", channel_summary, ""]
 
 
 def build_ai_conversation_prompt(
     context_entries: list[AIContextEntry],
     current_entry: AIContextEntry,
+    channel_summary: str | None = None,
 ) -> str:
-    lines = ["Recent Discord conversation from the same channel:"]
+    lines = build_ai_channel_summary_lines(channel_summary)
+    lines.append("Recent Discord conversation from the same channel:")
     for entry in context_entries:
         lines.append(format_ai_context_entry(entry))
     lines.append(format_ai_context_entry(current_entry))
@@ -811,6 +2113,41 @@ def build_ai_conversation_prompt(
     return "\n".join(lines)
 
 
+def build_ai_coalesced_conversation_prompt(
+    context_entries: list[AIContextEntry],
+    current_entries: list[AIContextEntry],
+    channel_summary: str | None = None,
+) -> str:
+    if len(current_entries) == 1:
+        return build_ai_conversation_prompt(context_entries, current_entries[0], channel_summary)
+
+    lines = build_ai_channel_summary_lines(channel_summary)
+    lines.append("Recent Discord conversation from the same channel:")
+    for entry in [*context_entries, *current_entries]:
+        lines.append(format_ai_context_entry(entry))
+    lines.append("")
+    lines.append(
+        f"The last {len(current_entries)} messages were all addressed to you at once. "
+        "Reply to each of them in a single message, addressing each asker by name."
+    )
+    return "\n".join(lines)
+
+
+def chunk_message_lines(lines: list[str], max_chars: int = DISCORD_MESSAGE_MAX_CHARS) -> list[str]:
+    chunks = []
+    current = ""
+    for line in lines:
+        line = line[:max_chars]
+        if current and len(current) + 1 + len(line) > max_chars:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 def trim_ai_reply(text: str, max_chars: int = AI_MAX_REPLY_CHARS) -> str:
     text = text.strip()
     if len(text) <= max_chars:
@@ -828,35 +2165,99 @@ def get_ai_mention_channel_status(guild_id: int | None, channel_id: int | None)
 
 def get_ai_timeout_remaining(user_id: int, now: float | None = None) -> float:
     current_time = time.monotonic() if now is None else now
-    timeout_until = ai_user_timeout_until.get(user_id)
-    if timeout_until is None:
+    bucket = ai_rate_limit_buckets.get(user_id)
+    if bucket is None:
         return 0.0
-    remaining = timeout_until - current_time
-    if remaining <= 0:
-        ai_user_timeout_until.pop(user_id, None)
-        return 0.0
-    return remaining
+    return max(0.0, bucket.timeout_until - current_time)
 
 
 def register_ai_prompt_attempt(user_id: int, now: float | None = None) -> float:
+    global ai_rate_limit_timeouts_dirty
+
     current_time = time.monotonic() if now is None else now
-    timeout_remaining = get_ai_timeout_remaining(user_id, current_time)
-    if timeout_remaining > 0:
-        return timeout_remaining
+    bucket = ai_rate_limit_buckets.get(user_id)
+    if bucket is None:
+        bucket = AIRateLimitBucket()
+        ai_rate_limit_buckets[user_id] = bucket
+        evict_ai_rate_limit_buckets(current_time)
+    else:
+        ai_rate_limit_buckets.move_to_end(user_id)
 
-    prompt_times = ai_recent_prompt_times.setdefault(user_id, deque())
-    while prompt_times and (current_time - prompt_times[0]) >= AI_RATE_LIMIT_WINDOW_SECONDS:
-        prompt_times.popleft()
+    if bucket.timeout_until > current_time:
+        return bucket.timeout_until - current_time
 
-    prompt_times.append(current_time)
-    if len(prompt_times) > AI_RATE_LIMIT_MAX_REQUESTS:
-        ai_user_timeout_until[user_id] = current_time + AI_RATE_LIMIT_TIMEOUT_SECONDS
+    # The ring keeps only the last AI_RATE_LIMIT_MAX_REQUESTS prompts; if the oldest of them is
+    # still inside the window, this prompt is one too many for the sliding window.
+    prompt_times = bucket.prompt_times
+    if len(prompt_times) >= AI_RATE_LIMIT_MAX_REQUESTS and (current_time - prompt_times[0]) < AI_RATE_LIMIT_WINDOW_SECONDS:
+        bucket.timeout_until = current_time + AI_RATE_LIMIT_TIMEOUT_SECONDS
         prompt_times.clear()
+        ai_rate_limit_timeouts_dirty = True
         return AI_RATE_LIMIT_TIMEOUT_SECONDS
 
+    prompt_times.append(current_time)
     return 0.0
 
 
+def evict_ai_rate_limit_buckets(current_time: float):
+    while len(ai_rate_limit_buckets) > AI_RATE_LIMIT_MAX_TRACKED_USERS:
+        # Evicting a timed-out user would end their timeout, so only evict users who are not in one.
+        evictable_user_id = next(
+            (
+                user_id
+                for user_id, bucket in ai_rate_limit_buckets.items()
+                if bucket.timeout_until <= current_time
+            ),
+            None,
+        )
+        if evictable_user_id is None:
+            return
+        ai_rate_limit_buckets.pop(evictable_user_id)
+
+
+def sweep_ai_rate_limit_buckets(now: float | None = None) -> int:
+    current_time = time.monotonic() if now is None else now
+    idle_user_ids = [
+        user_id
+        for user_id, bucket in ai_rate_limit_buckets.items()
+        if bucket.timeout_until <= current_time
+        and (not bucket.prompt_times or (current_time - bucket.prompt_times[-1]) >= AI_RATE_LIMIT_WINDOW_SECONDS)
+    ]
+    for user_id in idle_user_ids:
+        ai_rate_limit_buckets.pop(user_id, None)
+    return len(idle_user_ids)
+
+
+def save_ai_user_timeouts(now: float | None = None):
+    current_time = time.monotonic() if now is None else now
+    wall_offset = time.time() - current_time
+    rows = [
+        (user_id, bucket.timeout_until + wall_offset)
+        for user_id, bucket in ai_rate_limit_buckets.items()
+        if bucket.timeout_until > current_time
+    ]
+    with db_config() as conn:
+        conn.execute("DELETE FROM ai_user_timeouts")
+        conn.executemany(
+            "INSERT INTO ai_user_timeouts(user_id, timeout_until_epoch) VALUES (?, ?)",
+            rows,
+        )
+
+
+def load_ai_user_timeouts(now: float | None = None):
+    current_time = time.monotonic() if now is None else now
+    wall_offset = time.time() - current_time
+    with db_config() as conn:
+        rows = conn.execute("SELECT user_id, timeout_until_epoch FROM ai_user_timeouts").fetchall()
+
+    for row in rows:
+        timeout_until = row["timeout_until_epoch"] - wall_offset
+        if timeout_until <= current_time:
+            continue
+        bucket = ai_rate_limit_buckets.setdefault(int(row["user_id"]), AIRateLimitBucket())
+        bucket.timeout_until = max(bucket.timeout_until, timeout_until)
+
+
 def get_openai_client():
     global ai_client
 
@@ -865,7 +2266,11 @@ def get_openai_client():
     if not OPENAI_API_KEY or AsyncOpenAI is None:
         return None
 
-    ai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    ai_client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        timeout=Timeout(AI_OPENAI_TIMEOUT_SECONDS, connect=AI_OPENAI_CONNECT_TIMEOUT_SECONDS),
+        max_retries=AI_OPENAI_MAX_RETRIES,
+    )
     return ai_client
 
 
@@ -896,21 +2301,635 @@ async def run_ai_smoke_test() -> tuple[bool, str]:
         elapsed_ms = round((time.perf_counter() - started_at) * 1000)
         return False, f"{type(exc).__name__} after {elapsed_ms} ms ({exc})"
 
-    elapsed_ms = round((time.perf_counter() - started_at) * 1000)
-    status = getattr(response, "status", "unknown")
-    output_text = normalize_ai_summary_text(getattr(response, "output_text", "") or "", max_chars=80)
-    incomplete_details = getattr(response, "incomplete_details", None)
-    incomplete_reason = getattr(incomplete_details, "reason", None) if incomplete_details else None
+    elapsed_ms = round((time.perf_counter() - started_at) * 1000)
+    status = getattr(response, "status", "unknown")
+    output_text = normalize_ai_summary_text(getattr(response, "output_text", "") or "", max_chars=80)
+    incomplete_details = getattr(response, "incomplete_details", None)
+    incomplete_reason = getattr(incomplete_details, "reason", None) if incomplete_details else None
+
+    if incomplete_reason:
+        return False, f"incomplete after {elapsed_ms} ms (status={status}, reason={incomplete_reason})"
+    if not output_text:
+        return False, f"empty output after {elapsed_ms} ms (status={status})"
+
+    return True, f"ok after {elapsed_ms} ms (status={status}, output={output_text!r})"
+
+
+async def record_ai_health_probe() -> tuple[bool, str]:
+    started_at = time.perf_counter()
+    ok, message = await run_ai_smoke_test()
+    latency_ms = (time.perf_counter() - started_at) * 1000
+    ai_health_probe_results.append((datetime.now(LOCAL_TZ), ok, latency_ms, message))
+    if not ok:
+        print(f"[ai] health probe failed latency_ms={latency_ms:.0f} result={message}")
+    return ok, message
+
+
+def get_ai_health_probe_lines() -> list[str]:
+    if not ai_health_probe_results:
+        return ["- AI health probe: no results yet"]
+
+    latencies = sorted(latency_ms for _, ok, latency_ms, _ in ai_health_probe_results if ok)
+    failures = [result for result in ai_health_probe_results if not result[1]]
+    checked_at, last_ok, last_latency_ms, _ = ai_health_probe_results[-1]
+    lines = [
+        (
+            f"- AI health probe: last {'PASS' if last_ok else 'FAIL'} at {checked_at.strftime('%H:%M')} "
+            f"({last_latency_ms:.0f} ms), {len(failures)}/{len(ai_health_probe_results)} recent failures"
+        )
+    ]
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.95) - 1)]
+        buckets = []
+        lower_ms = 0
+        for upper_ms in AI_HEALTH_PROBE_LATENCY_BUCKETS_MS:
+            buckets.append(f"<{upper_ms}ms: {sum(1 for value in latencies if lower_ms <= value < upper_ms)}")
+            lower_ms = upper_ms
+        buckets.append(f">={lower_ms}ms: {sum(1 for value in latencies if value >= lower_ms)}")
+        lines.append(f"  - Latency p50 {p50:.0f} ms, p95 {p95:.0f} ms ({', '.join(buckets)})")
+    for checked_at, _, _, message in failures[-3:]:
+        lines.append(f"  - {checked_at.strftime('%H:%M')} FAIL - {message}")
+    return lines
+
+
+def extract_ai_response_text(response) -> str:
+    direct_text = trim_ai_reply(getattr(response, "output_text", "") or "")
+    if direct_text:
+        return direct_text
+
+    content_parts = []
+    for item in getattr(response, "output", None) or []:
+        if getattr(item, "type", None) != "message":
+            continue
+        for part in getattr(item, "content", None) or []:
+            if getattr(part, "type", None) != "output_text":
+                continue
+            text = trim_ai_reply(getattr(part, "text", "") or "")
+            if text:
+                content_parts.append(text)
+
+    return "\n".join(content_parts).strip()
+
+
+async def read_ai_response_stream(stream, on_partial_text):
+    streamed_text = ""
+    final_response = None
+    async for event in stream:
+        event_type = getattr(event, "type", None)
+        if event_type == "response.output_text.delta":
+            streamed_text += getattr(event, "delta", "") or ""
+            partial_text = trim_ai_reply(streamed_text)
+            if partial_text:
+                await on_partial_text(partial_text)
+        elif event_type in {"response.completed", "response.incomplete", "response.failed"}:
+            final_response = getattr(event, "response", None)
+        elif event_type == "error":
+            raise AIStreamError(f"AI stream error: {getattr(event, 'message', None) or 'unknown'}")
+
+    if final_response is None:
+        return AIStreamedResponse(output_text=streamed_text, status="incomplete")
+    return AIStreamedResponse(
+        output_text=extract_ai_response_text(final_response) or streamed_text,
+        status=getattr(final_response, "status", None),
+        incomplete_details=getattr(final_response, "incomplete_details", None),
+        usage=getattr(final_response, "usage", None),
+    )
+
+
+class AIRequestScheduler:
+    def __init__(self, max_concurrency: int, max_queue_depth: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.active = 0
+        self.waiting: list[tuple[float, int, int | None, asyncio.Future]] = []
+        self.virtual_time = 0.0
+        self.guild_finish_tags: dict[int | None, float] = {}
+        self.sequence = 0
+        self.served = 0
+        self.rejected = 0
+
+    def queued_count(self) -> int:
+        return sum(1 for *_, waiter in self.waiting if not waiter.done())
+
+    def try_acquire(self) -> bool:
+        if self.active < self.max_concurrency and not self.queued_count():
+            self.active += 1
+            return True
+        return False
+
+    async def acquire(self, guild_id: int | None, max_wait_seconds: float):
+        if self.try_acquire():
+            return
+        if self.queued_count() >= self.max_queue_depth:
+            self.rejected += 1
+            raise AISchedulerBusyError("AI request queue is full.")
+
+        # Weighted fair queuing: each guild's next request is tagged after its previous one,
+        # so a busy guild cannot push ahead of guilds that have been waiting.
+        weight = AI_SCHEDULER_GUILD_WEIGHTS.get(guild_id, 1.0)
+        finish_tag = max(self.virtual_time, self.guild_finish_tags.get(guild_id, 0.0)) + (1.0 / weight)
+        self.guild_finish_tags[guild_id] = finish_tag
+        self.sequence += 1
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (finish_tag, self.sequence, guild_id, waiter))
+
+        try:
+            await asyncio.wait_for(waiter, timeout=max_wait_seconds)
+        except asyncio.TimeoutError:
+            # release() can hand over the slot just as the wait times out.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            self.rejected += 1
+            raise AISchedulerBusyError(f"AI request waited more than {max_wait_seconds}s for a slot.")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiting:
+            finish_tag, _, _, waiter = heapq.heappop(self.waiting)
+            if waiter.done():
+                continue
+            self.virtual_time = finish_tag
+            waiter.set_result(None)
+            return
+
+        self.active -= 1
+        if self.active == 0:
+            self.virtual_time = 0.0
+            self.guild_finish_tags.clear()
+
+    async def run(self, guild_id: int | None, request_factory, max_wait_seconds: float = AI_SCHEDULER_MAX_WAIT_SECONDS):
+        await self.acquire(guild_id, max_wait_seconds)
+        try:
+            return await request_factory()
+        finally:
+            self.served += 1
+            self.release()
+
+    def summary(self) -> str:
+        return (
+            f"{self.active}/{self.max_concurrency} active, {self.queued_count()}/{self.max_queue_depth} queued, "
+            f"{self.served} served, {self.rejected} rejected as busy"
+        )
+
+
+def is_ai_outage_error(exc: BaseException) -> bool:
+    if isinstance(exc, APIConnectionError):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    return isinstance(exc, APIError) and status_code is not None and status_code >= 500
+
+
+def is_ai_upstream_answer_error(exc: BaseException) -> bool:
+    if isinstance(exc, (AIEmptyResponseError, AIIncompleteResponseError)):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    return isinstance(exc, APIStatusError) and status_code is not None and 400 <= status_code < 500
+
+
+class AICircuitBreaker:
+    def __init__(self, failure_threshold: int, open_seconds: float, history_size: int):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.fast_failures = 0
+        self.generation = 0
+        self.transitions: deque[tuple[datetime, str, str, str]] = deque(maxlen=history_size)
+
+    def _transition(self, state: str, reason: str):
+        if state == self.state:
+            return
+        self.transitions.append((datetime.now(LOCAL_TZ), self.state, state, reason))
+        print(f"[ai] circuit {self.state} -> {state} reason={reason}")
+        self.state = state
+        if state != "closed":
+            # Requests started before this point no longer say anything about the upstream.
+            self.generation += 1
+
+    def is_open(self, now: float | None = None) -> bool:
+        current_time = time.monotonic() if now is None else now
+        if self.state == "open":
+            return current_time - self.opened_at < self.open_seconds
+        return self.state == "half_open" and self.probe_in_flight
+
+    def start_request(self, now: float | None = None) -> tuple[int, bool]:
+        current_time = time.monotonic() if now is None else now
+        if self.is_open(current_time):
+            self.fast_failures += 1
+            raise AICircuitOpenError("AI circuit is open after repeated upstream failures.")
+        if self.state == "open":
+            # Let exactly one request through to test whether the upstream has recovered.
+            self._transition("half_open", "cooldown elapsed")
+        if self.state == "half_open":
+            self.probe_in_flight = True
+            return self.generation, True
+        return self.generation, False
+
+    def record_success(self, generation: int):
+        if generation != self.generation:
+            return
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self._transition("closed", "request succeeded")
+
+    def record_failure(self, exc: BaseException, generation: int, now: float | None = None):
+        if generation != self.generation:
+            return
+        self.probe_in_flight = False
+        if is_ai_upstream_answer_error(exc):
+            # The upstream answered, so it is reachable even if this request was rejected.
+            self.consecutive_failures = 0
+            self._transition("closed", f"upstream answered with {type(exc).__name__}")
+            return
+        if not is_ai_outage_error(exc):
+            # Errors such as a failed Discord edit say nothing about the upstream.
+            return
+
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic() if now is None else now
+            reason = normalize_ai_summary_text(f"{type(exc).__name__}: {exc}", max_chars=80)
+            self._transition("open", reason)
+
+    def release_probe(self, generation: int):
+        if generation == self.generation:
+            self.probe_in_flight = False
+
+    def summary(self) -> str:
+        summary = f"{self.state}, {self.consecutive_failures} consecutive failures, {self.fast_failures} fast-failed"
+        if self.state == "open":
+            remaining = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+            summary += f", probing in {math.ceil(remaining)}s"
+        return summary
+
+    def transition_lines(self) -> list[str]:
+        return [
+            f"  - {changed_at.strftime('%H:%M:%S')} {previous} -> {state} ({reason})"
+            for changed_at, previous, state, reason in self.transitions
+        ]
+
+
+async def run_ai_request_with_circuit_breaker(request_factory):
+    generation, is_probe = ai_circuit_breaker.start_request()
+    try:
+        result = await request_factory()
+    except Exception as exc:
+        ai_circuit_breaker.record_failure(exc, generation)
+        raise
+    except BaseException:
+        if is_probe:
+            ai_circuit_breaker.release_probe(generation)
+        raise
+    ai_circuit_breaker.record_success(generation)
+    return result
+
+
+class AIOutputBudgetStats:
+    def __init__(self, history_size: int):
+        self.output_tokens: deque[int] = deque(maxlen=history_size)
+        self.reasoning_tokens: deque[int] = deque(maxlen=history_size)
+        self.first_attempts = 0
+        self.retries = 0
+        self.retry_seconds = 0.0
+        self.avoided_retries = 0
+
+    def choose_max_output_tokens(self) -> int:
+        if len(self.output_tokens) < AI_OUTPUT_BUDGET_MIN_SAMPLES:
+            return AI_MAX_OUTPUT_TOKENS
+        ordered = sorted(self.output_tokens)
+        used = ordered[min(len(ordered) - 1, math.ceil(len(ordered) * AI_OUTPUT_BUDGET_PERCENTILE) - 1)]
+        budget = math.ceil(used * AI_OUTPUT_BUDGET_HEADROOM)
+        return max(AI_MAX_OUTPUT_TOKENS, min(AI_RETRY_MAX_OUTPUT_TOKENS, budget))
+
+    def record_retry(self, wasted_seconds: float):
+        self.retries += 1
+        self.retry_seconds += wasted_seconds
+
+    def record_result(self, response, initial_budget: int, retried: bool):
+        self.first_attempts += 1
+        usage = getattr(response, "usage", None)
+        output_tokens = getattr(usage, "output_tokens", None)
+        status = getattr(response, "status", None)
+        truncated = (
+            status == "incomplete"
+            and getattr(getattr(response, "incomplete_details", None), "reason", None) == "max_output_tokens"
+        )
+        if truncated:
+            # A cut-off reply needed more than its budget; leaving it out would bias the percentile low.
+            budget = AI_RETRY_MAX_OUTPUT_TOKENS if retried else initial_budget
+            output_tokens = max(output_tokens or 0, budget + 1)
+        elif status != "completed" or not output_tokens:
+            return
+        self.output_tokens.append(output_tokens)
+        details = getattr(usage, "output_tokens_details", None)
+        self.reasoning_tokens.append(getattr(details, "reasoning_tokens", 0) or 0)
+        if (
+            not truncated
+            and not retried
+            and output_tokens > AI_MAX_OUTPUT_TOKENS
+            and initial_budget > AI_MAX_OUTPUT_TOKENS
+        ):
+            # The fixed starting budget would have cut this reply off and forced a second round trip.
+            self.avoided_retries += 1
+
+    def summary(self) -> str:
+        retry_rate = f"{self.retries * 100 / self.first_attempts:.1f}%" if self.first_attempts else "n/a"
+        summary = f"next {self.choose_max_output_tokens()}, {self.retries}/{self.first_attempts} retried ({retry_rate})"
+        if self.output_tokens:
+            ordered = sorted(self.output_tokens)
+            reasoning_avg = sum(self.reasoning_tokens) / len(self.reasoning_tokens)
+            summary += f", p50 used {ordered[len(ordered) // 2]}, reasoning avg {reasoning_avg:.0f}"
+        if self.avoided_retries:
+            saved = ""
+            if self.retries:
+                saved = f" (~{self.avoided_retries * self.retry_seconds / self.retries:.1f}s saved)"
+            summary += f", {self.avoided_retries} retries avoided{saved}"
+        return summary
+
+
+def get_ai_output_budget_stats(model: str) -> AIOutputBudgetStats:
+    stats = ai_output_budget_stats.get(model)
+    if stats is None:
+        stats = AIOutputBudgetStats(AI_OUTPUT_BUDGET_HISTORY_SIZE)
+        ai_output_budget_stats[model] = stats
+    return stats
+
+
+def get_ai_output_budget_summary() -> str:
+    if not ai_output_budget_stats:
+        return "no replies yet"
+    return "; ".join(f"`{model}` {stats.summary()}" for model, stats in ai_output_budget_stats.items())
+
+
+class AIHedgeStats:
+    def __init__(self, history_size: int):
+        self.latencies: deque[float] = deque(maxlen=history_size)
+        self.recent_hedges: deque[bool] = deque(maxlen=history_size)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedge_losses = 0
+        self.capped = 0
+        self.busy = 0
+
+    def hedge_delay(self) -> float | None:
+        if len(self.latencies) < AI_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * AI_HEDGE_PERCENTILE) - 1)]
+
+    def can_hedge(self) -> bool:
+        return sum(self.recent_hedges) < AI_HEDGE_MAX_RATE * max(1, len(self.recent_hedges))
+
+    def summary(self) -> str:
+        delay = self.hedge_delay()
+        delay_text = f"after {delay:.2f}s" if delay is not None else "warming up"
+        return (
+            f"{delay_text}, {self.hedges}/{self.requests} hedged, "
+            f"{self.hedge_wins} won, {self.hedge_losses} lost, {self.capped} capped, "
+            f"{self.busy} skipped while busy"
+        )
+
+
+def get_ai_hedge_stats(model: str, streaming: bool) -> AIHedgeStats:
+    key = (model, streaming)
+    stats = ai_hedge_stats.get(key)
+    if stats is None:
+        stats = AIHedgeStats(AI_HEDGE_HISTORY_SIZE)
+        ai_hedge_stats[key] = stats
+    return stats
+
+
+def get_ai_hedge_summary() -> str:
+    if not AI_HEDGE_REQUESTS:
+        return "off"
+    if not ai_hedge_stats:
+        return "no requests yet"
+    return "; ".join(
+        f"`{model}`{' streamed' if streaming else ''} {stats.summary()}"
+        for (model, streaming), stats in ai_hedge_stats.items()
+    )
+
+
+async def run_hedged_ai_request(stats: AIHedgeStats, create_attempt, on_partial_text=None):
+    # Streamed attempts race to their first text so only one of them ever edits the reply;
+    # plain attempts race to completion.
+    started_at = time.perf_counter()
+    attempts: list[asyncio.Task] = []
+    winner: list[int] = []
+
+    def claim(index: int) -> bool:
+        if not winner:
+            winner.append(index)
+            stats.latencies.append(time.perf_counter() - started_at)
+            for other_index, task in enumerate(attempts):
+                if other_index != index:
+                    task.cancel()
+        return winner[0] == index
+
+    async def forward(index: int, text: str):
+        if claim(index):
+            await on_partial_text(text)
+
+    def start_attempt(index: int):
+        callback = partial(forward, index) if on_partial_text is not None else None
+        task = asyncio.create_task(create_attempt(callback))
+        if index:
+            task.add_done_callback(lambda task: ai_request_scheduler.release())
+        attempts.append(task)
+
+    stats.requests += 1
+    start_attempt(0)
+    hedged = False
+    try:
+        delay = stats.hedge_delay()
+        if delay is not None:
+            await asyncio.wait(attempts, timeout=delay)
+            if not winner and not attempts[0].done():
+                if not stats.can_hedge():
+                    stats.capped += 1
+                elif not ai_request_scheduler.try_acquire():
+                    # The hedge is a second upstream request, so it needs its own scheduler slot.
+                    stats.busy += 1
+                else:
+                    hedged = True
+                    stats.hedges += 1
+                    print(f"[ai] hedging slow request after {delay:.2f}s")
+                    start_attempt(1)
+        stats.recent_hedges.append(hedged)
+
+        pending = set(attempts)
+        first_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    first_error = first_error or task.exception()
+                    continue
+                index = attempts.index(task)
+                if not claim(index):
+                    continue
+                if hedged:
+                    if index == 1:
+                        stats.hedge_wins += 1
+                    else:
+                        stats.hedge_losses += 1
+                return task.result()
+        raise first_error or AIEmptyResponseError("AI response was empty.")
+    finally:
+        for task in attempts:
+            task.cancel()
+        # Let cancelled losers unwind so their billed usage is recorded before the reply returns.
+        await asyncio.gather(*attempts, return_exceptions=True)
+
+
+def count_ai_link_previews(entries: list[AIContextEntry]) -> int:
+    return sum(entry.link_preview_count for entry in entries)
+
+
+def count_ai_request_prompt_tokens(conversation_prompt: str) -> int:
+    # Instructions are billed as input too, so tier limits apply to what is actually sent.
+    return count_text_tokens(get_ai_system_prompt()) + count_text_tokens(conversation_prompt)
+
+
+def select_ai_model_tier(prompt_tokens: int, image_count: int, preview_count: int) -> dict:
+    for tier in AI_MODEL_TIERS:
+        if (
+            prompt_tokens <= tier.get("max_prompt_tokens", math.inf)
+            and image_count <= tier.get("max_images", math.inf)
+            and preview_count <= tier.get("max_previews", math.inf)
+        ):
+            return tier
+    return AI_MODEL_TIERS[-1]
+
+
+def record_ai_model_tier_request(
+    tier_name: str,
+    prompt_tokens: int,
+    image_count: int,
+    preview_count: int,
+    elapsed_seconds: float,
+    ok: bool,
+):
+    stats = ai_model_tier_stats.get(tier_name)
+    if stats is None:
+        stats = {
+            "requests": 0,
+            "failures": 0,
+            "prompt_tokens": 0,
+            "images": 0,
+            "previews": 0,
+            "latencies": deque(maxlen=AI_LATENCY_HISTORY_SIZE),
+        }
+        ai_model_tier_stats[tier_name] = stats
+    stats["requests"] += 1
+    stats["prompt_tokens"] += prompt_tokens
+    stats["images"] += image_count
+    stats["previews"] += preview_count
+    if ok:
+        stats["latencies"].append(elapsed_seconds)
+    else:
+        stats["failures"] += 1
+
+
+def get_ai_model_tier_summary() -> str:
+    if not ai_model_tier_stats:
+        return "no requests yet"
+    parts = []
+    for tier in AI_MODEL_TIERS:
+        stats = ai_model_tier_stats.get(tier["name"])
+        if stats is None:
+            continue
+        latencies = sorted(stats["latencies"])
+        latency = "n/a"
+        if latencies:
+            p95 = latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.95) - 1)]
+            latency = f"p50 {latencies[len(latencies) // 2]:.2f}s p95 {p95:.2f}s"
+        parts.append(
+            f"{tier['name']} (`{tier['model']}`) {stats['requests']} req, {stats['failures']} failed, "
+            f"avg {stats['prompt_tokens'] / stats['requests']:.0f} prompt tokens, {latency}"
+        )
+    return "; ".join(parts)
+
+
+def build_ai_request_key(
+    system_prompt: str,
+    conversation_prompt: str,
+    image_urls: list[str],
+    model: str = OPENAI_MODEL,
+) -> str:
+    hasher = hashlib.sha256()
+    for part in (model, system_prompt, conversation_prompt, *image_urls):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def build_ai_dedupe_text(channel_id: int, current_entries: list[AIContextEntry]) -> str:
+    # Keyed on what was asked rather than who asked it or the history around it, so a burst
+    # of people sending the same mention shares one reply.
+    lines = [f"channel {channel_id}"]
+    for entry in current_entries:
+        lines.append(" ".join(entry.text.casefold().split()))
+    return "\n".join(lines)
+
 
-    if incomplete_reason:
-        return False, f"incomplete after {elapsed_ms} ms (status={status}, reason={incomplete_reason})"
-    if not output_text:
-        return False, f"empty output after {elapsed_ms} ms (status={status})"
+async def fan_out_ai_partial_text(callbacks: list, text: str):
+    for callback in list(callbacks):
+        await callback(text)
 
-    return True, f"ok after {elapsed_ms} ms (status={status}, output={output_text!r})"
+
+def get_cached_ai_reply(request_key: str, now: float | None = None) -> str | None:
+    current_time = time.monotonic() if now is None else now
+    cached = ai_reply_cache.get(request_key)
+    if cached is None:
+        return None
+    reply_text, expires_at = cached
+    if expires_at <= current_time:
+        ai_reply_cache.pop(request_key, None)
+        return None
+    return reply_text
+
+
+def _finish_inflight_ai_reply(request_key: str, task: asyncio.Task):
+    if ai_inflight_replies.get(request_key) is task:
+        ai_inflight_replies.pop(request_key, None)
+        ai_inflight_partial_callbacks.pop(request_key, None)
+    if task.cancelled() or task.exception() is not None:
+        return
+
+    ai_reply_cache[request_key] = (task.result(), time.monotonic() + AI_REPLY_CACHE_TTL_SECONDS)
+    ai_reply_cache.move_to_end(request_key)
+    while len(ai_reply_cache) > AI_REPLY_CACHE_SIZE:
+        ai_reply_cache.popitem(last=False)
+
+
+def get_ai_dedupe_summary() -> str:
+    return (
+        f"{ai_dedupe_stats['cache_hits']} cache hits, "
+        f"{ai_dedupe_stats['inflight_joins']} in-flight joins, "
+        f"{ai_dedupe_stats['requests']} upstream requests"
+    )
 
 
-async def request_ai_reply(conversation_prompt: str, image_urls: list[str] | None = None) -> str:
+async def request_ai_reply(
+    conversation_prompt: str,
+    image_urls: list[str] | None = None,
+    on_partial_text=None,
+    guild_id: int | None = None,
+    prompt_cache_key: str | None = None,
+    model: str = OPENAI_MODEL,
+    usage_record: AIUsageRecord | None = None,
+    dedupe_text: str | None = None,
+) -> str:
     client = get_openai_client()
     if client is None:
         reason = "missing OPENAI_API_KEY"
@@ -918,54 +2937,186 @@ async def request_ai_reply(conversation_prompt: str, image_urls: list[str] | Non
             reason = f"openai package unavailable: {OPENAI_IMPORT_ERROR}"
         raise AIConfigurationError(f"AI replies are not configured: {reason}")
 
-    request_input = build_ai_request_input(conversation_prompt, image_urls or [])
+    image_urls = image_urls or []
     system_prompt = get_ai_system_prompt()
+    request_key = build_ai_request_key(
+        system_prompt,
+        conversation_prompt if dedupe_text is None else dedupe_text,
+        image_urls,
+        model,
+    )
 
-    async def _create_response(max_output_tokens: int):
-        return await client.responses.create(
-            model=OPENAI_MODEL,
-            instructions=system_prompt,
-            input=request_input,
-            max_output_tokens=max_output_tokens,
-            reasoning={"effort": AI_REASONING_EFFORT},
-            text={"verbosity": AI_TEXT_VERBOSITY},
+    cached_reply = get_cached_ai_reply(request_key)
+    if cached_reply is not None:
+        ai_dedupe_stats["cache_hits"] += 1
+        if usage_record is not None:
+            usage_record.source = "cache"
+        return cached_reply
+
+    task = ai_inflight_replies.get(request_key)
+    if task is None:
+        if ai_circuit_breaker.is_open():
+            ai_circuit_breaker.fast_failures += 1
+            raise AICircuitOpenError("AI circuit is open after repeated upstream failures.")
+        ai_dedupe_stats["requests"] += 1
+        if usage_record is not None:
+            usage_record.source = "upstream"
+            usage_record.requested_at = time.perf_counter()
+        shared_partial_text = None
+        if on_partial_text is not None:
+            # Everyone waiting on this request streams the same partial text into their own reply.
+            partial_callbacks = [on_partial_text]
+            ai_inflight_partial_callbacks[request_key] = partial_callbacks
+            shared_partial_text = partial(fan_out_ai_partial_text, partial_callbacks)
+        task = asyncio.create_task(
+            ai_request_scheduler.run(
+                guild_id,
+                partial(
+                    run_ai_request_with_circuit_breaker,
+                    partial(
+                        create_ai_reply,
+                        client,
+                        system_prompt,
+                        conversation_prompt,
+                        image_urls,
+                        shared_partial_text,
+                        prompt_cache_key,
+                        model,
+                        usage_record,
+                    ),
+                ),
+            )
+        )
+        ai_inflight_replies[request_key] = task
+        task.add_done_callback(partial(_finish_inflight_ai_reply, request_key))
+    else:
+        ai_dedupe_stats["inflight_joins"] += 1
+        if usage_record is not None:
+            usage_record.source = "joined"
+        partial_callbacks = ai_inflight_partial_callbacks.get(request_key)
+        if partial_callbacks is not None and on_partial_text is not None:
+            partial_callbacks.append(on_partial_text)
+
+    # Shield the shared request so one cancelled waiter does not cancel it for everyone else.
+    return await asyncio.shield(task)
+
+
+async def request_tiered_ai_reply(
+    tier: dict,
+    prompt_tokens: int,
+    preview_count: int,
+    conversation_prompt: str,
+    image_urls: list[str] | None = None,
+    **request_kwargs,
+) -> str:
+    image_count = min(len(image_urls or []), AI_CONTEXT_IMAGE_LIMIT)
+    started_at = time.perf_counter()
+    try:
+        reply_text = await request_ai_reply(
+            conversation_prompt,
+            image_urls=image_urls,
+            model=tier["model"],
+            **request_kwargs,
+        )
+    except Exception:
+        record_ai_model_tier_request(
+            tier["name"], prompt_tokens, image_count, preview_count, time.perf_counter() - started_at, ok=False
         )
+        raise
+    record_ai_model_tier_request(
+        tier["name"], prompt_tokens, image_count, preview_count, time.perf_counter() - started_at, ok=True
+    )
+    return reply_text
+
+
+async def create_ai_reply(
+    client,
+    system_prompt: str,
+    conversation_prompt: str,
+    image_urls: list[str],
+    on_partial_text=None,
+    prompt_cache_key: str | None = None,
+    model: str = OPENAI_MODEL,
+    usage_record: AIUsageRecord | None = None,
+) -> str:
+    if usage_record is not None and usage_record.requested_at is not None:
+        usage_record.queue_ms = (time.perf_counter() - usage_record.requested_at) * 1000
+    request_input = build_ai_request_input(conversation_prompt, image_urls)
+
+    async def _create_response(max_output_tokens: int, partial_text_callback=on_partial_text):
+        started_at = time.perf_counter()
+        request_kwargs = {
+            "model": model,
+            "instructions": system_prompt,
+            "input": request_input,
+            "max_output_tokens": max_output_tokens,
+            "reasoning": {"effort": AI_REASONING_EFFORT},
+            "text": {"verbosity": AI_TEXT_VERBOSITY},
+        }
+        if prompt_cache_key is not None:
+            # Sent as a raw body field so SDKs older than the prompt_cache_key keyword still work.
+            request_kwargs["extra_body"] = {"prompt_cache_key": prompt_cache_key}
+        if partial_text_callback is None:
+            response = await client.responses.create(**request_kwargs)
+        else:
+            stream = await client.responses.create(**request_kwargs, stream=True)
+            response = await read_ai_response_stream(stream, partial_text_callback)
+        record_ai_prompt_cache_usage(response, time.perf_counter() - started_at)
+        add_ai_response_usage(usage_record, response)
+        return response
 
-    def _extract_response_text(response) -> str:
-        direct_text = trim_ai_reply(getattr(response, "output_text", "") or "")
-        if direct_text:
-            return direct_text
+    budget_stats = get_ai_output_budget_stats(model)
+    initial_budget = budget_stats.choose_max_output_tokens()
+    cancelled_attempt_texts: list[str] = []
 
-        content_parts = []
-        for item in getattr(response, "output", None) or []:
-            if getattr(item, "type", None) != "message":
-                continue
-            for part in getattr(item, "content", None) or []:
-                if getattr(part, "type", None) != "output_text":
-                    continue
-                text = trim_ai_reply(getattr(part, "text", "") or "")
-                if text:
-                    content_parts.append(text)
+    async def _create_hedge_attempt(partial_text_callback):
+        streamed_text = ""
+
+        async def track_partial_text(text: str):
+            nonlocal streamed_text
+            streamed_text = text
+            await partial_text_callback(text)
 
-        return "\n".join(content_parts).strip()
+        try:
+            return await _create_response(
+                initial_budget, track_partial_text if partial_text_callback is not None else None
+            )
+        except asyncio.CancelledError:
+            cancelled_attempt_texts.append(streamed_text)
+            raise
 
-    response = await _create_response(AI_MAX_OUTPUT_TOKENS)
-    reply_text = _extract_response_text(response)
+    started_at = time.perf_counter()
+    if AI_HEDGE_REQUESTS:
+        response = await run_hedged_ai_request(
+            get_ai_hedge_stats(model, on_partial_text is not None),
+            _create_hedge_attempt,
+            on_partial_text,
+        )
+        for streamed_text in cancelled_attempt_texts:
+            add_ai_cancelled_attempt_usage(usage_record, response, streamed_text)
+    else:
+        response = await _create_response(initial_budget)
+    reply_text = extract_ai_response_text(response)
     status = getattr(response, "status", None)
     incomplete_details = getattr(response, "incomplete_details", None)
     incomplete_reason = getattr(incomplete_details, "reason", None)
 
-    if (
+    retried = (
         status == "incomplete"
         and incomplete_reason == "max_output_tokens"
         and not reply_text
-        and AI_RETRY_MAX_OUTPUT_TOKENS > AI_MAX_OUTPUT_TOKENS
-    ):
+        and AI_RETRY_MAX_OUTPUT_TOKENS > initial_budget
+    )
+    if retried:
+        budget_stats.record_retry(time.perf_counter() - started_at)
+        if usage_record is not None:
+            usage_record.retry_count += 1
         response = await _create_response(AI_RETRY_MAX_OUTPUT_TOKENS)
-        reply_text = _extract_response_text(response)
+        reply_text = extract_ai_response_text(response)
         status = getattr(response, "status", None)
         incomplete_details = getattr(response, "incomplete_details", None)
         incomplete_reason = getattr(incomplete_details, "reason", None)
+    budget_stats.record_result(response, initial_budget, retried)
 
     if reply_text:
         return reply_text
@@ -976,18 +3127,453 @@ async def request_ai_reply(conversation_prompt: str, image_urls: list[str] | Non
     raise AIEmptyResponseError("AI response was empty.")
 
 
+def record_ai_prompt_cache_usage(response, elapsed_seconds: float):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    cached_tokens = getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0
+
+    ai_prompt_cache_stats["input_tokens"] += input_tokens
+    ai_prompt_cache_stats["cached_tokens"] += cached_tokens
+    outcome = "hit" if cached_tokens else "miss"
+    ai_prompt_cache_stats[f"{outcome}_requests"] += 1
+    ai_prompt_cache_stats[f"{outcome}_seconds"] += elapsed_seconds
+
+
+def add_ai_response_usage(usage_record: AIUsageRecord | None, response):
+    usage = getattr(response, "usage", None)
+    if usage_record is None or usage is None:
+        return
+    usage_record.input_tokens += getattr(usage, "input_tokens", 0) or 0
+    usage_record.cached_tokens += getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0
+    usage_record.output_tokens += getattr(usage, "output_tokens", 0) or 0
+
+
+def add_ai_cancelled_attempt_usage(usage_record: AIUsageRecord | None, response, streamed_text: str):
+    # A cancelled hedge attempt never reports usage, but it is still billed for the same
+    # prompt as the winner plus whatever it had streamed.
+    usage = getattr(response, "usage", None)
+    if usage_record is None:
+        return
+    if usage is not None:
+        usage_record.input_tokens += getattr(usage, "input_tokens", 0) or 0
+        usage_record.cached_tokens += getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0
+    if streamed_text:
+        usage_record.output_tokens += count_text_tokens(streamed_text)
+
+
+def record_ai_usage(usage_record: AIUsageRecord, started_at: float):
+    if not AI_USAGE_LEDGER:
+        return
+    usage_record.total_ms = (time.perf_counter() - started_at) * 1000
+    ai_usage_pending.append(usage_record)
+    if len(ai_usage_pending) >= AI_USAGE_FLUSH_BATCH_SIZE and not ai_usage_flush_tasks:
+        task = asyncio.create_task(flush_ai_usage_ledger())
+        ai_usage_flush_tasks.add(task)
+        task.add_done_callback(ai_usage_flush_tasks.discard)
+
+
+async def flush_ai_usage_ledger() -> int:
+    if not ai_usage_pending:
+        return 0
+    records = ai_usage_pending[:]
+    ai_usage_pending.clear()
+    rows = [
+        (
+            record.created_at.timestamp(),
+            record.created_at.date().isoformat(),
+            record.kind,
+            record.guild_id,
+            record.channel_id,
+            record.user_id,
+            record.model,
+            record.source,
+            int(record.ok),
+            record.input_tokens,
+            record.cached_tokens,
+            record.output_tokens,
+            record.image_count,
+            record.retry_count,
+            *(
+                round(value) if value is not None else None
+                for value in (
+                    record.context_ms,
+                    record.images_ms,
+                    record.queue_ms,
+                    record.first_text_ms,
+                )
+            ),
+            round(record.total_ms),
+        )
+        for record in records
+    ]
+
+    try:
+        async with db_write_lock:
+            with db_ai_cache() as conn:
+                conn.executemany("""
+                    INSERT INTO ai_usage(
+                        created_at, day, kind, guild_id, channel_id, user_id, model, source, ok,
+                        input_tokens, cached_tokens, output_tokens, image_count, retry_count,
+                        context_ms, images_ms, queue_ms, first_text_ms, total_ms
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+    except asyncio.CancelledError:
+        # Cancelled while waiting on the write lock; keep the batch for the shutdown flush.
+        ai_usage_pending[:0] = records
+        raise
+    except sqlite3.Error as exc:
+        print(f"[ai] usage ledger write failed rows={len(rows)} error={exc}")
+        # Keep the batch for the next flush, dropping the oldest rows if the backlog keeps growing.
+        ai_usage_pending[:0] = records
+        del ai_usage_pending[:-AI_USAGE_MAX_PENDING]
+        return 0
+    return len(rows)
+
+
+def prune_ai_usage_ledger():
+    cutoff_day = (datetime.now(LOCAL_TZ).date() - timedelta(days=AI_USAGE_RETENTION_DAYS)).isoformat()
+    with db_ai_cache() as conn:
+        conn.execute("DELETE FROM ai_usage WHERE day < ?", (cutoff_day,))
+
+
+def get_ai_usage_report(
+    guild_id: int | None,
+    group_by: str,
+    days: int,
+) -> tuple[list[sqlite3.Row], sqlite3.Row]:
+    column = AI_USAGE_GROUP_COLUMNS[group_by]
+    since_day = (datetime.now(LOCAL_TZ).date() - timedelta(days=days - 1)).isoformat()
+    where = "day >= ?"
+    params: list[object] = [since_day]
+    if guild_id is not None:
+        where += " AND guild_id = ?"
+        params.append(guild_id)
+    order = "group_key DESC" if group_by == "day" else "SUM(input_tokens) + SUM(output_tokens) DESC"
+    totals_sql = """
+        COUNT(*) AS requests,
+        COALESCE(SUM(1 - ok), 0) AS failures,
+        COALESCE(SUM(input_tokens), 0) AS input_tokens,
+        COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+        COALESCE(SUM(output_tokens), 0) AS output_tokens,
+        COALESCE(SUM(image_count), 0) AS image_count,
+        COALESCE(SUM(retry_count), 0) AS retry_count,
+        AVG(total_ms) AS avg_total_ms,
+        AVG(first_text_ms) AS avg_first_text_ms
+    """
+    with db_ai_cache() as conn:
+        rows = conn.execute(
+            f"SELECT {column} AS group_key, {totals_sql} FROM ai_usage WHERE {where} "
+            f"GROUP BY group_key ORDER BY {order} LIMIT ?",
+            (*params, AI_USAGE_REPORT_ROWS),
+        ).fetchall()
+        totals = conn.execute(f"SELECT {totals_sql} FROM ai_usage WHERE {where}", params).fetchone()
+    return rows, totals
+
+
+def format_ai_usage_row(label: str, row: sqlite3.Row) -> str:
+    cached_percent = row["cached_tokens"] * 100 / row["input_tokens"] if row["input_tokens"] else 0
+    first_text = ""
+    if row["avg_first_text_ms"] is not None:
+        first_text = f", first text {row['avg_first_text_ms'] / 1000:.2f}s"
+    return (
+        f"- {label}: {row['requests']} req ({row['failures']} failed), "
+        f"{row['input_tokens']} in ({cached_percent:.0f}% cached) / {row['output_tokens']} out tokens, "
+        f"{row['image_count']} images, {row['retry_count']} retries, "
+        f"avg {(row['avg_total_ms'] or 0) / 1000:.2f}s{first_text}"
+    )
+
+
+def get_ai_prompt_cache_summary() -> str:
+    requests = ai_prompt_cache_stats["hit_requests"] + ai_prompt_cache_stats["miss_requests"]
+    if not requests:
+        return "no usage recorded yet"
+    input_tokens = ai_prompt_cache_stats["input_tokens"]
+    cached_percent = round(ai_prompt_cache_stats["cached_tokens"] * 100 / input_tokens) if input_tokens else 0
+    latencies = []
+    for outcome in ("hit", "miss"):
+        count = ai_prompt_cache_stats[f"{outcome}_requests"]
+        average = f"{ai_prompt_cache_stats[f'{outcome}_seconds'] / count:.2f}s" if count else "n/a"
+        latencies.append(f"{outcome}s {count} avg {average}")
+    return (
+        f"{cached_percent}% of {input_tokens} input tokens cached over {requests} requests "
+        f"({', '.join(latencies)})"
+    )
+
+
 async def send_message_reply(message: discord.Message, text: str):
-    await message.channel.send(
+    return await message.channel.send(
         text,
         allowed_mentions=discord.AllowedMentions.none(),
     )
 
 
+class AIReplyMessage:
+    def __init__(self, message: discord.Message, started_at: float):
+        self.message = message
+        self.started_at = started_at
+        self.sent_message = None
+        self.sent_text = ""
+        self.last_edit_at = 0.0
+        self.first_text_seconds: float | None = None
+        self.streaming = True
+
+    async def update(self, text: str):
+        now = time.perf_counter()
+        if self.first_text_seconds is None:
+            self.first_text_seconds = now - self.started_at
+        if not self.streaming:
+            return
+        # A Discord failure here must not abort the OpenAI stream; finish() delivers the final text.
+        try:
+            if self.sent_message is None:
+                self.sent_message = await send_message_reply(self.message, text)
+                self.sent_text = text
+                self.last_edit_at = now
+                return
+            if text == self.sent_text or (now - self.last_edit_at) < AI_STREAM_EDIT_INTERVAL_SECONDS:
+                return
+            await self.sent_message.edit(content=text, allowed_mentions=discord.AllowedMentions.none())
+        except discord.HTTPException as exc:
+            self.streaming = False
+            print(f"[ai] streaming reply update failed channel={self.message.channel.id} error={exc}")
+            return
+        self.sent_text = text
+        self.last_edit_at = now
+
+    async def finish(self, text: str):
+        if self.sent_message is not None and text != self.sent_text:
+            try:
+                await self.sent_message.edit(content=text, allowed_mentions=discord.AllowedMentions.none())
+            except discord.NotFound:
+                # The streamed reply was deleted; post the final text as a new message instead.
+                self.sent_message = None
+        if self.sent_message is None:
+            self.sent_message = await send_message_reply(self.message, text)
+        self.sent_text = text
+
+
+def record_ai_reply_latency(first_text_seconds: float | None, total_seconds: float):
+    ai_reply_latencies.append((first_text_seconds, total_seconds))
+
+
+def get_ai_reply_latency_summary() -> str:
+    if not ai_reply_latencies:
+        return "no replies yet"
+    totals = sorted(total for _, total in ai_reply_latencies)
+    first_texts = sorted(first for first, _ in ai_reply_latencies if first is not None)
+    summary = f"p50 total {totals[len(totals) // 2]:.2f}s"
+    if first_texts:
+        summary = f"p50 first token {first_texts[len(first_texts) // 2]:.2f}s, {summary}"
+    return f"{summary} over {len(totals)} replies"
+
+
+def remember_ai_channel_summary(channel_id: int, channel_summary: AIChannelSummary | None):
+    ai_channel_summaries[channel_id] = channel_summary
+    ai_channel_summaries.move_to_end(channel_id)
+    while len(ai_channel_summaries) > AI_SUMMARY_MEMORY_CACHE_SIZE:
+        ai_channel_summaries.popitem(last=False)
+
+
+def get_ai_channel_summary(channel_id: int | None) -> AIChannelSummary | None:
+    if channel_id is None:
+        return None
+    if channel_id in ai_channel_summaries:
+        ai_channel_summaries.move_to_end(channel_id)
+        return ai_channel_summaries[channel_id]
+
+    try:
+        with db_ai_cache() as conn:
+            row = conn.execute(
+                "SELECT summary, last_message_id, updated_at FROM channel_summaries WHERE channel_id=?",
+                (channel_id,),
+            ).fetchone()
+    except sqlite3.Error as exc:
+        print(f"[ai] channel summary read failed channel={channel_id} error={exc}")
+        return None
+
+    channel_summary = None
+    if row is not None:
+        channel_summary = AIChannelSummary(row["summary"], row["last_message_id"], row["updated_at"])
+    remember_ai_channel_summary(channel_id, channel_summary)
+    return channel_summary
+
+
+async def store_ai_channel_summary(channel_id: int, summary: str, last_message_id: int):
+    channel_summary = AIChannelSummary(summary, last_message_id, time.time())
+    remember_ai_channel_summary(channel_id, channel_summary)
+    try:
+        async with db_write_lock:
+            with db_ai_cache() as conn:
+                conn.execute("""
+                    INSERT INTO channel_summaries(channel_id, summary, last_message_id, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(channel_id) DO UPDATE SET
+                        summary=excluded.summary,
+                        last_message_id=excluded.last_message_id,
+                        updated_at=excluded.updated_at
+                """, (channel_id, summary, last_message_id, channel_summary.updated_at))
+    except sqlite3.Error as exc:
+        print(f"[ai] channel summary write failed channel={channel_id} error={exc}")
+
+
+async def clear_ai_channel_summary(channel_id: int):
+    refresh_task = ai_summary_refresh_tasks.pop(channel_id, None)
+    if refresh_task is not None:
+        refresh_task.cancel()
+    remember_ai_channel_summary(channel_id, None)
+    try:
+        async with db_write_lock:
+            with db_ai_cache() as conn:
+                conn.execute("DELETE FROM channel_summaries WHERE channel_id=?", (channel_id,))
+    except sqlite3.Error as exc:
+        print(f"[ai] channel summary clear failed channel={channel_id} error={exc}")
+
+
+def build_ai_summary_prompt(previous_summary: str | None, entries: list[AIContextEntry]) -> str:
+    lines = ["Previous summary:", previous_summary or "(none yet)", "", "New messages, oldest first:"]
+    for entry in entries:
+        lines.append(format_ai_context_entry(entry))
+    return "\n".join(lines)
+
+
+async def refresh_ai_channel_summary(
+    channel_id: int,
+    guild_id: int | None,
+    previous_summary: str | None,
+    entries: list[AIContextEntry],
+    last_message_id: int,
+):
+    client = get_openai_client()
+    if client is None:
+        return
+
+    usage_record = AIUsageRecord(
+        kind="summary",
+        guild_id=guild_id,
+        channel_id=channel_id,
+        user_id=None,
+        model=OPENAI_MODEL,
+        source="upstream",
+    )
+    started_at = time.perf_counter()
+    try:
+        response = await ai_request_scheduler.run(
+            guild_id,
+            partial(
+                client.responses.create,
+                model=OPENAI_MODEL,
+                instructions=AI_SUMMARY_SYSTEM_PROMPT,
+                input=build_ai_summary_prompt(previous_summary, entries),
+                max_output_tokens=AI_SUMMARY_MAX_OUTPUT_TOKENS,
+                reasoning={"effort": AI_REASONING_EFFORT},
+                text={"verbosity": AI_TEXT_VERBOSITY},
+            ),
+            max_wait_seconds=AI_SUMMARY_SCHEDULER_WAIT_SECONDS,
+        )
+        add_ai_response_usage(usage_record, response)
+        summary = normalize_ai_summary_text(extract_ai_response_text(response), max_chars=AI_SUMMARY_MAX_CHARS)
+        usage_record.ok = bool(summary)
+    except (AISchedulerBusyError, APIConnectionError, APIError, RateLimitError) as exc:
+        ai_channel_summary_stats["failures"] += 1
+        print(f"[ai] channel summary refresh failed channel={channel_id} error={exc}")
+        return
+    finally:
+        record_ai_usage(usage_record, started_at)
+
+    if not summary:
+        ai_channel_summary_stats["failures"] += 1
+        print(f"[ai] channel summary refresh empty channel={channel_id}")
+        return
+
+    await store_ai_channel_summary(channel_id, summary, last_message_id)
+    ai_channel_summary_stats["refreshes"] += 1
+    elapsed = time.perf_counter() - started_at
+    print(
+        f"[ai] channel summary refreshed channel={channel_id} "
+        f"folded={len(entries)} chars={len(summary)} elapsed={elapsed:.2f}s"
+    )
+
+
+def _finish_ai_summary_refresh(channel_id: int, task: asyncio.Task):
+    ai_background_tasks.discard(task)
+    if ai_summary_refresh_tasks.get(channel_id) is task:
+        ai_summary_refresh_tasks.pop(channel_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        ai_channel_summary_stats["failures"] += 1
+        print(f"[ai] channel summary refresh crashed channel={channel_id} error={task.exception()!r}")
+
+
+def schedule_ai_channel_summary_refresh(
+    channel_id: int,
+    guild_id: int | None,
+    oldest_context_message_id: int,
+) -> asyncio.Task | None:
+    if channel_id in ai_summary_refresh_tasks:
+        return None
+    buffer = get_ai_context_buffer(channel_id)
+    if buffer is None:
+        return None
+
+    channel_summary = get_ai_channel_summary(channel_id)
+    previous_summary = channel_summary.summary if channel_summary is not None else None
+    summarized_through = channel_summary.last_message_id if channel_summary is not None else 0
+
+    # Fold in messages that have scrolled out of the raw context window since the last refresh.
+    unsummarized_newest_first = []
+    for buffered in reversed(buffer.messages.values()):
+        if buffered.message_id >= oldest_context_message_id:
+            continue
+        if buffered.message_id <= summarized_through:
+            break
+        if buffered.is_reset:
+            # Anything summarized before a reset must not leak back into the prompt.
+            previous_summary = None
+            break
+        if buffered.entry is not None:
+            unsummarized_newest_first.append(buffered)
+
+    if len(unsummarized_newest_first) < AI_SUMMARY_REFRESH_MIN_MESSAGES:
+        return None
+
+    entries = [buffered.entry for buffered in reversed(unsummarized_newest_first)]
+    task = asyncio.create_task(
+        refresh_ai_channel_summary(
+            channel_id,
+            guild_id,
+            previous_summary,
+            entries,
+            unsummarized_newest_first[0].message_id,
+        )
+    )
+    ai_summary_refresh_tasks[channel_id] = task
+    ai_background_tasks.add(task)
+    task.add_done_callback(partial(_finish_ai_summary_refresh, channel_id))
+    return task
+
+
+def get_ai_channel_summary_summary() -> str:
+    if not AI_CHANNEL_SUMMARIES:
+        return "disabled"
+    cached = sum(1 for channel_summary in ai_channel_summaries.values() if channel_summary is not None)
+    return (
+        f"{cached} cached, {ai_channel_summary_stats['prompt_uses']} prompts used one, "
+        f"{ai_channel_summary_stats['refreshes']} refreshes, "
+        f"{ai_channel_summary_stats['failures']} failures, "
+        f"{len(ai_summary_refresh_tasks)} refreshing"
+    )
+
+
 async def handle_ai_mention(message: discord.Message, bot_user_id: int) -> bool:
     prompt = extract_bot_mention_prompt(message.content, bot_user_id)
     if not prompt:
         return False
     if is_ai_reset_prompt(prompt):
+        await record_ai_channel_reset(message.channel.id, message.id)
+        if AI_CHANNEL_SUMMARIES:
+            await clear_ai_channel_summary(message.channel.id)
         await send_message_reply(message, AI_RESET_MESSAGE)
         return True
 
@@ -996,56 +3582,131 @@ async def handle_ai_mention(message: discord.Message, bot_user_id: int) -> bool:
         await send_message_reply(message, AI_TIMEOUT_MESSAGE)
         return True
 
-    context_entries, current_entry = await fetch_ai_context_entries(message, bot_user_id)
-    conversation_prompt = build_ai_conversation_prompt(context_entries, current_entry)
-    image_urls = dedupe_preserve_order(
-        [
-            image_url
-            for entry in [*context_entries, current_entry]
-            for image_url in entry.image_urls
-        ]
+    batch_messages = [message]
+    if AI_COALESCE_MENTIONS:
+        channel_id = message.channel.id
+        pending_batch = ai_pending_mention_batches.get(channel_id)
+        if pending_batch is not None:
+            # The first mention in the window answers for the whole burst.
+            pending_batch.append(message)
+            return True
+        ai_pending_mention_batches[channel_id] = batch_messages
+        try:
+            await asyncio.sleep(AI_COALESCE_WINDOW_SECONDS)
+        finally:
+            ai_pending_mention_batches.pop(channel_id, None)
+
+    guild_id = getattr(getattr(message, "guild", None), "id", None)
+    usage_record = AIUsageRecord(
+        kind="mention",
+        guild_id=guild_id,
+        channel_id=message.channel.id,
+        user_id=message.author.id,
+        model=OPENAI_MODEL,
+    )
+    context_started_at = time.perf_counter()
+    channel_summary = get_ai_channel_summary(message.channel.id) if AI_CHANNEL_SUMMARIES else None
+    context_entries, current_entries = await fetch_ai_mention_context_entries(
+        batch_messages,
+        bot_user_id,
+        token_budget=AI_SUMMARY_CONTEXT_TOKEN_BUDGET if channel_summary is not None else AI_CONTEXT_TOKEN_BUDGET,
     )
+    if AI_CHANNEL_SUMMARIES:
+        oldest_context_message_id = next(
+            (entry.message_id for entry in context_entries if entry.message_id is not None),
+            message.id,
+        )
+        schedule_ai_channel_summary_refresh(message.channel.id, guild_id, oldest_context_message_id)
+        if channel_summary is not None:
+            ai_channel_summary_stats["prompt_uses"] += 1
+    if len(batch_messages) > 1:
+        print(f"[ai] coalesced mentions channel={message.channel.id} count={len(batch_messages)}")
+
+    conversation_prompt = build_ai_coalesced_conversation_prompt(
+        context_entries,
+        current_entries,
+        channel_summary.summary if channel_summary is not None else None,
+    )
+    image_urls = select_ai_request_image_urls(context_entries, current_entries)
+
+    images_started_at = time.perf_counter()
+    usage_record.context_ms = (images_started_at - context_started_at) * 1000
+    image_urls = await prepare_ai_request_image_urls(image_urls)
+    usage_record.images_ms = (time.perf_counter() - images_started_at) * 1000
+
+    prompt_tokens = count_ai_request_prompt_tokens(conversation_prompt)
+    preview_count = count_ai_link_previews([*context_entries, *current_entries])
+    tier = select_ai_model_tier(prompt_tokens, min(len(image_urls), AI_CONTEXT_IMAGE_LIMIT), preview_count)
+    usage_record.model = tier["model"]
+    usage_record.image_count = min(len(image_urls), AI_CONTEXT_IMAGE_LIMIT)
 
     started_at = time.perf_counter()
+    reply = AIReplyMessage(message, started_at)
     print(
         f"[ai] request start user={message.author.id} "
-        f"channel={message.channel.id} model={OPENAI_MODEL}"
+        f"channel={message.channel.id} model={tier['model']} tier={tier['name']} prompt_tokens={prompt_tokens}"
     )
 
     async with message.channel.typing():
         try:
-            reply_text = await request_ai_reply(conversation_prompt, image_urls=image_urls)
+            reply_text = await request_tiered_ai_reply(
+                tier,
+                prompt_tokens,
+                preview_count,
+                conversation_prompt,
+                image_urls=image_urls,
+                on_partial_text=reply.update if AI_STREAM_REPLIES else None,
+                guild_id=guild_id,
+                prompt_cache_key=f"poopbot-channel-{message.channel.id}",
+                usage_record=usage_record,
+                dedupe_text=build_ai_dedupe_text(message.channel.id, current_entries),
+            )
+            usage_record.ok = True
         except AIConfigurationError as exc:
             print(f"[ai] request skipped user={message.author.id} reason={exc}")
-            await send_message_reply(message, AI_NOT_CONFIGURED_MESSAGE)
+            await reply.finish(AI_NOT_CONFIGURED_MESSAGE)
             return True
         except AIEmptyResponseError as exc:
             print(f"[ai] request empty user={message.author.id} reason={exc}")
-            await send_message_reply(message, AI_EMPTY_RESPONSE_MESSAGE)
+            await reply.finish(AI_EMPTY_RESPONSE_MESSAGE)
+            return True
+        except AISchedulerBusyError as exc:
+            print(f"[ai] request busy user={message.author.id} reason={exc}")
+            await reply.finish(AI_BUSY_MESSAGE)
             return True
-        except AIIncompleteResponseError as exc:
+        except AICircuitOpenError as exc:
+            print(f"[ai] request fast_failed user={message.author.id} reason={exc}")
+            await reply.finish(AI_UNAVAILABLE_MESSAGE)
+            return True
+        except (AIIncompleteResponseError, AIStreamError) as exc:
             print(f"[ai] request incomplete user={message.author.id} reason={exc}")
-            await send_message_reply(message, AI_ERROR_MESSAGE)
+            await reply.finish(AI_ERROR_MESSAGE)
             return True
         except RateLimitError as exc:
             elapsed = time.perf_counter() - started_at
             print(f"[ai] request rate_limited user={message.author.id} elapsed={elapsed:.2f}s error={exc}")
-            await send_message_reply(message, AI_RATE_LIMIT_MESSAGE)
+            await reply.finish(AI_RATE_LIMIT_MESSAGE)
             return True
         except (APIConnectionError, APIError) as exc:
             elapsed = time.perf_counter() - started_at
             print(f"[ai] request failed user={message.author.id} elapsed={elapsed:.2f}s error={exc}")
-            await send_message_reply(message, AI_ERROR_MESSAGE)
+            await reply.finish(AI_ERROR_MESSAGE)
             return True
         except Exception as exc:
             elapsed = time.perf_counter() - started_at
             print(f"[ai] request unexpected_error user={message.author.id} elapsed={elapsed:.2f}s error={exc}")
-            await send_message_reply(message, AI_ERROR_MESSAGE)
+            await reply.finish(AI_ERROR_MESSAGE)
             return True
+        finally:
+            if reply.first_text_seconds is not None:
+                usage_record.first_text_ms = reply.first_text_seconds * 1000
+            record_ai_usage(usage_record, started_at)
 
     elapsed = time.perf_counter() - started_at
-    print(f"[ai] request ok user={message.author.id} elapsed={elapsed:.2f}s")
-    await send_message_reply(message, reply_text)
+    record_ai_reply_latency(reply.first_text_seconds, elapsed)
+    first_text = f"{reply.first_text_seconds:.2f}s" if reply.first_text_seconds is not None else "n/a"
+    print(f"[ai] request ok user={message.author.id} first_token={first_text} elapsed={elapsed:.2f}s")
+    await reply.finish(reply_text)
     return True
 
 
@@ -1056,14 +3717,83 @@ intents = discord.Intents.default()
 intents.reactions = True
 intents.message_content = True  # needed for cleanup logging
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class PoopBot(commands.Bot):
+    async def close(self):
+        # Usage rows are batched in memory, so write out whatever is left before disconnecting.
+        ai_usage_flush.cancel()
+        if ai_usage_flush_tasks:
+            await asyncio.gather(*ai_usage_flush_tasks, return_exceptions=True)
+        await flush_ai_usage_ledger()
+        if http_session is not None and not http_session.closed:
+            await http_session.close()
+        await super().close()
+
+
+bot = PoopBot(command_prefix="!", intents=intents)
 
 # serialize DB writes to avoid sqlite "database is locked"
 db_write_lock = asyncio.Lock()
 ai_client = None
+ai_system_prompt_cache: tuple[date, str] | None = None
+ai_prompt_cache_stats = {
+    "input_tokens": 0,
+    "cached_tokens": 0,
+    "hit_requests": 0,
+    "hit_seconds": 0.0,
+    "miss_requests": 0,
+    "miss_seconds": 0.0,
+}
 ai_token_encoder = None
-ai_recent_prompt_times: dict[int, deque[float]] = {}
-ai_user_timeout_until: dict[int, float] = {}
+ai_token_encoder_status = {"state": "not_loaded", "load_seconds": None, "error": None}
+ai_token_count_cache: OrderedDict[tuple, int] = OrderedDict()
+http_session: aiohttp.ClientSession | None = None
+ai_rate_limit_buckets: OrderedDict[int, AIRateLimitBucket] = OrderedDict()
+ai_rate_limit_timeouts_dirty = False
+ai_reply_latencies: deque[tuple[float | None, float]] = deque(maxlen=AI_LATENCY_HISTORY_SIZE)
+ai_reply_cache: OrderedDict[str, tuple[str, float]] = OrderedDict()
+ai_inflight_replies: dict[str, asyncio.Task] = {}
+ai_inflight_partial_callbacks: dict[str, list] = {}
+ai_dedupe_stats = {"cache_hits": 0, "inflight_joins": 0, "requests": 0}
+ai_request_scheduler = AIRequestScheduler(AI_SCHEDULER_MAX_CONCURRENCY, AI_SCHEDULER_MAX_QUEUE_DEPTH)
+ai_output_budget_stats: dict[str, AIOutputBudgetStats] = {}
+ai_model_tier_stats: dict[str, dict] = {}
+ai_hedge_stats: dict[tuple[str, bool], "AIHedgeStats"] = {}
+ai_health_probe_results: deque[tuple[datetime, bool, float, str]] = deque(maxlen=AI_HEALTH_PROBE_HISTORY_SIZE)
+ai_circuit_breaker = AICircuitBreaker(AI_CIRCUIT_FAILURE_THRESHOLD, AI_CIRCUIT_OPEN_SECONDS, AI_CIRCUIT_HISTORY_SIZE)
+ai_pending_mention_batches: dict[int, list[discord.Message]] = {}
+ai_context_buffers: OrderedDict[int, AIChannelContextBuffer] = OrderedDict()
+ai_link_preview_cache: OrderedDict[str, tuple[str | None, float]] = OrderedDict()
+ai_link_preview_cache_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+ai_link_preview_db_pruned_at = 0.0
+ai_dns_cache: OrderedDict[str, tuple[tuple[str, ...] | None, float]] = OrderedDict()
+ai_dns_inflight: dict[str, asyncio.Task] = {}
+ai_dns_cache_stats = {
+    "hits": 0,
+    "negative_hits": 0,
+    "inflight_joins": 0,
+    "lookups": 0,
+    "lookup_ms_total": 0.0,
+    "lookup_ms_max": 0.0,
+}
+ai_image_cache: OrderedDict[str, AIPreparedImage] = OrderedDict()
+ai_image_url_hashes: OrderedDict[str, str] = OrderedDict()
+ai_image_inflight: dict[str, asyncio.Task] = {}
+ai_image_cache_stats = {
+    "hits": 0,
+    "downloads": 0,
+    "downloaded_bytes": 0,
+    "cached_bytes": 0,
+    "failures": 0,
+    "evictions": 0,
+}
+ai_channel_reset_markers: OrderedDict[int, int | None] = OrderedDict()
+ai_channel_summaries: OrderedDict[int, AIChannelSummary | None] = OrderedDict()
+ai_summary_refresh_tasks: dict[int, asyncio.Task] = {}
+ai_channel_summary_stats = {"prompt_uses": 0, "refreshes": 0, "failures": 0}
+ai_background_tasks: set[asyncio.Task] = set()
+ai_usage_pending: list[AIUsageRecord] = []
+ai_usage_flush_tasks: set[asyncio.Task] = set()
 
 
 
@@ -1682,6 +4412,14 @@ def db_wordle() -> sqlite3.Connection:
     return conn
 
 
+def db_ai_cache() -> sqlite3.Connection:
+    os.makedirs(DB_DIR, exist_ok=True)
+    conn = sqlite3.connect(AI_CACHE_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    _apply_sqlite_pragmas(conn)
+    return conn
+
+
 def db_path_for_year(year: int) -> str:
     os.makedirs(DB_DIR, exist_ok=True)
     return os.path.join(DB_DIR, f"poopbot_{year}.db")
@@ -1736,6 +4474,12 @@ def init_config_db():
             PRIMARY KEY (ticket_id, user_id)
         );
         """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS ai_user_timeouts (
+            user_id INTEGER PRIMARY KEY,
+            timeout_until_epoch REAL NOT NULL
+        );
+        """)
         columns = {
             row["name"]
             for row in conn.execute("PRAGMA table_info(tickets)").fetchall()
@@ -1797,6 +4541,61 @@ def init_wordle_db():
         """)
 
 
+def init_ai_cache_db():
+    with db_ai_cache() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS link_preview_cache (
+            url TEXT PRIMARY KEY,
+            preview TEXT,                             -- NULL caches a failed/non-HTML fetch
+            fetched_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """)
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_link_preview_cache_fetched
+        ON link_preview_cache(fetched_at);
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS channel_reset_markers (
+            channel_id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL,              -- latest handled reset mention
+            reset_at REAL NOT NULL
+        );
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS channel_summaries (
+            channel_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,         -- newest message folded into the summary
+            updated_at REAL NOT NULL
+        );
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS ai_usage (
+            created_at REAL NOT NULL,
+            day TEXT NOT NULL,                        -- YYYY-MM-DD (Pacific)
+            kind TEXT NOT NULL,                       -- 'mention' or 'summary'
+            guild_id INTEGER,
+            channel_id INTEGER,
+            user_id INTEGER,                          -- NULL for channel summary refreshes
+            model TEXT NOT NULL,
+            source TEXT NOT NULL,                     -- 'upstream', 'cache', 'joined' or 'none'
+            ok INTEGER NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            cached_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            image_count INTEGER NOT NULL,
+            retry_count INTEGER NOT NULL,
+            context_ms INTEGER,
+            images_ms INTEGER,
+            queue_ms INTEGER,
+            first_text_ms INTEGER,
+            total_ms INTEGER NOT NULL
+        );
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_usage_day ON ai_usage(day, guild_id);")
+
+
 def init_year_db(year: int):
     with db_year(year) as conn:
         conn.execute("""
@@ -2045,18 +4844,15 @@ def now_utc_local():
     return utc, local
 
 
-def _fetch_url_text(url: str) -> str:
-    req = urllib.request.Request(
+async def _fetch_url_text(url: str) -> str:
+    result = await fetch_http_text(
         url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
-                "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-        }
+        headers={"User-Agent": FEED_REQUEST_USER_AGENT},
+        timeout_seconds=FEED_FETCH_TIMEOUT_SECONDS,
     )
-    with urllib.request.urlopen(req, timeout=20) as response:
-        return response.read().decode("utf-8")
+    if result is None:
+        raise aiohttp.ClientError(f"Too many redirects fetching {url}")
+    return result[1]
 
 
 def _extract_channel_id_from_handle_page(html: str) -> str | None:
@@ -2075,8 +4871,8 @@ async def resolve_wesroth_channel_id() -> str | None:
     if WESROTH_CHANNEL_ID:
         return WESROTH_CHANNEL_ID
     try:
-        html = await asyncio.to_thread(_fetch_url_text, WESROTH_HANDLE_URL)
-    except OSError as exc:
+        html = await _fetch_url_text(WESROTH_HANDLE_URL)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
         print(f"Failed to fetch WesRoth channel page: {exc}")
         return None
     channel_id = _extract_channel_id_from_handle_page(html)
@@ -2119,8 +4915,8 @@ async def fetch_wesroth_latest_today() -> dict | None:
         return None
     feed_url = f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
     try:
-        xml_text = await asyncio.to_thread(_fetch_url_text, feed_url)
-    except OSError as exc:
+        xml_text = await _fetch_url_text(feed_url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
         print(f"Failed to fetch WesRoth feed: {exc}")
         return None
     entries = _parse_wesroth_feed(xml_text)
@@ -2740,11 +5536,47 @@ async def wordle_daily_sync():
             print(f"Wordle daily sync failed for guild={gid} channel={cid}: {exc}")
 
 
+@tasks.loop(minutes=AI_RATE_LIMIT_SWEEP_MINUTES)
+async def ai_rate_limit_sweep():
+    global ai_rate_limit_timeouts_dirty
+
+    sweep_ai_rate_limit_buckets()
+    if not AI_RATE_LIMIT_PERSIST_TIMEOUTS or not ai_rate_limit_timeouts_dirty:
+        return
+    try:
+        async with db_write_lock:
+            save_ai_user_timeouts()
+        ai_rate_limit_timeouts_dirty = False
+    except sqlite3.Error as exc:
+        print(f"[ai] failed to persist prompt timeouts: {exc}")
+
+
+@tasks.loop(seconds=AI_USAGE_FLUSH_INTERVAL_SECONDS)
+async def ai_usage_flush():
+    await flush_ai_usage_ledger()
+    if ai_usage_flush.current_loop % 60 == 0:
+        try:
+            async with db_write_lock:
+                prune_ai_usage_ledger()
+        except sqlite3.Error as exc:
+            print(f"[ai] usage ledger prune failed: {exc}")
+
+
+@tasks.loop(minutes=AI_HEALTH_PROBE_INTERVAL_MINUTES)
+async def ai_health_probe():
+    if not OPENAI_API_KEY:
+        return
+    await record_ai_health_probe()
+
+
 # =========================
 # MESSAGE CLEANUP CHANNEL
 # =========================
 @bot.event
 async def on_message(message: discord.Message):
+    if message.guild is not None and message.channel.id != CLEANUP_CHANNEL_ID:
+        record_ai_context_message(message, bot.user.id if bot.user is not None else None)
+
     if message.author.bot or message.webhook_id is not None:
         await process_wordle_candidate_message(message)
         return
@@ -2776,6 +5608,21 @@ async def on_message_edit(before: discord.Message, after: discord.Message):
         await process_wordle_candidate_message(after)
 
 
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    update_ai_context_message(payload.message, bot.user.id if bot.user is not None else None)
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    forget_ai_context_messages(payload.channel_id, [payload.message_id])
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    forget_ai_context_messages(payload.channel_id, payload.message_ids)
+
+
 # =========================
 # REACTIONS
 # =========================
@@ -3590,7 +6437,8 @@ async def createwordledatabase(interaction: discord.Interaction):
 
 @bot.tree.command(name="diagnostics", description="Run AI mention diagnostics.")
 @app_commands.guild_only()
-async def diagnostics(interaction: discord.Interaction):
+@app_commands.describe(live_probe="Send a live OpenAI test request instead of using cached probe results.")
+async def diagnostics(interaction: discord.Interaction, live_probe: bool = False):
     if not is_dev_user(interaction.user.id):
         await interaction.response.send_message(
             "Only the configured dev user can run this command.",
@@ -3607,7 +6455,7 @@ async def diagnostics(interaction: discord.Interaction):
     timeout_remaining = get_ai_timeout_remaining(interaction.user.id)
     sentience_percent = get_ai_sentience_percent()
     discord_latency_ms = round(bot.latency * 1000) if bot.latency == bot.latency else None
-    smoke_ok, smoke_message = await run_ai_smoke_test()
+    live_result = await record_ai_health_probe() if live_probe else None
 
     lines = [
         "**PoopBot Diagnostics**",
@@ -3617,16 +6465,93 @@ async def diagnostics(interaction: discord.Interaction):
         f"- OpenAI SDK import: {'OK' if AsyncOpenAI is not None else f'Failed ({OPENAI_IMPORT_ERROR})'}",
         f"- OpenAI client cached: {'Yes' if ai_client is not None else 'No'}",
         f"- Model: `{OPENAI_MODEL}`",
+        f"- Model tiers: {get_ai_model_tier_summary()}",
         f"- Context window: {AI_CONTEXT_TOKEN_BUDGET} tokens, up to {AI_CONTEXT_HISTORY_SCAN_LIMIT} scanned messages",
+        (
+            f"- Context buffer: {len(ai_context_buffers)} channels, "
+            f"{sum(len(buffer.messages) for buffer in ai_context_buffers.values())} messages"
+        ),
+        f"- Link preview cache: {get_link_preview_cache_summary()}",
+        f"- Link preview DNS cache: {get_dns_cache_summary()}",
+        f"- Image cache: {get_ai_image_cache_summary()}",
+        f"- Channel summaries: {get_ai_channel_summary_summary()}",
+        f"- Tokenizer: {get_token_encoder_summary()}",
+        f"- Reply latency: {get_ai_reply_latency_summary()}",
+        f"- Duplicate request de-dupe: {get_ai_dedupe_summary()}",
+        f"- Prompt prefix cache: {get_ai_prompt_cache_summary()}",
+        f"- Output token budget: {get_ai_output_budget_summary()}",
+        f"- Hedged requests: {get_ai_hedge_summary()}",
+        f"- Request scheduler: {ai_request_scheduler.summary()}",
+        f"- Circuit breaker: {ai_circuit_breaker.summary()}",
+        *ai_circuit_breaker.transition_lines(),
         f"- Rate limit: {AI_RATE_LIMIT_MAX_REQUESTS} prompts/{AI_RATE_LIMIT_WINDOW_SECONDS}s, timeout {AI_RATE_LIMIT_TIMEOUT_SECONDS}s",
+        f"- Rate limit buckets tracked: {len(ai_rate_limit_buckets)}/{AI_RATE_LIMIT_MAX_TRACKED_USERS}",
         f"- Your current timeout: {'none' if timeout_remaining <= 0 else f'{math.ceil(timeout_remaining)}s remaining'}",
         f"- Sentience level today: {sentience_percent}%",
-        f"- Live OpenAI smoke test: {'PASS' if smoke_ok else 'FAIL'} - {smoke_message}",
+        *get_ai_health_probe_lines(),
     ]
+    if live_result is not None:
+        lines.append(f"- Live OpenAI smoke test: {'PASS' if live_result[0] else 'FAIL'} - {live_result[1]}")
     if not mention_enabled:
         lines.append("- This channel cannot trigger `@PoopBot` AI replies in the current code path.")
 
-    await interaction.followup.send("\n".join(lines), ephemeral=True)
+    for chunk in chunk_message_lines(lines):
+        await interaction.followup.send(chunk, ephemeral=True)
+
+
+def format_ai_usage_group_label(group_by: str, group_key) -> str:
+    if group_key is None:
+        return "channel summaries" if group_by == "user" else "unknown"
+    if group_by == "user":
+        return f"<@{group_key}>"
+    if group_by == "channel":
+        return f"<#{group_key}>"
+    if group_by == "guild":
+        guild = bot.get_guild(group_key)
+        return guild.name if guild is not None else str(group_key)
+    return str(group_key)
+
+
+@bot.tree.command(name="aiusage", description="Show AI token usage and latency from the usage ledger.")
+@app_commands.guild_only()
+@app_commands.describe(
+    group_by="Group usage by user, channel, or day in this server, or by server across all of them.",
+    days="How many days of usage to include.",
+)
+async def aiusage(
+    interaction: discord.Interaction,
+    group_by: Literal["user", "channel", "day", "guild"] = "user",
+    days: app_commands.Range[int, 1, AI_USAGE_RETENTION_DAYS] = AI_USAGE_REPORT_DEFAULT_DAYS,
+):
+    if not is_dev_user(interaction.user.id):
+        await interaction.response.send_message(
+            "Only the configured dev user can run this command.",
+            ephemeral=True,
+        )
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    await flush_ai_usage_ledger()
+    guild_id = None if group_by == "guild" else interaction.guild.id
+    try:
+        rows, totals = get_ai_usage_report(guild_id, group_by, days)
+    except sqlite3.Error as exc:
+        await interaction.followup.send(f"I couldn't read the AI usage ledger: {exc}", ephemeral=True)
+        return
+
+    scope = "all servers" if guild_id is None else "this server"
+    lines = [f"**AI Usage — {scope}, last {days} day{'s' if days != 1 else ''}, by {group_by}**"]
+    if not totals["requests"]:
+        lines.append("- No AI requests recorded yet.")
+    else:
+        lines.append(format_ai_usage_row("Total", totals))
+        lines.extend(
+            format_ai_usage_row(format_ai_usage_group_label(group_by, row["group_key"]), row)
+            for row in rows
+        )
+
+    for chunk in chunk_message_lines(lines):
+        await interaction.followup.send(chunk, ephemeral=True)
 
 
 @bot.tree.command(name="gokibothelp", description="Show all available GokiBot commands.")
@@ -3658,6 +6583,7 @@ async def gokibothelp(interaction: discord.Interaction):
 
     if is_dev_user(interaction.user.id):
         command_lines.insert(-1, "- `/diagnostics` - Run Discord/OpenAI mention diagnostics (dev only).")
+        command_lines.insert(-1, "- `/aiusage` - Show AI token usage and latency by user, channel, day, or server (dev only).")
 
     await interaction.response.send_message("\n".join(command_lines), ephemeral=True)
 
@@ -3671,6 +6597,11 @@ async def on_ready():
     init_year_db(current_year_local())
     init_cleanup_db()
     init_wordle_db()
+    init_ai_cache_db()
+    mark_ai_context_buffers_cold()
+    if AI_RATE_LIMIT_PERSIST_TIMEOUTS:
+        load_ai_user_timeouts()
+    start_token_encoder_warmup()
 
     try:
         await bot.tree.sync()
@@ -3683,6 +6614,12 @@ async def on_ready():
         wesroth_upload_watch.start()
     if not wordle_daily_sync.is_running():
         wordle_daily_sync.start()
+    if not ai_rate_limit_sweep.is_running():
+        ai_rate_limit_sweep.start()
+    if AI_HEALTH_PROBE_INTERVAL_MINUTES > 0 and not ai_health_probe.is_running():
+        ai_health_probe.start()
+    if AI_USAGE_LEDGER and not ai_usage_flush.is_running():
+        ai_usage_flush.start()
 
     # If configured guilds haven't posted today, post immediately
     today_local = datetime.now(LOCAL_TZ).date().isoformat()
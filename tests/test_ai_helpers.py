@@ -1,10 +1,19 @@
+import asyncio
 import importlib
+import io
+import math
 import os
+import socket
+import tempfile
+import time
 import types
 import unittest
-from datetime import date
+from datetime import date, datetime, timezone
 from unittest import mock
 
+import httpx
+from aiohttp import web
+
 
 os.environ.setdefault("DISCORD_TOKEN", "test-token")
 
@@ -13,8 +22,8 @@ poopbot = importlib.import_module("poopbot")
 
 class AIHelperTests(unittest.TestCase):
     def tearDown(self):
-        poopbot.ai_recent_prompt_times.clear()
-        poopbot.ai_user_timeout_until.clear()
+        poopbot.ai_rate_limit_buckets.clear()
+        poopbot.ai_token_count_cache.clear()
         poopbot.ai_token_encoder = None
 
     def test_extract_bot_mention_prompt_removes_bot_mentions(self):
@@ -40,6 +49,11 @@ class AIHelperTests(unittest.TestCase):
         self.assertFalse(enabled)
         self.assertIn("cleanup channel", message)
 
+    def test_chunk_message_lines_keeps_each_chunk_under_the_limit(self):
+        chunks = poopbot.chunk_message_lines(["a" * 6, "b" * 3, "c" * 20], max_chars=10)
+
+        self.assertEqual(chunks, ["aaaaaa\nbbb", "c" * 10])
+
     def test_extract_urls_from_text_normalizes_trailing_punctuation(self):
         urls = poopbot.extract_urls_from_text(
             "Look at https://example.com/test, and https://example.com/test.)"
@@ -86,8 +100,8 @@ class AIHelperTests(unittest.TestCase):
 
         with mock.patch.object(
             poopbot,
-            "count_text_tokens",
-            side_effect=lambda text: token_map[text],
+            "count_text_tokens_batch",
+            side_effect=lambda texts: [token_map[text] for text in texts],
         ):
             entries = poopbot.select_ai_context_entries(
                 newest_first,
@@ -97,6 +111,67 @@ class AIHelperTests(unittest.TestCase):
 
         self.assertEqual([entry.author_name for entry in entries], ["user-1", "user-2", "user-3"])
 
+    def test_image_limit_applies_across_entries_and_prefers_the_current_message(self):
+        def entry(name, image_count):
+            return poopbot.AIContextEntry(
+                author_name=name,
+                text="look",
+                image_urls=[f"https://example.com/{name}/{index}.png" for index in range(image_count)],
+            )
+
+        current = entry("current", 2)
+        history_oldest_first = [entry("old", 3), entry("recent", 3)]
+        image_tokens = poopbot.estimate_ai_image_tokens(poopbot.AI_IMAGE_MAX_DIMENSION, poopbot.AI_IMAGE_MAX_DIMENSION)
+
+        with mock.patch.object(poopbot, "count_text_tokens_batch", side_effect=lambda texts: [1] * len(texts)):
+            counts = poopbot.count_ai_context_entries_tokens([current, *reversed(history_oldest_first)])
+
+        self.assertEqual(counts, [1 + 2 * image_tokens, 1 + 2 * image_tokens, 1])
+        self.assertEqual(
+            poopbot.select_ai_request_image_urls(history_oldest_first, [current]),
+            [
+                "https://example.com/current/0.png",
+                "https://example.com/current/1.png",
+                "https://example.com/recent/0.png",
+                "https://example.com/recent/1.png",
+            ],
+        )
+
+    def test_count_ai_context_entries_tokens_batches_misses_and_caches_by_message_edit(self):
+        entries = [
+            poopbot.AIContextEntry(author_name="Bob", text=f"message {index}", message_id=index)
+            for index in range(3)
+        ]
+        batches = []
+
+        def fake_batch(texts):
+            batches.append(list(texts))
+            return [len(text) for text in texts]
+
+        with mock.patch.object(poopbot, "count_text_tokens_batch", side_effect=fake_batch):
+            first = poopbot.count_ai_context_entries_tokens(entries)
+            second = poopbot.count_ai_context_entries_tokens(entries)
+            edited = poopbot.AIContextEntry(
+                author_name="Bob",
+                text="message 1 (edited)",
+                message_id=1,
+                edited_at=datetime(2026, 1, 1, tzinfo=timezone.utc),
+            )
+            third = poopbot.count_ai_context_entries_tokens([entries[0], edited])
+            unfurled = poopbot.AIContextEntry(
+                author_name="Bob",
+                text="message 2\n[Embed] Link title",
+                message_id=2,
+            )
+            fourth = poopbot.count_ai_context_entries_tokens([unfurled])
+
+        self.assertEqual(first, second)
+        self.assertEqual(third, [first[0], len("Bob: message 1 (edited)")])
+        self.assertEqual(fourth, [len("Bob: message 2\n[Embed] Link title")])
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(len(batches[0]), 3)
+        self.assertEqual(batches[1], ["Bob: message 1 (edited)"])
+
     def test_register_ai_prompt_attempt_triggers_timeout_after_sixth_prompt(self):
         for second in range(5):
             self.assertEqual(poopbot.register_ai_prompt_attempt(42, now=float(second)), 0.0)
@@ -106,6 +181,67 @@ class AIHelperTests(unittest.TestCase):
         self.assertEqual(timeout, poopbot.AI_RATE_LIMIT_TIMEOUT_SECONDS)
         self.assertGreater(poopbot.get_ai_timeout_remaining(42, now=5.0), 0.0)
 
+    def test_register_ai_prompt_attempt_uses_a_sliding_window_and_timeout_expires(self):
+        for second in range(0, 60, 10):
+            result = poopbot.register_ai_prompt_attempt(7, now=float(second))
+        self.assertEqual(result, poopbot.AI_RATE_LIMIT_TIMEOUT_SECONDS)
+
+        for second in range(5):
+            poopbot.register_ai_prompt_attempt(42, now=float(second))
+        self.assertEqual(poopbot.register_ai_prompt_attempt(42, now=60.0), 0.0)
+
+        for second in range(61, 65):
+            self.assertEqual(poopbot.register_ai_prompt_attempt(42, now=float(second)), 0.0)
+        self.assertEqual(poopbot.register_ai_prompt_attempt(42, now=65.0), poopbot.AI_RATE_LIMIT_TIMEOUT_SECONDS)
+        remaining = poopbot.get_ai_timeout_remaining(42, now=70.0)
+        self.assertGreater(remaining, 0.0)
+        self.assertEqual(poopbot.register_ai_prompt_attempt(42, now=70.0), remaining)
+
+        after_timeout = 65.0 + poopbot.AI_RATE_LIMIT_TIMEOUT_SECONDS
+        self.assertEqual(poopbot.register_ai_prompt_attempt(42, now=after_timeout), 0.0)
+
+    def test_rate_limit_buckets_are_swept_and_capped(self):
+        with mock.patch.object(poopbot, "AI_RATE_LIMIT_MAX_TRACKED_USERS", 3):
+            for user_id in range(5):
+                poopbot.register_ai_prompt_attempt(user_id, now=0.0)
+        self.assertEqual(list(poopbot.ai_rate_limit_buckets), [2, 3, 4])
+
+        poopbot.register_ai_prompt_attempt(4, now=100.0)
+        swept = poopbot.sweep_ai_rate_limit_buckets(now=100.0)
+
+        self.assertEqual(swept, 2)
+        self.assertEqual(list(poopbot.ai_rate_limit_buckets), [4])
+
+    def test_rate_limit_cap_does_not_evict_timed_out_users(self):
+        with mock.patch.object(poopbot, "AI_RATE_LIMIT_MAX_TRACKED_USERS", 2):
+            for second in range(6):
+                poopbot.register_ai_prompt_attempt(1, now=float(second))
+            poopbot.register_ai_prompt_attempt(2, now=6.0)
+            poopbot.register_ai_prompt_attempt(3, now=7.0)
+
+        self.assertEqual(list(poopbot.ai_rate_limit_buckets), [1, 3])
+        self.assertGreater(poopbot.get_ai_timeout_remaining(1, now=7.0), 0.0)
+
+    def test_ai_user_timeouts_survive_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(
+            poopbot,
+            "CONFIG_DB_PATH",
+            os.path.join(tmp_dir, "config.db"),
+        ):
+            poopbot.init_config_db()
+            for second in range(6):
+                poopbot.register_ai_prompt_attempt(42, now=float(second))
+            with mock.patch.object(poopbot.time, "time", return_value=1000.0):
+                poopbot.save_ai_user_timeouts(now=5.0)
+            poopbot.ai_rate_limit_buckets.clear()
+            with mock.patch.object(poopbot.time, "time", return_value=1060.0):
+                poopbot.load_ai_user_timeouts(now=500.0)
+
+        self.assertAlmostEqual(
+            poopbot.get_ai_timeout_remaining(42, now=500.0),
+            poopbot.AI_RATE_LIMIT_TIMEOUT_SECONDS - 60.0,
+        )
+
     def test_get_ai_sentience_percent_progresses_weekly_from_march_10_2026(self):
         self.assertEqual(poopbot.get_ai_sentience_percent(date(2026, 3, 10)), 0)
         self.assertEqual(poopbot.get_ai_sentience_percent(date(2026, 3, 16)), 0)
@@ -126,6 +262,27 @@ class AIHelperTests(unittest.TestCase):
 
 
 class AIContextEntryTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_dir_patch = mock.patch.object(poopbot, "DB_DIR", self.tmp_dir.name)
+        self.db_path_patch = mock.patch.object(poopbot, "AI_CACHE_DB_PATH", os.path.join(self.tmp_dir.name, "ai_cache.db"))
+        self.db_dir_patch.start()
+        self.db_path_patch.start()
+        poopbot.init_ai_cache_db()
+        poopbot.ai_link_preview_db_pruned_at = 0.0
+
+    async def asyncTearDown(self):
+        self.db_path_patch.stop()
+        self.db_dir_patch.stop()
+        self.tmp_dir.cleanup()
+        poopbot.ai_channel_reset_markers.clear()
+        poopbot.ai_context_buffers.clear()
+        poopbot.ai_token_count_cache.clear()
+        poopbot.ai_link_preview_cache.clear()
+        poopbot.ai_link_preview_db_pruned_at = 0.0
+        for key in poopbot.ai_link_preview_cache_stats:
+            poopbot.ai_link_preview_cache_stats[key] = 0
+
     async def test_build_ai_context_entry_includes_link_preview_and_image_marker(self):
         message = types.SimpleNamespace(
             content="check this https://example.com/post",
@@ -186,19 +343,1109 @@ class AIContextEntryTests(unittest.IsolatedAsyncioTestCase):
             new=mock.AsyncMock(side_effect=fake_build_ai_context_entry),
         ), mock.patch.object(
             poopbot,
-            "count_text_tokens",
-            return_value=1,
+            "count_text_tokens_batch",
+            side_effect=lambda texts: [1] * len(texts),
         ):
             context_entries, current_entry = await poopbot.fetch_ai_context_entries(current_message, 123)
 
         self.assertEqual([entry.text for entry in context_entries], ["recent context"])
         self.assertEqual(current_entry.text, "what happened")
 
+    async def test_fetch_ai_context_entries_reads_warm_buffer_without_history_scan(self):
+        def make_message(message_id, content, name="Bob"):
+            return types.SimpleNamespace(
+                id=message_id,
+                content=content,
+                attachments=[],
+                embeds=[],
+                webhook_id=None,
+                author=types.SimpleNamespace(display_name=name),
+                channel=channel,
+            )
+
+        class FakeChannel:
+            id = 55
+
+            def __init__(self):
+                self.history_calls = 0
+
+            async def history(self, **kwargs):
+                self.history_calls += 1
+                for item in [make_message(2, "seeded context"), make_message(1, "<@123> reset")]:
+                    yield item
+
+        channel = FakeChannel()
+        first_mention = make_message(3, "<@123> first", name="Alice")
+        with mock.patch.object(
+            poopbot,
+            "count_text_tokens_batch",
+            side_effect=lambda texts: [1] * len(texts),
+        ):
+            await poopbot.fetch_ai_context_entries(first_mention, 123)
+
+            poopbot.record_ai_context_message(make_message(4, "gateway context"), 123)
+            poopbot.record_ai_context_message(make_message(5, "deleted context"), 123)
+            poopbot.forget_ai_context_messages(channel.id, [5])
+            second_mention = make_message(6, "<@123> second", name="Alice")
+            poopbot.record_ai_context_message(second_mention, 123)
+            context_entries, current_entry = await poopbot.fetch_ai_context_entries(second_mention, 123)
+
+        self.assertEqual(channel.history_calls, 1)
+        self.assertEqual(
+            [entry.text for entry in context_entries],
+            ["seeded context", "<@123> first", "gateway context"],
+        )
+        self.assertEqual(current_entry.text, "second")
+
+    async def test_coalesced_mentions_share_preview_prefetch_and_token_budget(self):
+        channel = types.SimpleNamespace(id=57)
+
+        def make_message(message_id, content, name="Bob"):
+            return types.SimpleNamespace(
+                id=message_id,
+                content=content,
+                attachments=[],
+                embeds=[],
+                webhook_id=None,
+                author=types.SimpleNamespace(display_name=name),
+                channel=channel,
+            )
+
+        buffer = poopbot.get_ai_context_buffer(channel.id, create=True)
+        buffer.warm = True
+        for message_id in range(1, 4):
+            poopbot.record_ai_context_message(make_message(message_id, f"context {message_id}"), 123)
+        prefetched = []
+
+        async def fake_prefetch(urls, preview_cache, preview_state):
+            prefetched.extend(urls)
+            preview_cache.update({url: f"[Link preview] {url}" for url in urls})
+
+        with mock.patch.object(
+            poopbot,
+            "count_text_tokens_batch",
+            side_effect=lambda texts: [10] * len(texts),
+        ), mock.patch.object(poopbot, "AI_LINK_PREVIEW_TOKEN_ESTIMATE", 0), mock.patch.object(
+            poopbot,
+            "prefetch_url_previews",
+            new=mock.AsyncMock(side_effect=fake_prefetch),
+        ):
+            context_entries, current_entries = await poopbot.fetch_ai_mention_context_entries(
+                [
+                    make_message(10, "<@123> look https://a.example/x", name="Alice"),
+                    make_message(11, "<@123> and https://b.example/y", name="Carol"),
+                ],
+                123,
+                token_budget=35,
+            )
+
+        self.assertEqual(prefetched, ["https://a.example/x", "https://b.example/y"])
+        self.assertEqual([entry.text for entry in context_entries], ["context 2", "context 3"])
+        self.assertEqual([entry.author_name for entry in current_entries], ["Alice", "Carol"])
+        self.assertIn("[Link preview] https://b.example/y", current_entries[1].text)
+
+    async def test_fetch_ai_context_entries_keeps_window_start_stable_for_prompt_caching(self):
+        channel = types.SimpleNamespace(id=56)
+
+        def make_message(message_id, content, name="Bob"):
+            return types.SimpleNamespace(
+                id=message_id,
+                content=content,
+                attachments=[],
+                embeds=[],
+                webhook_id=None,
+                author=types.SimpleNamespace(display_name=name),
+                channel=channel,
+            )
+
+        buffer = poopbot.get_ai_context_buffer(channel.id, create=True)
+        buffer.warm = True
+        for message_id in range(1, 8):
+            poopbot.record_ai_context_message(make_message(message_id, f"message {message_id}"), 123)
+
+        with mock.patch.object(
+            poopbot,
+            "count_text_tokens_batch",
+            side_effect=lambda texts: [100] * len(texts),
+        ), mock.patch.object(poopbot, "AI_PROMPT_CACHE_WINDOW_SLACK_TOKENS", 250):
+            prompts = []
+            for message_id in range(8, 13):
+                mention = make_message(message_id, "<@123> hi", name="Alice")
+                poopbot.record_ai_context_message(mention, 123)
+                context_entries, current_entry = await poopbot.fetch_ai_context_entries(
+                    mention,
+                    123,
+                    token_budget=350,
+                )
+                prompts.append(poopbot.build_ai_conversation_prompt(context_entries, current_entry))
+
+        first_lines = prompts[0].splitlines()
+        self.assertEqual(first_lines[1], "Bob: message 5")
+        self.assertTrue(prompts[1].startswith("\n".join(first_lines[:4])))
+        self.assertTrue(prompts[2].startswith("\n".join(first_lines[:4])))
+        self.assertEqual(prompts[3].splitlines()[1], "Alice: <@123> hi")
+
+    async def test_get_url_preview_text_reuses_persistent_cache_across_calls(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(
+            poopbot,
+            "AI_CACHE_DB_PATH",
+            os.path.join(tmp_dir, "ai_cache.db"),
+        ), mock.patch.object(
+            poopbot,
+            "_fetch_public_link_preview",
+            side_effect=lambda url: "[Fetched link context from example.com] Title" if "good" in url else None,
+        ) as fetch_mock:
+            poopbot.init_ai_cache_db()
+
+            first = await poopbot.get_url_preview_text("https://example.com/good", {}, {"used": 0})
+            await poopbot.get_url_preview_text("https://example.com/bad", {}, {"used": 0})
+            poopbot.ai_link_preview_cache.clear()
+            second = await poopbot.get_url_preview_text("https://example.com/good", {}, {"used": 0})
+            negative = await poopbot.get_url_preview_text("https://example.com/bad", {}, {"used": 0})
+            memory_hit = await poopbot.get_url_preview_text("https://example.com/good", {}, {"used": 0})
+
+        self.assertEqual(first, second)
+        self.assertEqual(first, memory_hit)
+        self.assertIsNone(negative)
+        self.assertEqual(fetch_mock.call_count, 2)
+        self.assertEqual(poopbot.ai_link_preview_cache_stats, {"memory_hits": 1, "db_hits": 2, "misses": 2})
+
+    async def test_transient_preview_failures_get_a_short_negative_ttl(self):
+        def fail(url):
+            status = 404 if "gone" in url else 503
+            raise poopbot.aiohttp.ClientResponseError(mock.Mock(), (), status=status)
+
+        with mock.patch.object(poopbot, "_fetch_public_link_preview", side_effect=fail), mock.patch.object(
+            poopbot.time, "time", return_value=1000.0
+        ):
+            await poopbot.fetch_url_preview_cached("https://example.com/gone")
+            await poopbot.fetch_url_preview_cached("https://example.com/flaky")
+            with mock.patch.object(poopbot, "_fetch_public_link_preview", side_effect=asyncio.TimeoutError):
+                await poopbot.fetch_url_preview_cached("https://example.com/slow")
+
+        expires = {url.rsplit("/", 1)[1]: expires_at for url, (_, expires_at) in poopbot.ai_link_preview_cache.items()}
+        self.assertEqual(expires["gone"], 1000.0 + poopbot.AI_LINK_PREVIEW_NEGATIVE_CACHE_TTL_SECONDS)
+        self.assertEqual(expires["flaky"], 1000.0 + poopbot.AI_LINK_PREVIEW_TRANSIENT_CACHE_TTL_SECONDS)
+        self.assertEqual(expires["slow"], 1000.0 + poopbot.AI_LINK_PREVIEW_TRANSIENT_CACHE_TTL_SECONDS)
+
+    async def test_preview_db_cache_is_pruned_on_an_interval(self):
+        interval = poopbot.AI_LINK_PREVIEW_DB_PRUNE_INTERVAL_SECONDS
+        expired_at = interval + poopbot.AI_LINK_PREVIEW_TRANSIENT_CACHE_TTL_SECONDS
+
+        def stored_urls():
+            with poopbot.db_ai_cache() as conn:
+                return {row["url"] for row in conn.execute("SELECT url FROM link_preview_cache")}
+
+        await poopbot.store_cached_link_preview("https://example.com/old", None, now=interval, transient=True)
+        await poopbot.store_cached_link_preview("https://example.com/a", "a", now=expired_at + 1)
+        self.assertEqual(stored_urls(), {"https://example.com/old", "https://example.com/a"})
+
+        await poopbot.store_cached_link_preview("https://example.com/b", "b", now=2 * interval)
+        self.assertEqual(stored_urls(), {"https://example.com/a", "https://example.com/b"})
+
+    async def test_fetch_ai_context_entries_stops_tokenizing_and_fetching_at_budget(self):
+        history = [
+            types.SimpleNamespace(id=10 - index, content=f"message {index} https://example.com/{index} " + "x" * 5000)
+            for index in range(9)
+        ]
+
+        class FakeChannel:
+            id = 77
+
+            async def history(self, **kwargs):
+                for item in history:
+                    yield item
+
+        current_message = types.SimpleNamespace(
+            id=11,
+            content="<@123> what happened",
+            channel=FakeChannel(),
+            author=types.SimpleNamespace(display_name="Alice"),
+        )
+        tokenized = []
+
+        def fake_count_text_tokens_batch(texts):
+            tokenized.extend(texts)
+            return [math.ceil(len(text) / 4) for text in texts]
+
+        with mock.patch.object(
+            poopbot,
+            "count_text_tokens_batch",
+            side_effect=fake_count_text_tokens_batch,
+        ), mock.patch.object(
+            poopbot,
+            "AI_LINK_PREVIEW_TOKEN_ESTIMATE",
+            0,
+        ), mock.patch.object(
+            poopbot,
+            "fetch_url_preview_cached",
+            new=mock.AsyncMock(return_value=None),
+        ) as fetch_mock:
+            context_entries, _ = await poopbot.fetch_ai_context_entries(current_message, 123)
+
+        self.assertEqual(
+            [entry.text.split(" x")[0] for entry in context_entries],
+            ["message 1 https://example.com/1", "message 0 https://example.com/0"],
+        )
+        self.assertEqual(len(tokenized), 3)
+        fetched_urls = [call.args[0] for call in fetch_mock.await_args_list]
+        self.assertNotIn("https://example.com/2", fetched_urls)
+
+    async def test_prefetch_url_previews_runs_concurrently_and_drops_late_previews(self):
+        async def fake_fetch(url):
+            await asyncio.sleep(5 if "slow" in url else 0.01)
+            return f"preview for {url}"
+
+        preview_cache = {}
+        with mock.patch.object(
+            poopbot,
+            "fetch_url_preview_cached",
+            new=mock.AsyncMock(side_effect=fake_fetch),
+        ), mock.patch.object(poopbot, "AI_LINK_PREVIEW_DEADLINE_SECONDS", 0.2):
+            started_at = time.perf_counter()
+            await poopbot.prefetch_url_previews(
+                ["https://slow.example.com", "https://a.example.com", "https://b.example.com"],
+                preview_cache,
+                {"used": 0},
+            )
+            elapsed = time.perf_counter() - started_at
+            for task in list(poopbot.ai_background_tasks):
+                task.cancel()
+
+        self.assertLess(elapsed, 1.0)
+        self.assertIsNone(preview_cache["https://slow.example.com"])
+        self.assertEqual(preview_cache["https://a.example.com"], "preview for https://a.example.com")
+        self.assertEqual(preview_cache["https://b.example.com"], "preview for https://b.example.com")
+
+    async def test_buffers_refill_from_history_after_a_fresh_gateway_session(self):
+        history_calls = []
+
+        class FakeChannel:
+            id = 55
+
+            async def history(self, **kwargs):
+                history_calls.append(kwargs)
+                if False:
+                    yield None
+
+        channel = FakeChannel()
+        message = types.SimpleNamespace(
+            id=100,
+            content="<@123> hi",
+            attachments=[],
+            embeds=[],
+            webhook_id=None,
+            author=types.SimpleNamespace(display_name="Alice"),
+            channel=channel,
+        )
+
+        await poopbot.fetch_ai_context_entries(message, 123)
+        await poopbot.fetch_ai_context_entries(message, 123)
+        self.assertEqual(len(history_calls), 1)
+
+        poopbot.mark_ai_context_buffers_cold()
+        await poopbot.fetch_ai_context_entries(message, 123)
+        self.assertEqual(len(history_calls), 2)
+
+    async def test_context_buffers_evict_least_recently_used_channel_over_global_cap(self):
+        for channel_id in (1, 2):
+            buffer = poopbot.get_ai_context_buffer(channel_id, create=True)
+            for message_id in range(3):
+                poopbot.store_ai_buffered_message(
+                    buffer,
+                    poopbot.AIBufferedMessage(message_id=message_id, entry=None),
+                )
+
+        with mock.patch.object(poopbot, "AI_CONTEXT_BUFFER_MAX_TOTAL_MESSAGES", 4):
+            poopbot.enforce_ai_context_buffer_limits()
+
+        self.assertEqual(list(poopbot.ai_context_buffers), [2])
+
+
+class ChannelSummaryTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_dir_patch = mock.patch.object(poopbot, "DB_DIR", self.tmp_dir.name)
+        self.db_patch = mock.patch.object(poopbot, "AI_CACHE_DB_PATH", os.path.join(self.tmp_dir.name, "ai_cache.db"))
+        self.db_dir_patch.start()
+        self.db_patch.start()
+        poopbot.init_ai_cache_db()
+
+    async def asyncTearDown(self):
+        self.db_patch.stop()
+        self.db_dir_patch.stop()
+        self.tmp_dir.cleanup()
+        poopbot.ai_context_buffers.clear()
+        poopbot.ai_channel_summaries.clear()
+        poopbot.ai_summary_refresh_tasks.clear()
+        for key in poopbot.ai_channel_summary_stats:
+            poopbot.ai_channel_summary_stats[key] = 0
+        poopbot.ai_usage_pending.clear()
+        poopbot.ai_client = None
+
+    async def test_summary_refresh_folds_only_messages_older_than_the_window(self):
+        inputs = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                inputs.append(kwargs["input"])
+                return types.SimpleNamespace(output_text=f"summary {len(inputs)}", status="completed", output=[])
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        buffer = poopbot.get_ai_context_buffer(77, create=True)
+        for message_id in range(1, 21):
+            entry = poopbot.AIContextEntry(author_name="Bob", text=f"message {message_id}", message_id=message_id)
+            poopbot.store_ai_buffered_message(buffer, poopbot.AIBufferedMessage(message_id, entry))
+
+        with mock.patch.object(poopbot, "AI_SUMMARY_REFRESH_MIN_MESSAGES", 5):
+            self.assertIsNone(poopbot.schedule_ai_channel_summary_refresh(77, None, 5))
+            await poopbot.schedule_ai_channel_summary_refresh(77, None, 11)
+            poopbot.ai_channel_summaries.clear()
+            self.assertEqual(poopbot.get_ai_channel_summary(77).last_message_id, 10)
+            self.assertIsNone(poopbot.schedule_ai_channel_summary_refresh(77, None, 13))
+            await poopbot.schedule_ai_channel_summary_refresh(77, None, 16)
+
+        self.assertIn("Bob: message 1\n", inputs[0])
+        self.assertNotIn("message 11", inputs[0])
+        self.assertIn("summary 1", inputs[1])
+        self.assertNotIn("message 10", inputs[1])
+        self.assertIn("Bob: message 15", inputs[1])
+        self.assertEqual(poopbot.get_ai_channel_summary(77).summary, "summary 2")
+
+        prompt = poopbot.build_ai_conversation_prompt([], poopbot.AIContextEntry("Alice", "hi"), "summary 2")
+        self.assertTrue(prompt.startswith("Summary of earlier conversation in this channel:\nsummary 2\n"))
+
+    async def test_summary_refresh_task_is_tracked_and_its_crash_is_logged(self):
+        poopbot.ai_client = types.SimpleNamespace(
+            responses=types.SimpleNamespace(create=mock.AsyncMock(side_effect=RuntimeError("boom")))
+        )
+        buffer = poopbot.get_ai_context_buffer(77, create=True)
+        for message_id in range(1, 11):
+            entry = poopbot.AIContextEntry(author_name="Bob", text=f"message {message_id}", message_id=message_id)
+            poopbot.store_ai_buffered_message(buffer, poopbot.AIBufferedMessage(message_id, entry))
+
+        with mock.patch.object(poopbot, "AI_SUMMARY_REFRESH_MIN_MESSAGES", 5), mock.patch("builtins.print") as print_mock:
+            task = poopbot.schedule_ai_channel_summary_refresh(77, None, 11)
+            self.assertIn(task, poopbot.ai_background_tasks)
+            self.assertIs(poopbot.ai_summary_refresh_tasks[77], task)
+            await asyncio.wait([task])
+            await asyncio.sleep(0)
+
+        self.assertNotIn(task, poopbot.ai_background_tasks)
+        self.assertNotIn(77, poopbot.ai_summary_refresh_tasks)
+        self.assertEqual(poopbot.ai_channel_summary_stats["failures"], 1)
+        self.assertIn("channel summary refresh crashed channel=77", print_mock.call_args.args[0])
+
+        await poopbot.clear_ai_channel_summary(77)
+        poopbot.ai_channel_summaries.clear()
+        self.assertIsNone(poopbot.get_ai_channel_summary(77))
+
+
+class ChannelResetMarkerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_dir_patch = mock.patch.object(poopbot, "DB_DIR", self.tmp_dir.name)
+        self.db_patch = mock.patch.object(poopbot, "AI_CACHE_DB_PATH", os.path.join(self.tmp_dir.name, "ai_cache.db"))
+        self.db_dir_patch.start()
+        self.db_patch.start()
+        poopbot.init_ai_cache_db()
+
+    async def asyncTearDown(self):
+        self.db_patch.stop()
+        self.db_dir_patch.stop()
+        self.tmp_dir.cleanup()
+        poopbot.ai_context_buffers.clear()
+        poopbot.ai_channel_reset_markers.clear()
+        poopbot.ai_token_count_cache.clear()
+
+    async def test_reset_marker_prunes_buffer_and_bounds_history_fetch(self):
+        history_calls = []
+
+        class FakeChannel:
+            id = 88
+
+            async def history(self, **kwargs):
+                history_calls.append(kwargs)
+                yield make_message(31, "after reset")
+
+        channel = FakeChannel()
+
+        def make_message(message_id, content):
+            return types.SimpleNamespace(
+                id=message_id,
+                content=content,
+                attachments=[],
+                embeds=[],
+                webhook_id=None,
+                author=types.SimpleNamespace(display_name="Bob"),
+                channel=channel,
+            )
+
+        buffer = poopbot.get_ai_context_buffer(channel.id, create=True)
+        for message_id in (10, 20, 30):
+            poopbot.record_ai_context_message(make_message(message_id, f"message {message_id}"), 123)
+
+        await poopbot.record_ai_channel_reset(channel.id, 30)
+        await poopbot.record_ai_channel_reset(channel.id, 25)
+        self.assertEqual(list(buffer.messages), [30])
+
+        poopbot.ai_context_buffers.clear()
+        poopbot.ai_channel_reset_markers.clear()
+        with mock.patch.object(
+            poopbot,
+            "count_text_tokens_batch",
+            side_effect=lambda texts: [1] * len(texts),
+        ):
+            context_entries, _ = await poopbot.fetch_ai_context_entries(make_message(40, "<@123> hi"), 123)
+
+        self.assertEqual(history_calls[0]["after"].id, 30)
+        self.assertEqual([entry.text for entry in context_entries], ["after reset"])
+
+    async def test_history_after_a_reset_requests_only_messages_since_the_reset(self):
+        def make_message(channel, message_id):
+            return types.SimpleNamespace(
+                id=message_id,
+                content=f"message {message_id}",
+                attachments=[],
+                embeds=[],
+                webhook_id=None,
+                author=types.SimpleNamespace(display_name="Bob"),
+                channel=channel,
+            )
+
+        class RestChannel(poopbot.discord.abc.Messageable):
+            id = 88
+
+            def __init__(self, pages):
+                self._state = types.SimpleNamespace(
+                    http=types.SimpleNamespace(logs_from=mock.AsyncMock(side_effect=pages)),
+                    create_message=lambda channel, data: make_message(channel, int(data["id"])),
+                )
+
+            async def _get_channel(self):
+                return self
+
+        # Discord returns pages newest-first.
+        short = RestChannel([[{"id": "32"}, {"id": "31"}]])
+        await poopbot.record_ai_channel_reset(short.id, 30)
+        history = await poopbot.load_ai_context_history(make_message(short, 40), 123)
+
+        self.assertEqual([buffered.message_id for buffered in history], [32, 31])
+        self.assertEqual(short._state.http.logs_from.await_count, 1)
+        self.assertEqual(short._state.http.logs_from.await_args.kwargs["after"], 30)
+        self.assertNotIn("before", short._state.http.logs_from.await_args.kwargs)
+
+        poopbot.ai_context_buffers.clear()
+        full_page = [{"id": str(message_id)} for message_id in range(35, 31, -1)]
+        busy = RestChannel([full_page, full_page])
+        with mock.patch.object(poopbot, "AI_CONTEXT_HISTORY_SCAN_LIMIT", 4):
+            history = await poopbot.load_ai_context_history(make_message(busy, 40), 123)
+
+        self.assertEqual([buffered.message_id for buffered in history], [35, 34, 33, 32])
+        self.assertEqual(busy._state.http.logs_from.await_args.kwargs["before"], 40)
+
+class AIUsageLedgerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_dir_patch = mock.patch.object(poopbot, "DB_DIR", self.tmp_dir.name)
+        self.db_patch = mock.patch.object(poopbot, "AI_CACHE_DB_PATH", os.path.join(self.tmp_dir.name, "ai_cache.db"))
+        self.db_dir_patch.start()
+        self.db_patch.start()
+        poopbot.init_ai_cache_db()
+
+    async def asyncTearDown(self):
+        self.db_patch.stop()
+        self.db_dir_patch.stop()
+        self.tmp_dir.cleanup()
+        poopbot.ai_usage_pending.clear()
+        poopbot.ai_client = None
+
+    async def test_bot_close_flushes_pending_usage(self):
+        poopbot.ai_usage_pending.append(self.make_record(7, 20, 1000))
+        test_bot = poopbot.PoopBot(command_prefix="!", intents=poopbot.discord.Intents.none())
+
+        with mock.patch.object(poopbot.ai_usage_flush, "cancel") as cancel:
+            await test_bot.close()
+
+        cancel.assert_called_once()
+        self.assertEqual(poopbot.ai_usage_pending, [])
+        with poopbot.db_ai_cache() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM ai_usage").fetchone()[0], 1)
+
+    async def test_bot_close_closes_the_pooled_http_session(self):
+        session = mock.Mock(closed=False, close=mock.AsyncMock())
+        test_bot = poopbot.PoopBot(command_prefix="!", intents=poopbot.discord.Intents.none())
+
+        with mock.patch.object(poopbot, "http_session", session):
+            await test_bot.close()
+
+        session.close.assert_awaited_once()
+
+    async def test_cancelled_flush_keeps_its_batch_for_the_shutdown_flush(self):
+        poopbot.ai_usage_pending.append(self.make_record(7, 20, 1000))
+
+        async with poopbot.db_write_lock:
+            flush = asyncio.create_task(poopbot.flush_ai_usage_ledger())
+            await asyncio.sleep(0)
+            flush.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await flush
+
+        self.assertEqual(len(poopbot.ai_usage_pending), 1)
+        self.assertEqual(await poopbot.flush_ai_usage_ledger(), 1)
+
+    async def test_summary_refresh_records_usage_even_when_it_crashes(self):
+        poopbot.ai_client = mock.Mock()
+        entries = [poopbot.AIContextEntry(author_name="alice", text="hello", message_id=1)]
+
+        with mock.patch.object(
+            poopbot.ai_request_scheduler, "run", mock.AsyncMock(side_effect=RuntimeError("boom"))
+        ):
+            with self.assertRaises(RuntimeError):
+                await poopbot.refresh_ai_channel_summary(20, 1, None, entries, 1)
+
+        self.assertEqual(len(poopbot.ai_usage_pending), 1)
+        self.assertEqual(poopbot.ai_usage_pending[0].kind, "summary")
+        self.assertFalse(poopbot.ai_usage_pending[0].ok)
+
+    def make_record(self, user_id, channel_id, input_tokens, ok=True):
+        return poopbot.AIUsageRecord(
+            kind="mention",
+            guild_id=1,
+            channel_id=channel_id,
+            user_id=user_id,
+            model="gpt-5-mini",
+            source="upstream",
+            ok=ok,
+            input_tokens=input_tokens,
+            cached_tokens=input_tokens // 2,
+            output_tokens=100,
+            image_count=1,
+            first_text_ms=400.0,
+        )
+
+    async def test_usage_is_written_in_batches_and_aggregated(self):
+        with mock.patch.object(poopbot, "AI_USAGE_FLUSH_BATCH_SIZE", 3):
+            poopbot.record_ai_usage(self.make_record(10, 100, 1000), time.perf_counter())
+            poopbot.record_ai_usage(self.make_record(10, 200, 3000, ok=False), time.perf_counter())
+            self.assertEqual(len(poopbot.ai_usage_pending), 2)
+            poopbot.record_ai_usage(self.make_record(20, 100, 500), time.perf_counter())
+            await asyncio.gather(*poopbot.ai_usage_flush_tasks)
+
+        self.assertEqual(poopbot.ai_usage_pending, [])
+        by_user, totals = poopbot.get_ai_usage_report(1, "user", 7)
+        by_channel, _ = poopbot.get_ai_usage_report(1, "channel", 7)
+        other_guild, _ = poopbot.get_ai_usage_report(2, "user", 7)
+
+        self.assertEqual([row["group_key"] for row in by_user], [10, 20])
+        self.assertEqual((by_user[0]["requests"], by_user[0]["failures"]), (2, 1))
+        self.assertEqual(by_user[0]["input_tokens"], 4000)
+        self.assertEqual([row["group_key"] for row in by_channel], [200, 100])
+        self.assertEqual(totals["requests"], 3)
+        self.assertEqual(other_guild, [])
+        self.assertEqual(
+            poopbot.format_ai_usage_row("Total", totals),
+            "- Total: 3 req (1 failed), 4500 in (50% cached) / 300 out tokens, "
+            "3 images, 0 retries, avg 0.00s, first text 0.40s",
+        )
+
+    async def test_request_ai_reply_fills_usage_record(self):
+        class FakeResponses:
+            async def create(self, **kwargs):
+                return types.SimpleNamespace(
+                    output_text="Answer",
+                    status="completed",
+                    output=[],
+                    usage=types.SimpleNamespace(
+                        input_tokens=1200,
+                        input_tokens_details=types.SimpleNamespace(cached_tokens=1024),
+                        output_tokens=40,
+                    ),
+                )
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        record = poopbot.AIUsageRecord(kind="mention", guild_id=1, channel_id=2, user_id=3, model="gpt-5-mini")
+        cached_record = poopbot.AIUsageRecord(kind="mention", guild_id=1, channel_id=2, user_id=3, model="gpt-5-mini")
+        try:
+            await poopbot.request_ai_reply("Alice: hi", usage_record=record)
+            await poopbot.request_ai_reply("Alice: hi", usage_record=cached_record)
+        finally:
+            poopbot.ai_reply_cache.clear()
+            for key in poopbot.ai_dedupe_stats:
+                poopbot.ai_dedupe_stats[key] = 0
+            for key in poopbot.ai_prompt_cache_stats:
+                poopbot.ai_prompt_cache_stats[key] = 0
+            poopbot.ai_output_budget_stats.clear()
+
+        self.assertEqual((record.input_tokens, record.cached_tokens, record.output_tokens), (1200, 1024, 40))
+        self.assertEqual(record.source, "upstream")
+        self.assertIsNotNone(record.queue_ms)
+        self.assertEqual(cached_record.source, "cache")
+        self.assertEqual(cached_record.input_tokens, 0)
+
+
+class LinkPreviewFetchTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        async def page(request):
+            body = "<html><head><title>Local page</title></head><body>" + ("x" * 200000) + "</body></html>"
+            return web.Response(text=body, content_type="text/html")
+
+        async def redirect_public(request):
+            raise web.HTTPFound("/page")
+
+        async def redirect_private(request):
+            raise web.HTTPFound(f"http://localhost:{self.port}/page")
+
+        app = web.Application()
+        app.router.add_get("/page", page)
+        app.router.add_get("/redirect-public", redirect_public)
+        app.router.add_get("/redirect-private", redirect_private)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        if poopbot.http_session is not None:
+            await poopbot.http_session.close()
+            poopbot.http_session = None
+        await self.runner.cleanup()
+
+    async def test_fetch_public_link_preview_follows_redirects_and_checks_every_hop(self):
+        with mock.patch.object(
+            poopbot,
+            "_is_public_fetch_host",
+            new=mock.AsyncMock(side_effect=lambda hostname: hostname == "127.0.0.1"),
+        ):
+            preview = await poopbot._fetch_public_link_preview(f"http://127.0.0.1:{self.port}/redirect-public")
+            blocked = await poopbot._fetch_public_link_preview(f"http://127.0.0.1:{self.port}/redirect-private")
+
+        self.assertEqual(preview, "[Fetched link context from 127.0.0.1] Local page")
+        self.assertIsNone(blocked)
+
+    async def test_fetch_http_text_stops_reading_at_max_bytes(self):
+        result = await poopbot.fetch_http_text(
+            f"http://127.0.0.1:{self.port}/page",
+            headers={},
+            timeout_seconds=5,
+            max_bytes=1000,
+        )
+
+        self.assertIsNotNone(result)
+        self.assertEqual(len(result[1]), 1000)
+
+    async def test_fetch_http_text_stops_reading_after_head(self):
+        parser = poopbot.LinkPreviewHeadParser()
+        result = await poopbot.fetch_http_text(
+            f"http://127.0.0.1:{self.port}/page",
+            headers={},
+            timeout_seconds=5,
+            max_bytes=65536,
+            on_text=parser.feed_text,
+        )
+
+        self.assertIsNotNone(result)
+        self.assertTrue(parser.done)
+        self.assertLessEqual(len(result[1]), poopbot.HTTP_READ_CHUNK_BYTES)
+        self.assertEqual(parser.title_and_description(), ("Local page", None))
+
+    def test_head_parser_prefers_open_graph_and_ignores_body(self):
+        parser = poopbot.LinkPreviewHeadParser()
+        chunks = [
+            "<html><head><title>Fallback &amp; title</title>",
+            '<script>var s = "</head><title>Script title</title>";</scr',
+            'ipt><!-- <meta property="og:title" content="Commented"> -->',
+            '<meta content="Card description" name="twitter:description">',
+            '<meta property="og:title" content="OG title"><meta name="descr',
+            'iption" content="Plain description"></head>',
+            '<body><meta property="og:description" content="Body description">',
+        ]
+        stopped = [parser.feed_text(chunk) for chunk in chunks]
+
+        self.assertEqual(stopped, [False, False, False, False, False, True, True])
+        self.assertEqual(parser.title_and_description(), ("OG title", "Card description"))
+        self.assertEqual(
+            poopbot._extract_html_title_and_description("<title>Fallback &amp; title</title>"),
+            ("Fallback & title", None),
+        )
+
+
+class PublicFetchDNSCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        poopbot.ai_dns_cache.clear()
+        poopbot.ai_dns_inflight.clear()
+        for key in poopbot.ai_dns_cache_stats:
+            poopbot.ai_dns_cache_stats[key] = 0
+
+    async def test_resolver_caches_validated_addresses_and_negative_results(self):
+        answers = {
+            "example.com": [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("93.184.216.34", 0))],
+            "rebind.example": [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.5", 0))],
+        }
+
+        async def fake_getaddrinfo(host, port, **kwargs):
+            await asyncio.sleep(0)
+            return answers[host]
+
+        loop = asyncio.get_running_loop()
+        with mock.patch.object(loop, "getaddrinfo", side_effect=fake_getaddrinfo) as getaddrinfo:
+            first, joined = await asyncio.gather(
+                poopbot.resolve_public_fetch_host("example.com"),
+                poopbot.resolve_public_fetch_host("Example.com"),
+            )
+            resolved = await poopbot.PublicFetchResolver().resolve("example.com", 443, socket.AF_UNSPEC)
+            self.assertFalse(await poopbot._is_public_fetch_host("rebind.example"))
+            self.assertFalse(await poopbot._is_public_fetch_host("rebind.example"))
+            with self.assertRaises(OSError):
+                await poopbot.PublicFetchResolver().resolve("rebind.example", 80)
+
+        self.assertEqual(first, ("93.184.216.34",))
+        self.assertEqual(joined, first)
+        self.assertEqual(resolved[0]["host"], "93.184.216.34")
+        self.assertEqual(resolved[0]["hostname"], "example.com")
+        self.assertEqual(getaddrinfo.call_count, 2)
+        self.assertEqual(poopbot.ai_dns_cache_stats["lookups"], 2)
+        self.assertEqual(poopbot.ai_dns_cache_stats["inflight_joins"], 1)
+        self.assertEqual(poopbot.ai_dns_cache_stats["hits"], 1)
+        self.assertEqual(poopbot.ai_dns_cache_stats["negative_hits"], 2)
+
+    async def test_ip_literals_and_local_names_skip_lookup(self):
+        loop = asyncio.get_running_loop()
+        with mock.patch.object(loop, "getaddrinfo") as getaddrinfo:
+            self.assertEqual(await poopbot.resolve_public_fetch_host("8.8.8.8"), ("8.8.8.8",))
+            self.assertIsNone(await poopbot.resolve_public_fetch_host("127.0.0.1"))
+            self.assertIsNone(await poopbot.resolve_public_fetch_host("[::1]"))
+            self.assertIsNone(await poopbot.resolve_public_fetch_host("printer.local"))
+
+        getaddrinfo.assert_not_called()
+
+
+@unittest.skipIf(poopbot.Image is None, "Pillow is not installed")
+class ImagePreprocessingTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.downloads = 0
+        image_buffer = io.BytesIO()
+        poopbot.Image.new("RGBA", (2000, 1000), (200, 40, 40, 128)).save(image_buffer, format="PNG")
+        self.image_bytes = image_buffer.getvalue()
+
+        async def image(request):
+            self.downloads += 1
+            return web.Response(body=self.image_bytes, content_type="image/png")
+
+        app = web.Application()
+        app.router.add_get("/attachments/1/cat.png", image)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        if poopbot.http_session is not None:
+            await poopbot.http_session.close()
+            poopbot.http_session = None
+        await self.runner.cleanup()
+        poopbot.ai_image_cache.clear()
+        poopbot.ai_image_url_hashes.clear()
+        poopbot.ai_image_inflight.clear()
+        for key in poopbot.ai_image_cache_stats:
+            poopbot.ai_image_cache_stats[key] = 0
+
+    async def test_images_are_downloaded_once_downscaled_and_sent_as_data_urls(self):
+        url = f"http://127.0.0.1:{self.port}/attachments/1/cat.png"
+        with mock.patch.object(
+            poopbot,
+            "_is_public_fetch_host",
+            new=mock.AsyncMock(side_effect=lambda hostname: hostname == "127.0.0.1"),
+        ), mock.patch.object(poopbot, "AI_DISCORD_CDN_HOSTS", {"127.0.0.1"}):
+            first = await poopbot.prepare_ai_request_image_urls([f"{url}?ex=1&hm=a"])
+            refreshed = await poopbot.prepare_ai_request_image_urls([f"{url}?ex=2&hm=b"])
+
+        self.assertEqual(self.downloads, 1)
+        self.assertEqual(first, refreshed)
+        self.assertTrue(first[0].startswith("data:image/jpeg;base64,"))
+        prepared = poopbot.get_cached_ai_image(url)
+        self.assertEqual((prepared.width, prepared.height), (poopbot.AI_IMAGE_MAX_DIMENSION, poopbot.AI_IMAGE_MAX_DIMENSION // 2))
+        self.assertEqual(prepared.token_estimate, 255)
+        entry = poopbot.AIContextEntry(author_name="Alice", text="look", image_urls=[url])
+        self.assertEqual(poopbot.estimate_ai_entry_image_tokens(entry), 255)
+        self.assertEqual(poopbot.ai_image_cache_stats["hits"], 1)
+
+    async def test_oversized_and_unreachable_images_are_dropped(self):
+        url = f"http://127.0.0.1:{self.port}/attachments/1/cat.png"
+        with mock.patch.object(
+            poopbot,
+            "_is_public_fetch_host",
+            new=mock.AsyncMock(side_effect=lambda hostname: hostname == "127.0.0.1"),
+        ), mock.patch.object(poopbot, "AI_IMAGE_MAX_DOWNLOAD_BYTES", len(self.image_bytes) - 1):
+            prepared = await poopbot.prepare_ai_request_image_urls([url, f"http://127.0.0.1:{self.port}/missing.png"])
+
+        self.assertEqual(prepared, [])
+        self.assertEqual(poopbot.ai_image_cache_stats["failures"], 2)
+
+    def test_image_cache_evicts_least_recently_used_by_size(self):
+        small = poopbot.AIPreparedImage(data_url="x" * 10, width=1, height=1, token_estimate=255)
+        with mock.patch.object(poopbot, "AI_IMAGE_CACHE_MAX_BYTES", 25):
+            poopbot.remember_ai_image("a", "hash-a", small)
+            poopbot.remember_ai_image("b", "hash-b", small)
+            poopbot.remember_ai_image("a", "hash-a", small)
+            poopbot.remember_ai_image("c", "hash-c", small)
+
+        self.assertEqual(list(poopbot.ai_image_cache), ["hash-a", "hash-c"])
+        self.assertEqual(poopbot.ai_image_cache_stats["cached_bytes"], 20)
+        self.assertEqual(poopbot.ai_image_cache_stats["evictions"], 1)
+        self.assertEqual(
+            poopbot.get_ai_image_cache_key("https://cdn.discordapp.com/attachments/1/2/cat.png?ex=abc&is=def&hm=123"),
+            "https://cdn.discordapp.com/attachments/1/2/cat.png",
+        )
+        self.assertEqual(poopbot.estimate_ai_image_tokens(4000, 1000), 85 + 170 * 4)
+
+
+class AIRequestSchedulerTests(unittest.IsolatedAsyncioTestCase):
+    async def test_scheduler_interleaves_guilds_fairly(self):
+        scheduler = poopbot.AIRequestScheduler(max_concurrency=1, max_queue_depth=10)
+        served = []
+        gate = asyncio.Event()
+
+        def make_request(label):
+            async def _request():
+                served.append(label)
+                if label == "a1":
+                    await gate.wait()
+                return label
+            return _request
+
+        tasks = [asyncio.create_task(scheduler.run(1, make_request("a1")))]
+        await asyncio.sleep(0)
+        for guild_id, label in [(1, "a2"), (1, "a3"), (2, "b1")]:
+            tasks.append(asyncio.create_task(scheduler.run(guild_id, make_request(label))))
+            await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(served, ["a1", "a2", "b1", "a3"])
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_scheduler_rejects_when_queue_is_full_or_wait_is_too_long(self):
+        scheduler = poopbot.AIRequestScheduler(max_concurrency=1, max_queue_depth=1)
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+            return "done"
+
+        running = asyncio.create_task(scheduler.run(1, blocked))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.run(2, blocked, max_wait_seconds=0.05))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(poopbot.AISchedulerBusyError):
+            await scheduler.run(3, blocked)
+        with self.assertRaises(poopbot.AISchedulerBusyError):
+            await queued
+
+        gate.set()
+        self.assertEqual(await running, "done")
+        self.assertEqual(scheduler.rejected, 2)
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_scheduler_returns_a_slot_granted_as_the_wait_times_out(self):
+        scheduler = poopbot.AIRequestScheduler(max_concurrency=1, max_queue_depth=1)
+        await scheduler.acquire(1, max_wait_seconds=1)
+
+        async def granted_then_timed_out(waiter, timeout):
+            scheduler.release()
+            raise asyncio.TimeoutError
+
+        with mock.patch.object(poopbot.asyncio, "wait_for", granted_then_timed_out):
+            with self.assertRaises(poopbot.AISchedulerBusyError):
+                await scheduler.acquire(2, max_wait_seconds=1)
+
+        self.assertEqual(scheduler.active, 0)
+
+
+class AICircuitBreakerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        poopbot.ai_circuit_breaker = poopbot.AICircuitBreaker(
+            poopbot.AI_CIRCUIT_FAILURE_THRESHOLD,
+            poopbot.AI_CIRCUIT_OPEN_SECONDS,
+            poopbot.AI_CIRCUIT_HISTORY_SIZE,
+        )
+        poopbot.ai_reply_cache.clear()
+        poopbot.ai_inflight_replies.clear()
+        poopbot.ai_client = None
+
+    def test_breaker_opens_probes_and_closes(self):
+        breaker = poopbot.AICircuitBreaker(failure_threshold=2, open_seconds=30, history_size=5)
+        request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+        server_error = poopbot.APIError("upstream down", request, body=None)
+        server_error.status_code = 503
+
+        generation, _ = breaker.start_request(now=0)
+        breaker.record_failure(poopbot.APIConnectionError(request=request), generation, now=0)
+        self.assertEqual(breaker.state, "closed")
+        generation, _ = breaker.start_request(now=1)
+        stale_generation, _ = breaker.start_request(now=1)
+        breaker.record_failure(server_error, generation, now=1)
+        self.assertEqual(breaker.state, "open")
+        breaker.record_success(stale_generation)
+        self.assertEqual(breaker.state, "open")
+
+        with self.assertRaises(poopbot.AICircuitOpenError):
+            breaker.start_request(now=10)
+        generation, is_probe = breaker.start_request(now=31)
+        self.assertTrue(is_probe)
+        self.assertEqual(breaker.state, "half_open")
+        breaker.record_failure(server_error, stale_generation, now=31)
+        self.assertEqual(breaker.state, "half_open")
+        with self.assertRaises(poopbot.AICircuitOpenError):
+            breaker.start_request(now=31)
+        breaker.record_failure(server_error, generation, now=32)
+        self.assertEqual(breaker.state, "open")
+
+        generation, is_probe = breaker.start_request(now=63)
+        self.assertTrue(is_probe)
+        breaker.record_success(generation)
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(
+            [(previous, state) for _, previous, state, _ in breaker.transitions],
+            [("closed", "open"), ("open", "half_open"), ("half_open", "open"), ("open", "half_open"), ("half_open", "closed")],
+        )
+        self.assertEqual(breaker.fast_failures, 2)
+
+    def test_breaker_only_treats_openai_rejections_as_answers(self):
+        breaker = poopbot.AICircuitBreaker(failure_threshold=1, open_seconds=30, history_size=5)
+        request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+        generation, _ = breaker.start_request(now=0)
+        breaker.record_failure(poopbot.APIConnectionError(request=request), generation, now=0)
+        generation, is_probe = breaker.start_request(now=31)
+        self.assertTrue(is_probe)
+
+        discord_error = poopbot.discord.HTTPException(mock.Mock(status=429, reason="Too Many Requests"), "slow down")
+        breaker.record_failure(discord_error, generation, now=31)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.probe_in_flight)
+
+        generation, _ = breaker.start_request(now=32)
+        response = httpx.Response(400, request=request)
+        breaker.record_failure(poopbot.APIStatusError("bad request", response=response, body=None), generation, now=32)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_openai_client_uses_short_timeouts_and_few_retries(self):
+        self.addCleanup(setattr, poopbot, "ai_client", None)
+        poopbot.ai_client = None
+        with mock.patch.object(poopbot, "OPENAI_API_KEY", "test-key"):
+            client = poopbot.get_openai_client()
+
+        self.assertEqual(client.max_retries, poopbot.AI_OPENAI_MAX_RETRIES)
+        self.assertEqual(client.timeout.read, poopbot.AI_OPENAI_TIMEOUT_SECONDS)
+        self.assertEqual(client.timeout.connect, poopbot.AI_OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+    async def test_request_ai_reply_fast_fails_once_circuit_opens(self):
+        calls = []
+        request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                raise poopbot.APIConnectionError(request=request)
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        poopbot.ai_circuit_breaker = poopbot.AICircuitBreaker(failure_threshold=2, open_seconds=30, history_size=5)
+
+        for attempt in range(2):
+            with self.assertRaises(poopbot.APIConnectionError):
+                await poopbot.request_ai_reply(f"Alice: attempt {attempt}")
+        with self.assertRaises(poopbot.AICircuitOpenError):
+            await poopbot.request_ai_reply("Alice: attempt 2")
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(poopbot.ai_circuit_breaker.state, "open")
+
+
+class AIHealthProbeTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        poopbot.ai_health_probe_results.clear()
+
+    async def test_health_probe_keeps_rolling_results_and_latency_summary(self):
+        outcomes = [(True, "ok")] * 4 + [(False, "APIConnectionError after 5 ms (down)")]
+        with mock.patch.object(poopbot, "run_ai_smoke_test", new=mock.AsyncMock(side_effect=outcomes)):
+            for _ in outcomes:
+                await poopbot.record_ai_health_probe()
+
+        lines = poopbot.get_ai_health_probe_lines()
+
+        self.assertEqual(len(poopbot.ai_health_probe_results), 5)
+        self.assertIn("last FAIL", lines[0])
+        self.assertIn("1/5 recent failures", lines[0])
+        self.assertIn("p50", lines[1])
+        self.assertIn("<500ms: 4", lines[1])
+        self.assertIn("APIConnectionError after 5 ms (down)", lines[2])
+
+
+class TokenEncoderWarmupTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        poopbot.ai_token_encoder = None
+        poopbot.ai_token_encoder_status.update(state="not_loaded", load_seconds=None, error=None)
+
+    async def test_count_text_tokens_uses_estimate_until_warmup_finishes(self):
+        class FakeEncoder:
+            def encode_ordinary(self, text):
+                return text.split()
+
+        def slow_load():
+            time.sleep(0.05)
+            return FakeEncoder()
+
+        with mock.patch.object(poopbot, "load_token_encoder", side_effect=slow_load):
+            warmup = asyncio.create_task(poopbot.warm_token_encoder())
+            await asyncio.sleep(0)
+            self.assertEqual(poopbot.ai_token_encoder_status["state"], "loading")
+            self.assertEqual(poopbot.count_text_tokens("one two three four five six seven eight"), 10)
+            await warmup
+
+        self.assertEqual(poopbot.ai_token_encoder_status["state"], "ready")
+        self.assertEqual(poopbot.count_text_tokens("one two three four five six seven eight"), 8)
+        self.assertIn("ready (loaded in", poopbot.get_token_encoder_summary())
+
+    async def test_warmup_drops_token_counts_cached_from_the_estimate(self):
+        class FakeEncoder:
+            def encode_ordinary(self, text):
+                return text.split()
+
+        entry = poopbot.AIContextEntry(author_name="Bob", text="one two three four five six seven", message_id=1)
+        self.addCleanup(poopbot.ai_token_count_cache.clear)
+        self.assertEqual(poopbot.count_ai_context_entries_tokens([entry]), [10])
+
+        with mock.patch.object(poopbot, "load_token_encoder", return_value=FakeEncoder()):
+            await poopbot.warm_token_encoder()
+
+        self.assertEqual(poopbot.count_ai_context_entries_tokens([entry]), [8])
+
+    async def test_warm_token_encoder_records_failure_and_keeps_estimate(self):
+        with mock.patch.object(poopbot, "load_token_encoder", side_effect=OSError("offline")):
+            await poopbot.warm_token_encoder()
+
+        self.assertIsNone(poopbot.get_token_encoder())
+        self.assertEqual(poopbot.ai_token_encoder_status["state"], "failed")
+        self.assertIn("offline", poopbot.get_token_encoder_summary())
+
 
 class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
     async def asyncTearDown(self):
-        poopbot.ai_recent_prompt_times.clear()
-        poopbot.ai_user_timeout_until.clear()
+        poopbot.ai_rate_limit_buckets.clear()
+        poopbot.ai_reply_latencies.clear()
+        poopbot.ai_reply_cache.clear()
+        poopbot.ai_inflight_replies.clear()
+        for key in poopbot.ai_dedupe_stats:
+            poopbot.ai_dedupe_stats[key] = 0
+        for key in poopbot.ai_prompt_cache_stats:
+            poopbot.ai_prompt_cache_stats[key] = 0
+        poopbot.ai_output_budget_stats.clear()
+        poopbot.ai_model_tier_stats.clear()
+        poopbot.ai_hedge_stats.clear()
+        poopbot.ai_usage_pending.clear()
         poopbot.ai_client = None
         poopbot.ai_token_encoder = None
 
@@ -225,6 +1472,33 @@ class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(captured["reasoning"], {"effort": poopbot.AI_REASONING_EFFORT})
         self.assertEqual(captured["text"], {"verbosity": poopbot.AI_TEXT_VERBOSITY})
 
+    async def test_request_ai_reply_records_cached_prompt_tokens(self):
+        captured = {}
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                captured.update(kwargs)
+                return types.SimpleNamespace(
+                    output_text="Cached answer",
+                    status="completed",
+                    output=[],
+                    usage=types.SimpleNamespace(
+                        input_tokens=2000,
+                        input_tokens_details=types.SimpleNamespace(cached_tokens=1536),
+                    ),
+                )
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+
+        reply = await poopbot.request_ai_reply("Alice: hi", prompt_cache_key="poopbot-channel-1")
+
+        self.assertEqual(reply, "Cached answer")
+        self.assertEqual(captured["extra_body"], {"prompt_cache_key": "poopbot-channel-1"})
+        self.assertIs(poopbot.get_ai_system_prompt(), poopbot.get_ai_system_prompt())
+        self.assertEqual(poopbot.ai_prompt_cache_stats["cached_tokens"], 1536)
+        self.assertEqual(poopbot.ai_prompt_cache_stats["hit_requests"], 1)
+        self.assertTrue(poopbot.get_ai_prompt_cache_summary().startswith("77% of 2000 input tokens cached"))
+
     async def test_request_ai_reply_retries_when_first_response_hits_max_output_tokens(self):
         calls = []
 
@@ -247,6 +1521,408 @@ class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(reply, "Retried answer")
         self.assertEqual(calls[0]["max_output_tokens"], poopbot.AI_MAX_OUTPUT_TOKENS)
         self.assertEqual(calls[1]["max_output_tokens"], poopbot.AI_RETRY_MAX_OUTPUT_TOKENS)
+        self.assertEqual(poopbot.get_ai_output_budget_stats(poopbot.OPENAI_MODEL).retries, 1)
+
+    async def test_request_ai_reply_sizes_first_attempt_from_observed_usage(self):
+        calls = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                return types.SimpleNamespace(
+                    output_text="Long answer",
+                    status="completed",
+                    output=[],
+                    usage=types.SimpleNamespace(
+                        output_tokens=300,
+                        output_tokens_details=types.SimpleNamespace(reasoning_tokens=200),
+                    ),
+                )
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        stats = poopbot.get_ai_output_budget_stats(poopbot.OPENAI_MODEL)
+        stats.record_retry(2.0)
+        for _ in range(poopbot.AI_OUTPUT_BUDGET_MIN_SAMPLES):
+            stats.output_tokens.append(300)
+            stats.reasoning_tokens.append(200)
+
+        await poopbot.request_ai_reply("Alice: explain it all")
+
+        self.assertEqual(calls[0]["max_output_tokens"], math.ceil(300 * poopbot.AI_OUTPUT_BUDGET_HEADROOM))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(stats.avoided_retries, 1)
+        self.assertIn("1 retries avoided (~2.0s saved)", poopbot.get_ai_output_budget_summary())
+
+    def test_output_budget_samples_truncated_replies_above_their_budget(self):
+        stats = poopbot.AIOutputBudgetStats(history_size=10)
+        truncated = types.SimpleNamespace(
+            status="incomplete",
+            incomplete_details=types.SimpleNamespace(reason="max_output_tokens"),
+            usage=types.SimpleNamespace(output_tokens=400),
+        )
+        filtered = types.SimpleNamespace(
+            status="incomplete",
+            incomplete_details=types.SimpleNamespace(reason="content_filter"),
+            usage=types.SimpleNamespace(output_tokens=50),
+        )
+
+        stats.record_result(truncated, initial_budget=500, retried=False)
+        stats.record_result(truncated, initial_budget=500, retried=True)
+        stats.record_result(filtered, initial_budget=500, retried=False)
+
+        self.assertEqual(list(stats.output_tokens), [501, poopbot.AI_RETRY_MAX_OUTPUT_TOKENS + 1])
+        self.assertEqual(stats.first_attempts, 3)
+        self.assertEqual(stats.avoided_retries, 0)
+
+    async def test_request_tiered_ai_reply_routes_small_prompts_to_fast_model(self):
+        captured = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                captured.append(kwargs)
+                return types.SimpleNamespace(output_text="Routed answer", status="completed", output=[])
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        self.assertEqual([tier["name"] for tier in poopbot.AI_MODEL_TIERS], ["default"])
+        tiers = [
+            {"name": "fast", "model": "fast-model", "max_prompt_tokens": 1000, "max_images": 0, "max_previews": 0},
+            {"name": "default", "model": poopbot.OPENAI_MODEL},
+        ]
+        with mock.patch.object(poopbot, "AI_MODEL_TIERS", tiers):
+            small = poopbot.select_ai_model_tier(50, 0, 0)
+            large = poopbot.select_ai_model_tier(5000, 0, 0)
+            with_image = poopbot.select_ai_model_tier(50, 1, 0)
+            with_preview = poopbot.select_ai_model_tier(50, 0, 1)
+            reply = await poopbot.request_tiered_ai_reply(small, 50, 0, "Alice: hi")
+            tier_summary = poopbot.get_ai_model_tier_summary()
+
+        self.assertEqual(reply, "Routed answer")
+        self.assertEqual(small["model"], "fast-model")
+        self.assertEqual(large["model"], poopbot.OPENAI_MODEL)
+        self.assertEqual(with_image["model"], poopbot.OPENAI_MODEL)
+        self.assertEqual(with_preview["model"], poopbot.OPENAI_MODEL)
+        self.assertEqual(captured[0]["model"], "fast-model")
+        self.assertEqual(poopbot.ai_model_tier_stats["fast"]["requests"], 1)
+        self.assertIn("fast (`fast-model`)", tier_summary)
+
+    async def test_routing_measures_the_sent_prompt_and_counts_attached_previews(self):
+        entry = poopbot.AIContextEntry(author_name="Bob", text="see https://example.com", link_urls=["https://example.com"])
+        attached = await poopbot.attach_ai_link_previews(
+            entry, {"https://example.com": "[Link preview] Example"}, {"used": 0}
+        )
+        quoted = poopbot.AIContextEntry(author_name="Alice", text="[Link preview] pasted by hand")
+        prompt = poopbot.build_ai_conversation_prompt([attached], quoted, "earlier summary")
+
+        self.assertEqual(poopbot.count_ai_link_previews([attached, quoted]), 1)
+        self.assertEqual(
+            poopbot.count_ai_request_prompt_tokens(prompt),
+            poopbot.count_text_tokens(poopbot.get_ai_system_prompt()) + poopbot.count_text_tokens(prompt),
+        )
+
+    async def test_request_ai_reply_hedges_slow_requests_and_cancels_the_loser(self):
+        calls = []
+        cancelled = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                attempt = len(calls)
+                try:
+                    await asyncio.sleep(1 if attempt == 1 else 0)
+                except asyncio.CancelledError:
+                    cancelled.append(attempt)
+                    raise
+                return types.SimpleNamespace(output_text=f"Answer {attempt}", status="completed", output=[])
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        stats = poopbot.get_ai_hedge_stats(poopbot.OPENAI_MODEL, False)
+        stats.latencies.extend([0.01] * poopbot.AI_HEDGE_MIN_SAMPLES)
+
+        with mock.patch.object(poopbot, "AI_HEDGE_REQUESTS", True):
+            reply = await poopbot.request_ai_reply("Alice: hi")
+            await asyncio.sleep(0)
+
+        self.assertEqual(reply, "Answer 2")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cancelled, [1])
+        self.assertEqual((stats.hedges, stats.hedge_wins, stats.hedge_losses), (1, 1, 0))
+
+    async def test_hedge_needs_a_free_scheduler_slot(self):
+        calls = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                await asyncio.sleep(0.05)
+                return types.SimpleNamespace(output_text="Slow answer", status="completed", output=[])
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        stats = poopbot.get_ai_hedge_stats(poopbot.OPENAI_MODEL, False)
+        stats.latencies.extend([0.01] * poopbot.AI_HEDGE_MIN_SAMPLES)
+        scheduler = poopbot.AIRequestScheduler(max_concurrency=1, max_queue_depth=4)
+
+        with mock.patch.object(poopbot, "AI_HEDGE_REQUESTS", True), mock.patch.object(
+            poopbot, "ai_request_scheduler", scheduler
+        ):
+            reply = await poopbot.request_ai_reply("Alice: hi")
+
+        self.assertEqual(reply, "Slow answer")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((stats.hedges, stats.busy), (0, 1))
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_hedged_loser_usage_is_recorded(self):
+        calls = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                if len(calls) == 1:
+                    await asyncio.sleep(1)
+                return types.SimpleNamespace(
+                    output_text="Answer",
+                    status="completed",
+                    output=[],
+                    usage=types.SimpleNamespace(
+                        input_tokens=100,
+                        output_tokens=10,
+                        input_tokens_details=types.SimpleNamespace(cached_tokens=40),
+                    ),
+                )
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        stats = poopbot.get_ai_hedge_stats(poopbot.OPENAI_MODEL, False)
+        stats.latencies.extend([0.01] * poopbot.AI_HEDGE_MIN_SAMPLES)
+        usage_record = poopbot.AIUsageRecord(
+            kind="mention", guild_id=1, channel_id=2, user_id=3, model=poopbot.OPENAI_MODEL
+        )
+
+        with mock.patch.object(poopbot, "AI_HEDGE_REQUESTS", True):
+            await poopbot.request_ai_reply("Alice: hi", usage_record=usage_record)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(
+            (usage_record.input_tokens, usage_record.cached_tokens, usage_record.output_tokens), (200, 80, 10)
+        )
+        self.assertEqual(poopbot.ai_request_scheduler.active, 0)
+
+    async def test_request_ai_reply_caps_the_hedge_rate(self):
+        calls = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                await asyncio.sleep(0.05)
+                return types.SimpleNamespace(output_text="Slow answer", status="completed", output=[])
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        stats = poopbot.get_ai_hedge_stats(poopbot.OPENAI_MODEL, False)
+        stats.latencies.extend([0.01] * poopbot.AI_HEDGE_MIN_SAMPLES)
+        stats.recent_hedges.extend([True, False, False])
+
+        with mock.patch.object(poopbot, "AI_HEDGE_REQUESTS", True):
+            reply = await poopbot.request_ai_reply("Alice: hi")
+
+        self.assertEqual(reply, "Slow answer")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((stats.hedges, stats.capped), (0, 1))
+
+    async def test_request_ai_reply_streams_partial_text_and_returns_final_reply(self):
+        captured = {}
+
+        async def fake_stream():
+            for delta in ["Hel", "lo ", "there"]:
+                yield types.SimpleNamespace(type="response.output_text.delta", delta=delta)
+            yield types.SimpleNamespace(
+                type="response.completed",
+                response=types.SimpleNamespace(output_text="Hello there", status="completed", output=[]),
+            )
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                captured.update(kwargs)
+                return fake_stream()
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        partials = []
+
+        async def on_partial_text(text):
+            partials.append(text)
+
+        reply = await poopbot.request_ai_reply("Alice: hi", on_partial_text=on_partial_text)
+
+        self.assertEqual(reply, "Hello there")
+        self.assertTrue(captured["stream"])
+        self.assertEqual(partials, ["Hel", "Hello", "Hello there"])
+
+    async def test_handle_ai_mention_streams_into_one_message_with_throttled_edits(self):
+        async def fake_stream():
+            for delta in ["first", " second", " third"]:
+                yield types.SimpleNamespace(type="response.output_text.delta", delta=delta)
+            yield types.SimpleNamespace(
+                type="response.completed",
+                response=types.SimpleNamespace(output_text="first second third", status="completed", output=[]),
+            )
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                return fake_stream()
+
+        class FakeTyping:
+            async def __aenter__(self):
+                return None
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+        class FakeSentMessage:
+            def __init__(self, text):
+                self.edits = []
+                self.text = text
+
+            async def edit(self, content, **kwargs):
+                self.edits.append(content)
+
+        class FakeChannel:
+            id = 999
+
+            def __init__(self):
+                self.sent_messages = []
+
+            def typing(self):
+                return FakeTyping()
+
+            async def send(self, text, **kwargs):
+                sent = FakeSentMessage(text)
+                self.sent_messages.append(sent)
+                return sent
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        message = types.SimpleNamespace(
+            content="<@123> hello there",
+            author=types.SimpleNamespace(id=1, display_name="Alice"),
+            channel=FakeChannel(),
+        )
+
+        with mock.patch.object(
+            poopbot,
+            "fetch_ai_mention_context_entries",
+            new=mock.AsyncMock(
+                return_value=([], [poopbot.AIContextEntry(author_name="Alice", text="hello there", image_urls=[])]),
+            ),
+        ):
+            handled = await poopbot.handle_ai_mention(message, 123)
+
+        self.assertTrue(handled)
+        self.assertEqual(len(message.channel.sent_messages), 1)
+        sent = message.channel.sent_messages[0]
+        self.assertEqual(sent.text, "first")
+        self.assertEqual(sent.edits, ["first second third"])
+        first_text_seconds, total_seconds = poopbot.ai_reply_latencies[-1]
+        self.assertLessEqual(first_text_seconds, total_seconds)
+
+    async def test_reply_message_stops_streaming_on_discord_errors_and_finish_delivers(self):
+        rate_limited = poopbot.discord.HTTPException(mock.Mock(status=429, reason="Too Many Requests"), "slow down")
+        deleted = poopbot.discord.NotFound(mock.Mock(status=404, reason="Not Found"), "Unknown Message")
+        first_reply = mock.Mock(edit=mock.AsyncMock(side_effect=[rate_limited, deleted]))
+        final_reply = mock.Mock()
+        channel = types.SimpleNamespace(id=999, send=mock.AsyncMock(side_effect=[first_reply, final_reply]))
+        reply = poopbot.AIReplyMessage(types.SimpleNamespace(channel=channel), time.perf_counter())
+
+        with mock.patch.object(poopbot, "AI_STREAM_EDIT_INTERVAL_SECONDS", 0), mock.patch("builtins.print"):
+            await reply.update("Hel")
+            await reply.update("Hello")
+            await reply.update("Hello there")
+            await reply.finish("Hello there!")
+
+        self.assertFalse(reply.streaming)
+        self.assertEqual(first_reply.edit.await_count, 2)
+        self.assertEqual([call.args[0] for call in channel.send.await_args_list], ["Hel", "Hello there!"])
+        self.assertIs(reply.sent_message, final_reply)
+
+    async def test_request_ai_reply_shares_inflight_request_and_caches_reply(self):
+        calls = []
+        release = asyncio.Event()
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                await release.wait()
+                return types.SimpleNamespace(output_text="Same answer", status="completed", output=[])
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+
+        first = asyncio.create_task(poopbot.request_ai_reply("Alice: lol", image_urls=["https://cdn.example.com/a.png"]))
+        second = asyncio.create_task(poopbot.request_ai_reply("Alice: lol", image_urls=["https://cdn.example.com/a.png"]))
+        await asyncio.sleep(0)
+        release.set()
+        replies = await asyncio.gather(first, second)
+        cached = await poopbot.request_ai_reply("Alice: lol", image_urls=["https://cdn.example.com/a.png"])
+        other = await poopbot.request_ai_reply("Alice: lol")
+
+        self.assertEqual(replies, ["Same answer", "Same answer"])
+        self.assertEqual(cached, "Same answer")
+        self.assertEqual(other, "Same answer")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(poopbot.ai_dedupe_stats, {"cache_hits": 1, "inflight_joins": 1, "requests": 2})
+        self.assertEqual(poopbot.ai_inflight_replies, {})
+
+    async def test_same_question_from_different_askers_shares_one_streamed_request(self):
+        calls = []
+        release = asyncio.Event()
+
+        async def fake_stream():
+            yield types.SimpleNamespace(type="response.output_text.delta", delta="lol")
+            await release.wait()
+            yield types.SimpleNamespace(type="response.output_text.delta", delta=" same")
+            yield types.SimpleNamespace(
+                type="response.completed",
+                response=types.SimpleNamespace(output_text="lol same", status="completed", output=[]),
+            )
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                return fake_stream()
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        alice_partials, bob_partials = [], []
+
+        async def alice_partial(text):
+            alice_partials.append(text)
+
+        async def bob_partial(text):
+            bob_partials.append(text)
+
+        alice_entry = poopbot.AIContextEntry(author_name="Alice", text="<@123> tell  me a JOKE")
+        bob_entry = poopbot.AIContextEntry(author_name="Bob", text="<@123> tell me a joke")
+        first = asyncio.create_task(
+            poopbot.request_ai_reply(
+                "Alice: tell me a joke",
+                on_partial_text=alice_partial,
+                dedupe_text=poopbot.build_ai_dedupe_text(1, [alice_entry]),
+            )
+        )
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(
+            poopbot.request_ai_reply(
+                "Alice: tell me a joke\nBob: tell me a joke",
+                on_partial_text=bob_partial,
+                dedupe_text=poopbot.build_ai_dedupe_text(1, [bob_entry]),
+            )
+        )
+        await asyncio.sleep(0)
+        release.set()
+        replies = await asyncio.gather(first, second)
+
+        self.assertEqual(replies, ["lol same", "lol same"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(alice_partials, ["lol", "lol same"])
+        self.assertEqual(bob_partials, ["lol same"])
+        self.assertNotEqual(
+            poopbot.build_ai_dedupe_text(1, [alice_entry]), poopbot.build_ai_dedupe_text(2, [alice_entry])
+        )
+        self.assertEqual(poopbot.ai_inflight_partial_callbacks, {})
 
     async def test_run_ai_smoke_test_reports_success(self):
         captured = {}
@@ -318,11 +1994,11 @@ class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
 
         with mock.patch.object(
             poopbot,
-            "fetch_ai_context_entries",
+            "fetch_ai_mention_context_entries",
             new=mock.AsyncMock(
                 return_value=(
                     [],
-                    poopbot.AIContextEntry(author_name="Alice", text="hello there", image_urls=[]),
+                    [poopbot.AIContextEntry(author_name="Alice", text="hello there", image_urls=[])],
                 )
             ),
         ):
@@ -331,6 +2007,79 @@ class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
         self.assertTrue(handled)
         self.assertEqual(message.channel.sent_messages[0][0], poopbot.AI_ERROR_MESSAGE)
 
+    async def test_handle_ai_mention_coalesces_burst_into_one_request(self):
+        captured = []
+
+        class FakeResponses:
+            async def create(self, **kwargs):
+                captured.append(kwargs)
+                return types.SimpleNamespace(output_text="Answers for both", status="completed", output=[])
+
+        class FakeTyping:
+            async def __aenter__(self):
+                return None
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+        class FakeChannel:
+            id = 999
+
+            def __init__(self):
+                self.sent_messages = []
+
+            def typing(self):
+                return FakeTyping()
+
+            async def send(self, text, **kwargs):
+                self.sent_messages.append((text, kwargs))
+
+        channel = FakeChannel()
+
+        def make_message(user_id, name, content):
+            return types.SimpleNamespace(
+                content=content,
+                attachments=[],
+                embeds=[],
+                webhook_id=None,
+                author=types.SimpleNamespace(id=user_id, display_name=name),
+                channel=channel,
+            )
+
+        poopbot.ai_client = types.SimpleNamespace(responses=FakeResponses())
+        first = make_message(1, "Alice", "<@123> who won")
+        second = make_message(2, "Bob", "<@123> and why")
+
+        with mock.patch.object(poopbot, "AI_COALESCE_MENTIONS", True), mock.patch.object(
+            poopbot,
+            "AI_COALESCE_WINDOW_SECONDS",
+            0.05,
+        ), mock.patch.object(poopbot, "AI_STREAM_REPLIES", False), mock.patch.object(
+            poopbot,
+            "fetch_ai_mention_context_entries",
+            new=mock.AsyncMock(
+                return_value=(
+                    [],
+                    [
+                        poopbot.AIContextEntry(author_name="Alice", text="who won", image_urls=[]),
+                        poopbot.AIContextEntry(author_name="Bob", text="and why", image_urls=[]),
+                    ],
+                ),
+            ),
+        ):
+            results = await asyncio.gather(
+                poopbot.handle_ai_mention(first, 123),
+                poopbot.handle_ai_mention(second, 123),
+            )
+
+        self.assertEqual(results, [True, True])
+        self.assertEqual(len(captured), 1)
+        prompt_text = captured[0]["input"][0]["content"][0]["text"]
+        self.assertIn("Alice: who won", prompt_text)
+        self.assertIn("Bob: and why", prompt_text)
+        self.assertEqual([text for text, _ in channel.sent_messages], ["Answers for both"])
+        self.assertIn(2, poopbot.ai_rate_limit_buckets)
+
     async def test_handle_ai_mention_reset_acknowledges_without_calling_api(self):
         class FakeChannel:
             id = 999
@@ -345,6 +2094,7 @@ class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
                 self.sent_messages.append((text, kwargs))
 
         message = types.SimpleNamespace(
+            id=42,
             content="<@123> reset",
             author=types.SimpleNamespace(id=1, display_name="Alice"),
             channel=FakeChannel(),
@@ -352,18 +2102,23 @@ class RequestAIReplyTests(unittest.IsolatedAsyncioTestCase):
 
         with mock.patch.object(
             poopbot,
-            "fetch_ai_context_entries",
+            "fetch_ai_mention_context_entries",
             new=mock.AsyncMock(),
         ) as fetch_mock, mock.patch.object(
             poopbot,
             "request_ai_reply",
             new=mock.AsyncMock(),
-        ) as request_mock:
+        ) as request_mock, mock.patch.object(
+            poopbot,
+            "record_ai_channel_reset",
+            new=mock.AsyncMock(),
+        ) as reset_mock:
             handled = await poopbot.handle_ai_mention(message, 123)
 
         self.assertTrue(handled)
         self.assertEqual(message.channel.sent_messages[0][0], poopbot.AI_RESET_MESSAGE)
-        self.assertNotIn(1, poopbot.ai_recent_prompt_times)
+        self.assertNotIn(1, poopbot.ai_rate_limit_buckets)
+        reset_mock.assert_awaited_once_with(999, 42)
         fetch_mock.assert_not_awaited()
         request_mock.assert_not_awaited()
 